@@ -0,0 +1,92 @@
+import argparse
+import time
+from typing import NamedTuple, Callable
+
+import pyarrow as pa
+
+from src.models.columnar import ColumnarBuilder
+from src.models.enums import CourseType
+from src.models.named_tuples import Curriculum, Course
+from src.schemas.course_schema import COURSE_SCHEMA
+from src.schemas.curriculum_fact_schema import CURRICULUM_FACT_SCHEMA
+from src.schemas.curriculum_schema import CURRICULUM_SCHEMA
+
+
+def generate_curricula(number_of_rows: int) -> list[Curriculum]:
+    return [
+        Curriculum(
+            study_program_name=f"Студиска програма {index % 20}",
+            study_program_duration=4,
+            study_program_url=f"https://finki.ukim.mk/program/{index % 20}/mk",
+            study_program_id=index % 20,
+            course_code=f"F23L{1 + index % 3}{'SW'[index % 2]}{index % 1000:03d}",
+            course_name_mk=f"Предмет {index}",
+            course_url=f"https://finki.ukim.mk/subject/F23L{1 + index % 3}{'SW'[index % 2]}{index % 1000:03d}",
+            course_semester=1 + index % 8,
+            course_type=CourseType.from_bool(index % 3 == 0),
+            source='default',
+        )
+        for index in range(number_of_rows)
+    ]
+
+
+def generate_courses(number_of_rows: int) -> list[Course]:
+    return [
+        Course(
+            course_code=f"F23L{1 + index % 3}{'SW'[index % 2]}{index:03d}",
+            course_name_mk=f"Предмет {index}",
+            course_url=f"https://finki.ukim.mk/subject/F23L{1 + index % 3}{'SW'[index % 2]}{index:03d}",
+            course_name_en=f"Course {index}",
+            course_professors="проф. д-р Име Презиме, вонр. проф. д-р Име Презиме",
+            course_prerequisites="Нема",
+            course_competence="Компетенции " * 40,
+            course_content="Содржина " * 120,
+            source='default',
+        )
+        for index in range(number_of_rows)
+    ]
+
+
+def convert_with_pylist(rows: list[NamedTuple], arrow_schema: pa.Schema, dictionary_columns: tuple[str, ...]) -> pa.Table:
+    return pa.Table.from_pylist([row._asdict() for row in rows], schema=arrow_schema)
+
+
+def convert_with_builder(rows: list[NamedTuple], arrow_schema: pa.Schema, dictionary_columns: tuple[str, ...]) -> pa.Table:
+    builder: ColumnarBuilder = ColumnarBuilder(arrow_schema, dictionary_columns)
+    for row in rows:
+        builder.append(row)
+    return pa.Table.from_batches([builder.to_record_batch()]).cast(arrow_schema)
+
+
+def measure(convert: Callable[..., pa.Table], rows: list[NamedTuple], arrow_schema: pa.Schema,
+            dictionary_columns: tuple[str, ...], repeats: int) -> tuple[float, int]:
+    timings: list[float] = []
+    table: pa.Table | None = None
+    for _ in range(repeats):
+        start: float = time.perf_counter()
+        table = convert(rows, arrow_schema, dictionary_columns)
+        timings.append(time.perf_counter() - start)
+    return min(timings), table.nbytes
+
+
+def main() -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Compare NamedTuple to Arrow conversion paths")
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeats', type=int, default=5)
+    arguments: argparse.Namespace = parser.parse_args()
+
+    datasets: list[tuple[str, list[NamedTuple], pa.Schema, tuple[str, ...]]] = [
+        ('curricula', generate_curricula(arguments.rows), CURRICULUM_SCHEMA.as_arrow(),
+         ('study_program_name', 'study_program_url', 'course_type')),
+        ('facts', generate_curricula(arguments.rows), CURRICULUM_FACT_SCHEMA.as_arrow(), ('course_type',)),
+        ('courses', generate_courses(arguments.rows), COURSE_SCHEMA.as_arrow(), ()),
+    ]
+    print(f"{'dataset':<10} {'method':<10} {'seconds':>10} {'rows/sec':>14} {'arrow MiB':>10}")
+    for name, rows, arrow_schema, dictionary_columns in datasets:
+        for method, convert in (('pylist', convert_with_pylist), ('builder', convert_with_builder)):
+            seconds, nbytes = measure(convert, rows, arrow_schema, dictionary_columns, arguments.repeats)
+            print(f"{name:<10} {method:<10} {seconds:>10.4f} {len(rows) / seconds:>14,.0f} {nbytes / 2 ** 20:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
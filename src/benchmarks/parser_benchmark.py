@@ -0,0 +1,120 @@
+import argparse
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import NamedTuple, Callable
+
+from src.benchmarks.synthetic_pages import study_programs_page, curriculum_page, course_page, course_code, program_course_indices
+from src.configurations import ApplicationConfiguration, SOURCES
+from src.models.named_tuples import StudyProgram, CourseHeader
+from src.parsers.base_parser import Parser, ParserBackend, BeautifulSoupBackend, LxmlBackend
+from src.parsers.course_parser import CourseParser
+from src.parsers.curriculum_parser import CurriculumParser
+from src.parsers.study_program_parser import StudyProgramParser
+
+PageCase = tuple[bytes, dict]
+ParseFunction = Callable[[Parser, bytes, dict], list[NamedTuple]]
+
+
+def parse_study_programs(parser: Parser, page_content: bytes, kwargs: dict) -> list[NamedTuple]:
+    return parser.parse_data(document=parser.get_parsed_html(page_content))
+
+
+def parse_curriculum(parser: Parser, page_content: bytes, kwargs: dict) -> list[NamedTuple]:
+    return parser.parse_data(page_content=page_content, **kwargs)
+
+
+def parse_course(parser: Parser, page_content: bytes, kwargs: dict) -> list[NamedTuple]:
+    return [parser.parse_data(page_content=page_content, **kwargs)]
+
+
+def generate_pages(number_of_programs: int, number_of_courses: int) -> dict[str, list[PageCase]]:
+    return {
+        'study_programs': [(study_programs_page(number_of_programs).encode(), {})],
+        'curricula': [
+            (curriculum_page(index, program_course_indices(index, number_of_courses, 40)).encode(),
+             {'study_program': StudyProgram(f"Студиска програма {index}", 4, f"{ApplicationConfiguration.BASE_URL}/program/{index}/mk", index,
+                                           SOURCES[0].name)})
+            for index in range(number_of_programs)
+        ],
+        'courses': [
+            (course_page(index).encode(),
+             {'course_header': CourseHeader(course_code(index), f"Предмет {index}",
+                                            f"{ApplicationConfiguration.BASE_URL}/subject/{course_code(index)}", SOURCES[0].name)})
+            for index in range(number_of_courses)
+        ],
+    }
+
+
+def load_cached_pages(file_path: Path) -> dict[str, list[PageCase]]:
+    pages: dict[str, list[PageCase]] = {'study_programs': [], 'curricula': [], 'courses': []}
+    with sqlite3.connect(file_path) as connection:
+        for url, body in connection.execute('SELECT url, body FROM responses'):
+            if url == ApplicationConfiguration.STUDY_PROGRAMS_URL:
+                pages['study_programs'].append((body, {}))
+            elif '/program/' in url:
+                pages['curricula'].append((body, {'study_program': StudyProgram('', 0, url, 0, SOURCES[0].name)}))
+            elif '/subject/' in url:
+                pages['courses'].append((body, {'course_header': CourseHeader(url.rstrip('/').split('/')[-1], '', url, SOURCES[0].name)}))
+    return pages
+
+
+def create_parsers(parser_class: type[Parser], backends: list[tuple[str, ParserBackend]]) -> list[tuple[str, Parser]]:
+    if parser_class is not CourseParser:
+        return [(backend_name, parser_class(backend)) for backend_name, backend in backends]
+    return [(f"{backend_name}{'-partial' if partial_parsing else ''}", CourseParser(backend, partial_parsing=partial_parsing))
+            for partial_parsing in (False, True) for backend_name, backend in backends]
+
+
+def measure(parser: Parser, parse: ParseFunction, cases: list[PageCase], repeats: int) -> tuple[float, list[NamedTuple]]:
+    timings: list[float] = []
+    rows: list[NamedTuple] = []
+    for _ in range(repeats):
+        start: float = time.perf_counter()
+        rows = [row for page_content, kwargs in cases for row in parse(parser, page_content, kwargs)]
+        timings.append(time.perf_counter() - start)
+    return min(timings), rows
+
+
+def main() -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Check parser backend parity and compare their throughput")
+    parser.add_argument('--programs', type=int, default=20)
+    parser.add_argument('--courses', type=int, default=300)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--cache-file', type=Path, help="Use the pages stored in an HTTP response cache instead of synthetic ones")
+    arguments: argparse.Namespace = parser.parse_args()
+
+    pages: dict[str, list[PageCase]] = load_cached_pages(arguments.cache_file) if arguments.cache_file \
+        else generate_pages(arguments.programs, arguments.courses)
+    datasets: list[tuple[str, type[Parser], ParseFunction]] = [
+        ('study_programs', StudyProgramParser, parse_study_programs),
+        ('curricula', CurriculumParser, parse_curriculum),
+        ('courses', CourseParser, parse_course),
+    ]
+    backends: list[tuple[str, ParserBackend]] = [('bs4', BeautifulSoupBackend()), ('lxml', LxmlBackend())]
+
+    mismatches: int = 0
+    print(f"{'dataset':<15} {'backend':<13} {'pages':>6} {'rows':>7} {'seconds':>10} {'pages/sec':>10} {'parity':>7}")
+    for name, parser_class, parse in datasets:
+        cases: list[PageCase] = pages[name]
+        if not cases:
+            continue
+        expected_rows: list[NamedTuple] | None = None
+        for backend_name, parser_instance in create_parsers(parser_class, backends):
+            seconds, rows = measure(parser_instance, parse, cases, arguments.repeats)
+            parity: bool = expected_rows is None or rows == expected_rows
+            if not parity:
+                mismatches += 1
+                for expected_row, row in zip(expected_rows, rows):
+                    if expected_row != row:
+                        print(f"  expected {expected_row}\n  got      {row}", file=sys.stderr)
+                        break
+            expected_rows = expected_rows or rows
+            print(f"{name:<15} {backend_name:<13} {len(cases):>6} {len(rows):>7} {seconds:>10.4f} "
+                  f"{len(cases) / seconds:>10,.0f} {'ok' if parity else 'FAIL':>7}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
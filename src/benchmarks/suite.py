@@ -0,0 +1,315 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Any
+
+Result = dict[str, Any]
+
+
+def configure_environment(work_directory: Path, **overrides: str) -> None:
+    # Benchmarks run against a throwaway SQL catalog and filesystem warehouse, so no .env is needed
+    warehouse: Path = work_directory / 'warehouse'
+    warehouse.mkdir(parents=True, exist_ok=True)
+    os.environ.update({
+        'FILE_IO_TYPE': 'local',
+        'LOCAL_ICEBERG_LAKEHOUSE_FILE_PATH': str(warehouse),
+        'ICEBERG_CATALOG_NAME': 'benchmark',
+        'ICEBERG_NAMESPACE': 'benchmark',
+        'PYICEBERG_CATALOG__BENCHMARK__TYPE': 'sql',
+        'PYICEBERG_CATALOG__BENCHMARK__URI': f"sqlite:///{work_directory / 'catalog.sqlite3'}",
+        'PYICEBERG_CATALOG__BENCHMARK__WAREHOUSE': warehouse.as_uri(),
+        'NUMBER_OF_THREADS': '-1',
+        'REQUESTS_TIMEOUT_SECONDS': '30',
+        'REQUEST_RETRY_COUNT': '3',
+        'REQUESTS_RETRY_DELAY_SECONDS': '1',
+        'HTTP_CACHE_MODE': 'disabled',
+        'SKIP_UNCHANGED_PAGES': 'false',
+        **overrides,
+    })
+
+
+def percentile(values: list[float], quantile: float) -> float:
+    if not values:
+        return 0.0
+    ordered: list[float] = sorted(values)
+    return ordered[min(len(ordered) - 1, round(quantile * (len(ordered) - 1)))]
+
+
+def summarize(name: str, seconds: float, latencies: list[float], pages: int = 0, rows: int = 0, **extra: Any) -> Result:
+    return {
+        'name': name,
+        'seconds': round(seconds, 4),
+        'pages': pages,
+        'rows': rows,
+        'pages_per_sec': round(pages / seconds, 1) if pages and seconds else None,
+        'rows_per_sec': round(rows / seconds, 1) if rows and seconds else None,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        **extra,
+    }
+
+
+def peak_rss_mib() -> float:
+    # ru_maxrss is reported in KiB on Linux and in bytes on macOS
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+def benchmark_parse(work_directory: Path, arguments: dict) -> list[Result]:
+    configure_environment(work_directory)
+    from src.benchmarks.parser_benchmark import generate_pages, parse_study_programs, parse_curriculum, parse_course
+    from src.parsers.course_parser import CourseParser
+    from src.parsers.curriculum_parser import CurriculumParser
+    from src.parsers.study_program_parser import StudyProgramParser
+
+    pages = generate_pages(arguments['programs'], arguments['courses'])
+    results: list[Result] = []
+    for name, parser, parse in (('parse.study_programs', StudyProgramParser(), parse_study_programs),
+                                ('parse.curricula', CurriculumParser(), parse_curriculum),
+                                ('parse.courses', CourseParser(), parse_course)):
+        latencies: list[float] = []
+        rows: int = 0
+        start: float = time.perf_counter()
+        for page_content, kwargs in pages[name.split('.')[1]]:
+            page_start: float = time.perf_counter()
+            rows += len(parse(parser, page_content, kwargs))
+            latencies.append(time.perf_counter() - page_start)
+        results.append(summarize(name, time.perf_counter() - start, latencies, pages=len(latencies), rows=rows))
+    return results
+
+
+def benchmark_corrector(work_directory: Path, arguments: dict) -> list[Result]:
+    configure_environment(work_directory)
+    from src.benchmarks.synthetic_pages import course_code
+    from src.corrector import CourseCorrector
+
+    names: list[str] = [f"{course_code(index)} Course {index}" if index % 7 == 0 else f"Course {index}"
+                        for index in range(arguments['corrections'])]
+    latencies: list[float] = []
+    start: float = time.perf_counter()
+    for name in names:
+        call_start: float = time.perf_counter()
+        CourseCorrector.correct({'course_name_en': name, 'course_professors': '', 'course_prerequisites': ''})
+        latencies.append(time.perf_counter() - call_start)
+    return [summarize('corrector.correct', time.perf_counter() - start, latencies, rows=len(names))]
+
+
+def benchmark_save_data(work_directory: Path, arguments: dict) -> list[Result]:
+    configure_environment(work_directory)
+    from src.benchmarks.columnar_benchmark import generate_courses
+    from src.configurations import TableConfiguration, StorageConfiguration
+    from src.models.enums import WriteMode
+    from src.schemas.course_schema import COURSE_SCHEMA
+    from src.storage import IcebergClient
+
+    iceberg_client: IcebergClient = IcebergClient()
+    iceberg_client.get_catalog().create_namespace_if_not_exists(StorageConfiguration.ICEBERG_NAMESPACE)
+    batch_rows: int = arguments['save_rows'] // arguments['save_batches']
+    results: list[Result] = []
+    for write_mode in (WriteMode.APPEND, WriteMode.MERGE):
+        iceberg_configuration: TableConfiguration = TableConfiguration(
+            table_name=f"courses_{write_mode.lower()}", schema=COURSE_SCHEMA, key_columns=('course_code',), write_mode=write_mode)
+        iceberg_client.get_catalog().create_table_if_not_exists(
+            iceberg_client.get_table_identifier(StorageConfiguration.ICEBERG_NAMESPACE, iceberg_configuration.table_name), COURSE_SCHEMA)
+        latencies: list[float] = []
+        start: float = time.perf_counter()
+        for batch in range(arguments['save_batches']):
+            # Merge batches overlap by half so every commit both updates and inserts rows
+            offset: int = batch * (batch_rows // 2 if write_mode == WriteMode.MERGE else batch_rows)
+            rows = generate_courses(offset + batch_rows)[offset:]
+            call_start: float = time.perf_counter()
+            asyncio.run(iceberg_client.save_data(rows, iceberg_configuration))
+            latencies.append(time.perf_counter() - call_start)
+        results.append(summarize(f"save_data.{write_mode.lower()}", time.perf_counter() - start, latencies,
+                                 rows=batch_rows * arguments['save_batches'], commits=arguments['save_batches']))
+    return results
+
+
+def find_free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def benchmark_end_to_end(work_directory: Path, arguments: dict) -> list[Result]:
+    overrides: dict[str, str] = {'REQUESTS_PER_SECOND': '0'}
+    site: subprocess.Popen | None = None
+    if arguments['cache_file']:
+        overrides.update({'HTTP_CACHE_MODE': 'cache_only', 'HTTP_CACHE_FILE_PATH': str(arguments['cache_file'])})
+    else:
+        port: int = find_free_port()
+        base_url: str = f"http://127.0.0.1:{port}"
+        overrides.update({'BASE_URL': base_url, 'STUDY_PROGRAMS_URL': f"{base_url}/mk/dodiplomski-studii"})
+        site = subprocess.Popen([sys.executable, '-m', 'src.benchmarks.synthetic_site', '--port', str(port),
+                                 '--scale', str(arguments['site_scale']), '--latency-ms', str(arguments['site_latency_ms'])],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline: float = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+    configure_environment(work_directory, **overrides)
+    from src.main import main
+    from src.network import HTTPClient
+    from src.parsers.base_parser import Parser
+    logging.getLogger().setLevel(logging.WARNING)
+
+    fetch_latencies: list[float] = []
+    parse_latencies: list[float] = []
+
+    def timed(function: Callable, latencies: list[float]) -> Callable:
+        async def wrapper(*args, **kwargs):
+            call_start: float = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - call_start)
+        return wrapper
+
+    HTTPClient.fetch_page = timed(HTTPClient.fetch_page, fetch_latencies)
+    Parser.parse_page = timed(Parser.parse_page, parse_latencies)
+    try:
+        start: float = time.perf_counter()
+        rows_written: dict[str, int] = asyncio.run(main())
+        seconds: float = time.perf_counter() - start
+    finally:
+        if site is not None:
+            site.terminate()
+            site.wait()
+    rows: int = sum(rows_written.values())
+    return [
+        summarize('end_to_end', seconds, [], pages=len(fetch_latencies), rows=rows, rows_per_table=rows_written),
+        summarize('end_to_end.fetch', seconds, fetch_latencies, pages=len(fetch_latencies)),
+        summarize('end_to_end.parse', seconds, parse_latencies, pages=len(parse_latencies)),
+    ]
+
+
+def benchmark_startup(work_directory: Path, arguments: dict) -> list[Result]:
+    configure_environment(work_directory, SCHEMA_CACHE_FILE_PATH=str(work_directory / 'verified_schemas.json'))
+    # Imports are cached per process, so every import is measured in a fresh interpreter
+    import_latencies: list[float] = []
+    stage_import_latencies: list[float] = []
+    for _ in range(arguments['startup_repeats']):
+        output: str = subprocess.run(
+            [sys.executable, '-c', 'import time; start = time.perf_counter(); import src.main; middle = time.perf_counter(); '
+                                   'src.main.import_stage_modules(); print(middle - start, time.perf_counter() - middle)'],
+            capture_output=True, text=True, check=True).stdout
+        main_seconds, stage_seconds = map(float, output.split())
+        import_latencies.append(main_seconds)
+        stage_import_latencies.append(stage_seconds)
+
+    from src.initialization import initialize
+    logging.getLogger().setLevel(logging.WARNING)
+    results: list[Result] = [
+        summarize('startup.import_main', sum(import_latencies), import_latencies, runs=len(import_latencies)),
+        summarize('startup.import_stages', sum(stage_import_latencies), stage_import_latencies, runs=len(stage_import_latencies)),
+    ]
+    # The first initialization creates the tables, the following ones find the verified schemas in the cache
+    for name in ('startup.initialize_cold', 'startup.initialize_cached'):
+        start: float = time.perf_counter()
+        asyncio.run(initialize())
+        results.append(summarize(name, time.perf_counter() - start, []))
+    return results
+
+
+def run_isolated(benchmark: Callable[[Path, dict], list[Result]], arguments: dict) -> list[Result]:
+    # Every benchmark runs in a fresh process, so its peak RSS and imports are not shared with the others
+    results: list[Result] = benchmark(Path(tempfile.mkdtemp(prefix='benchmark-')), arguments)
+    for result in results:
+        result['peak_rss_mib'] = peak_rss_mib()
+    return results
+
+
+BENCHMARKS: dict[str, Callable[[Path, dict], list[Result]]] = {
+    'parse': benchmark_parse,
+    'corrector': benchmark_corrector,
+    'save_data': benchmark_save_data,
+    'end_to_end': benchmark_end_to_end,
+    'startup': benchmark_startup,
+}
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: list[Result], baseline: dict[str, Result]) -> None:
+    print(f"{'benchmark':<26} {'seconds':>9} {'pages/sec':>11} {'rows/sec':>12} {'p50 ms':>9} {'p99 ms':>9} {'RSS MiB':>8} {'vs baseline':>12}")
+    for result in results:
+        previous: Result | None = baseline.get(result['name'])
+        change: str = f"{(result['seconds'] / previous['seconds'] - 1) * 100:+.1f}%" if previous and previous['seconds'] else ''
+        print(f"{result['name']:<26} {result['seconds']:>9.3f} {result['pages_per_sec'] or '':>11} {result['rows_per_sec'] or '':>12} "
+              f"{result['p50_ms'] if result['p50_ms'] is not None else '':>9} {result['p99_ms'] if result['p99_ms'] is not None else '':>9} "
+              f"{result['peak_rss_mib']:>8} {change:>12}")
+
+
+def main() -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Run the scraper benchmark suite and save the results as JSON")
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark', help=f"Any of {', '.join(BENCHMARKS)}, all by default")
+    parser.add_argument('--programs', type=int, default=20)
+    parser.add_argument('--courses', type=int, default=500)
+    parser.add_argument('--corrections', type=int, default=100_000)
+    parser.add_argument('--save-rows', type=int, default=20_000)
+    parser.add_argument('--save-batches', type=int, default=5)
+    parser.add_argument('--site-scale', type=float, default=1.0)
+    parser.add_argument('--site-latency-ms', type=float, default=0.0)
+    parser.add_argument('--startup-repeats', type=int, default=5)
+    parser.add_argument('--cache-file', type=Path, help="Run the end to end benchmark against pages recorded in an HTTP response cache")
+    parser.add_argument('--output-directory', type=Path, default=Path('benchmark_results'))
+    parser.add_argument('--baseline', type=Path, help="A previous results file to compare against")
+    arguments: argparse.Namespace = parser.parse_args()
+    unknown_benchmarks: set[str] = set(arguments.benchmarks) - BENCHMARKS.keys()
+    if unknown_benchmarks:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown_benchmarks))}")
+
+    benchmark_arguments: dict = {
+        'programs': arguments.programs, 'courses': arguments.courses, 'corrections': arguments.corrections,
+        'save_rows': arguments.save_rows, 'save_batches': arguments.save_batches, 'site_scale': arguments.site_scale,
+        'site_latency_ms': arguments.site_latency_ms, 'startup_repeats': arguments.startup_repeats, 'cache_file': arguments.cache_file and str(arguments.cache_file.resolve()),
+    }
+    results: list[Result] = []
+    for name in arguments.benchmarks or BENCHMARKS:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results.extend(executor.submit(run_isolated, BENCHMARKS[name], benchmark_arguments).result())
+
+    revision: str | None = git_revision()
+    report: dict[str, Any] = {
+        'revision': revision,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'arguments': benchmark_arguments,
+        'results': results,
+    }
+    arguments.output_directory.mkdir(parents=True, exist_ok=True)
+    output: Path = arguments.output_directory / f"{datetime.now():%Y%m%d-%H%M%S}-{revision or 'unknown'}.json"
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+
+    baseline: dict[str, Result] = {}
+    if arguments.baseline:
+        baseline = {result['name']: result for result in json.loads(arguments.baseline.read_text())['results']}
+    print_results(results, baseline)
+    print(f"Saved results to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import random
+
+COURSE_SEASONS: tuple[str, ...] = ('Зимски', 'Летен')
+
+
+def course_code(index: int) -> str:
+    return f"F23L{1 + index % 3}{'SW'[index % 2]}{index:03d}"
+
+
+def page(body: str, title: str, head: str = '') -> str:
+    navigation: str = ''.join(f'<li class="nav-item"><a class="nav-link" href="/mk/page/{index}">Страница {index}</a></li>'
+                              for index in range(60))
+    scripts: str = ''.join(f'<script src="/static/js/bundle-{index}.js"></script>' for index in range(8))
+    footer: str = ''.join(f'<div class="col-md-3"><h4>Контакт {index}</h4><p>ул. Руѓер Бошковиќ 16, Скопје</p></div>'
+                          for index in range(4))
+    return (f'<!DOCTYPE html><html lang="mk"><head><meta charset="utf-8"><title>{title}</title>{head}'
+            f'<style>.table-striped tr:nth-child(odd) {{ background: #f9f9f9; }}</style></head>'
+            f'<body><header><nav class="navbar"><ul class="navbar-nav">{navigation}</ul></nav></header>'
+            f'<main>{body}</main><footer class="footer"><div class="row">{footer}</div></footer>{scripts}</body></html>')
+
+
+def study_programs_page(number_of_programs: int) -> str:
+    items: str = ''.join(
+        f'<li><div><a href="/program/{index}/{language}"><span>{name} {index}</span><span>{4 if index % 3 else 3}</span></a></div></li>'
+        for index in range(number_of_programs)
+        for language, name in (('mk', 'Студиска програма'), ('en', 'Study program'))
+    )
+    return page(f'<div><div><div><div><div><ul>{items}</ul></div></div></div></div></div>', 'Додипломски студии')
+
+
+def course_index(code: str) -> int:
+    return int(code[6:])
+
+
+def program_course_indices(program_index: int, number_of_courses: int, courses_per_program: int, seed: int = 0) -> list[int]:
+    generator: random.Random = random.Random(seed * 1_000_003 + program_index)
+    return generator.sample(range(number_of_courses), min(courses_per_program, number_of_courses))
+
+
+def curriculum_page(program_index: int, course_indices: list[int], seed: int = 0) -> str:
+    generator: random.Random = random.Random(seed + program_index)
+    mandatory_courses: int = len(course_indices) // 2
+    sections: list[str] = []
+    for semester in range(1, 9):
+        rows: str = ''.join(
+            f'<tr><td>{course_code(index)}</td><td><a href="/subject/{course_code(index)}">Задолжителен предмет {index}</a></td></tr>'
+            for index in course_indices[semester - 1:mandatory_courses:8]
+        )
+        sections.append(f'<div class="col-md-6 col-sm-12"><h3>Семестар <span>{semester}</span></h3>'
+                        f'<table class="table"><tr><th>Код</th><th>Предмет</th></tr>{rows}</table></div>')
+    elective_rows: str = ''.join(
+        f'<tr><td>{course_code(index)}</td><td><a href="/subject/{course_code(index)}">Изборен предмет {index}</a></td>'
+        f'<td>{generator.randint(1, 8)}</td></tr>'
+        for index in course_indices[mandatory_courses:]
+    )
+    sections.append(f'<div class="col-md-12 col-sm-12"><table class="table"><tr><th>Код</th><th>Предмет</th><th>Семестар</th></tr>'
+                    f'{elective_rows}</table></div>')
+    return page(''.join(sections), f'Студиска програма {program_index}')
+
+
+def course_page(index: int, seed: int = 0) -> str:
+    generator: random.Random = random.Random(seed + index)
+    code: str = course_code(index)
+    head: str = ('<meta name="viewport" content="width=device-width"><meta name="description" content="ФИНКИ">'
+                 '<meta name="author" content="ФИНКИ"><meta name="robots" content="index"><link rel="icon" href="/favicon.ico">'
+                 f'<link rel="canonical" href="/subject/{code}">')
+    # Some course pages put the course code into the English name, which the corrector extracts
+    name_en: str = f"{code} Course {index}" if index % 7 == 0 else f"Course {index}"
+    rows: list[str] = [
+        f'<tr><td>1</td><td>Наслов на предметот</td><td><p><b>Предмет {index}</b></p><p><span>{name_en}</span></p></td></tr>',
+        f'<tr><td>2</td><td>Код</td><td><p><span>{code}</span></p></td></tr>',
+        '<tr><td>3</td><td>Студиска програма</td><td>Сите</td></tr>',
+        '<tr><td>4</td><td>Организатор</td><td>ФИНКИ</td></tr>',
+        f'<tr><td>5</td><td>Степен</td><td>Прв циклус</td></tr>',
+        f'<tr><td>6</td><td><p>Академска година/семестар</p><p><span>{1 + index % 4}</span>'
+        f'<span>{COURSE_SEASONS[index % 2]}</span></p></td><td>6 ЕКТС</td></tr>',
+        f'<tr><td>7</td><td>Наставник</td><td>проф. д-р Име {generator.randint(1, 50)} Презиме, '
+        f'вонр. проф. д-р Име {generator.randint(1, 50)} Презиме</td></tr>',
+        f'<tr><td>8</td><td>Предуслов</td><td>{"Нема" if index % 3 else f"Положен {course_code(max(index - 3, 0))}"}</td></tr>',
+        f'<tr><td>9</td><td><p>Цели на предметот</p><p>(компетенции)</p><p>{"Компетенции &amp; вештини. " * generator.randint(5, 20)}</p></td></tr>',
+        f'<tr><td>10</td><td><p>Тематски</p><p>содржини</p><p>{"Содржина на предметот. " * generator.randint(20, 60)}</p></td></tr>',
+    ]
+    body: str = (f'<div class="container"><h1>{code}</h1>'
+                 f'<table class="table table-striped table table-bordered table-sm">{"".join(rows)}</table></div>')
+    return page(body, f'Предмет {code}', head)
@@ -0,0 +1,168 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import random
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from http import HTTPStatus
+from typing import AsyncIterator
+
+from aiohttp import web
+
+from src.benchmarks.synthetic_pages import study_programs_page, curriculum_page, course_page, course_index, \
+    program_course_indices
+
+STUDY_PROGRAMS_PATH: str = '/mk/dodiplomski-studii'
+SERVER_ERROR_STATUSES: tuple[HTTPStatus, ...] = (HTTPStatus.INTERNAL_SERVER_ERROR, HTTPStatus.BAD_GATEWAY,
+                                                 HTTPStatus.SERVICE_UNAVAILABLE)
+
+
+@dataclass(frozen=True)
+class SiteConfiguration:
+    number_of_programs: int = 20
+    number_of_courses: int = 400
+    courses_per_program: int = 50
+    latency_ms: float = 0.0
+    latency_jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    retry_after_seconds: int = 1
+    seed: int = 0
+
+    def scaled(self, scale: float) -> 'SiteConfiguration':
+        return replace(self, number_of_programs=max(1, round(self.number_of_programs * scale)),
+                       number_of_courses=max(1, round(self.number_of_courses * scale)))
+
+
+class SyntheticSite:
+
+    def __init__(self, site_configuration: SiteConfiguration):
+        self._configuration: SiteConfiguration = site_configuration
+        self._random: random.Random = random.Random(site_configuration.seed)
+        self.statistics: Counter[str] = Counter()
+        self.render = lru_cache(maxsize=4096)(self._render)
+
+    def _render(self, kind: str, index: int) -> tuple[bytes, str]:
+        configuration: SiteConfiguration = self._configuration
+        if kind == 'study_programs':
+            html: str = study_programs_page(configuration.number_of_programs)
+        elif kind == 'curriculum':
+            html = curriculum_page(index, program_course_indices(index, configuration.number_of_courses,
+                                                                 configuration.courses_per_program, configuration.seed),
+                                   configuration.seed)
+        else:
+            html = course_page(index, configuration.seed)
+        body: bytes = html.encode()
+        return body, f'"{hashlib.md5(body).hexdigest()}"'
+
+    async def _respond(self, request: web.Request, kind: str, index: int) -> web.Response:
+        configuration: SiteConfiguration = self._configuration
+        delay_ms: float = configuration.latency_ms + self._random.uniform(0, configuration.latency_jitter_ms)
+        if delay_ms > 0:
+            await asyncio.sleep(delay_ms / 1000)
+        roll: float = self._random.random()
+        if roll < configuration.throttle_rate:
+            self.statistics[str(HTTPStatus.TOO_MANY_REQUESTS.value)] += 1
+            return web.Response(status=HTTPStatus.TOO_MANY_REQUESTS,
+                                headers={'Retry-After': str(configuration.retry_after_seconds)})
+        if roll < configuration.throttle_rate + configuration.error_rate:
+            status: HTTPStatus = self._random.choice(SERVER_ERROR_STATUSES)
+            self.statistics[str(status.value)] += 1
+            return web.Response(status=status)
+        body, etag = self.render(kind, index)
+        if request.headers.get('If-None-Match') == etag:
+            self.statistics[str(HTTPStatus.NOT_MODIFIED.value)] += 1
+            return web.Response(status=HTTPStatus.NOT_MODIFIED, headers={'ETag': etag})
+        self.statistics[str(HTTPStatus.OK.value)] += 1
+        return web.Response(body=body, content_type='text/html', charset='utf-8', headers={'ETag': etag})
+
+    async def study_programs(self, request: web.Request) -> web.Response:
+        return await self._respond(request, 'study_programs', 0)
+
+    async def curriculum(self, request: web.Request) -> web.Response:
+        program_index: int = int(request.match_info['program_index'])
+        if program_index >= self._configuration.number_of_programs:
+            raise web.HTTPNotFound()
+        return await self._respond(request, 'curriculum', program_index)
+
+    async def course(self, request: web.Request) -> web.Response:
+        try:
+            index: int = course_index(request.match_info['course_code'])
+        except ValueError:
+            raise web.HTTPNotFound()
+        if index >= self._configuration.number_of_courses:
+            raise web.HTTPNotFound()
+        return await self._respond(request, 'course', index)
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.statistics))
+
+    def create_application(self) -> web.Application:
+        application: web.Application = web.Application()
+        application.add_routes([
+            web.get(STUDY_PROGRAMS_PATH, self.study_programs),
+            web.get('/program/{program_index:\\d+}/{language}', self.curriculum),
+            web.get('/subject/{course_code}', self.course),
+            web.get('/stats', self.stats),
+        ])
+        return application
+
+
+@asynccontextmanager
+async def serve_site(site_configuration: SiteConfiguration, host: str = '127.0.0.1', port: int = 0) -> AsyncIterator[tuple[SyntheticSite, str]]:
+    site: SyntheticSite = SyntheticSite(site_configuration)
+    runner: web.AppRunner = web.AppRunner(site.create_application(), access_log=None)
+    await runner.setup()
+    tcp_site: web.TCPSite = web.TCPSite(runner, host, port)
+    await tcp_site.start()
+    bound_port: int = runner.addresses[0][1]
+    try:
+        yield site, f"http://{host}:{bound_port}"
+    finally:
+        await runner.cleanup()
+
+
+async def serve_forever(site_configuration: SiteConfiguration, host: str, port: int) -> None:
+    async with serve_site(site_configuration, host, port) as (_, base_url):
+        logging.info(f"Serving {site_configuration.number_of_programs} study programs and {site_configuration.number_of_courses} courses "
+                     f"at {base_url}")
+        print(f"export BASE_URL={base_url}\nexport STUDY_PROGRAMS_URL={base_url}{STUDY_PROGRAMS_PATH}", flush=True)
+        await asyncio.Event().wait()
+
+
+def main() -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Serve a synthetic FINKI-like site for offline load testing")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--programs', type=int, default=20, help="Number of study programs at scale 1")
+    parser.add_argument('--courses', type=int, default=400, help="Number of distinct course pages at scale 1")
+    parser.add_argument('--courses-per-program', type=int, default=50)
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplies the number of study programs and courses")
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--latency-jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 500, 502 or 503")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument('--retry-after-seconds', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    arguments: argparse.Namespace = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    site_configuration: SiteConfiguration = SiteConfiguration(
+        number_of_programs=arguments.programs,
+        number_of_courses=arguments.courses,
+        courses_per_program=arguments.courses_per_program,
+        latency_ms=arguments.latency_ms,
+        latency_jitter_ms=arguments.latency_jitter_ms,
+        error_rate=arguments.error_rate,
+        throttle_rate=arguments.throttle_rate,
+        retry_after_seconds=arguments.retry_after_seconds,
+        seed=arguments.seed,
+    ).scaled(arguments.scale)
+    asyncio.run(serve_forever(site_configuration, arguments.host, arguments.port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from src.configurations import ApplicationConfiguration
+from src.models.enums import HTTPCacheMode
+from src.models.named_tuples import CachedResponse
+
+
+class ResponseCache:
+    SCHEMA: str = '''
+        CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            body BLOB NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            size INTEGER NOT NULL,
+            stored_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+    '''
+
+    def __init__(self, file_path: Path, max_size_bytes: int, ttl_seconds: float):
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection: sqlite3.Connection = sqlite3.connect(file_path, check_same_thread=False)
+        self._connection.executescript(self.SCHEMA)
+        self._lock: threading.Lock = threading.Lock()
+        self._max_size_bytes: int = max_size_bytes
+        self._ttl_seconds: float = ttl_seconds
+
+    @classmethod
+    def from_configuration(cls) -> 'ResponseCache | None':
+        if ApplicationConfiguration.HTTP_CACHE_MODE == HTTPCacheMode.DISABLED:
+            return None
+        logging.info(f"Using HTTP response cache at {ApplicationConfiguration.HTTP_CACHE_FILE_PATH} "
+                     f"in {ApplicationConfiguration.HTTP_CACHE_MODE} mode")
+        return cls(file_path=ApplicationConfiguration.HTTP_CACHE_FILE_PATH,
+                   max_size_bytes=ApplicationConfiguration.HTTP_CACHE_MAX_SIZE_BYTES,
+                   ttl_seconds=ApplicationConfiguration.HTTP_CACHE_TTL_SECONDS)
+
+    def is_fresh(self, cached_response: CachedResponse) -> bool:
+        return self._ttl_seconds > 0 and time.time() - cached_response.stored_at < self._ttl_seconds
+
+    def _get(self, url: str) -> CachedResponse | None:
+        with self._lock:
+            row: tuple | None = self._connection.execute(
+                'SELECT url, body, etag, last_modified, stored_at FROM responses WHERE url = ?', (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute('UPDATE responses SET accessed_at = ? WHERE url = ?', (time.time(), url))
+            self._connection.commit()
+        return CachedResponse(*row)
+
+    def _put(self, cached_response: CachedResponse) -> None:
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO responses (url, body, etag, last_modified, size, stored_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (cached_response.url, cached_response.body, cached_response.etag,
+                 cached_response.last_modified, len(cached_response.body), cached_response.stored_at, time.time())
+            )
+            self._evict()
+            self._connection.commit()
+
+    def _touch(self, url: str) -> None:
+        with self._lock:
+            now: float = time.time()
+            self._connection.execute('UPDATE responses SET stored_at = ?, accessed_at = ? WHERE url = ?', (now, now, url))
+            self._connection.commit()
+
+    def _evict(self) -> None:
+        total_size: int = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total_size <= self._max_size_bytes:
+            return
+        evicted: int = 0
+        for url, size in self._connection.execute('SELECT url, size FROM responses ORDER BY accessed_at').fetchall():
+            if total_size <= self._max_size_bytes:
+                break
+            self._connection.execute('DELETE FROM responses WHERE url = ?', (url,))
+            total_size -= size
+            evicted += 1
+        logging.info(f"Evicted {evicted} least recently used entries from the HTTP response cache")
+
+    async def get(self, url: str) -> CachedResponse | None:
+        return await asyncio.to_thread(self._get, url)
+
+    async def put(self, cached_response: CachedResponse) -> None:
+        await asyncio.to_thread(self._put, cached_response)
+
+    async def touch(self, url: str) -> None:
+        await asyncio.to_thread(self._touch, url)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
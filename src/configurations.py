@@ -1,13 +1,18 @@
+import json
 import os
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 
 from pyiceberg.schema import Schema
 
-from src.models.enums import FileIOType
+from src.models.enums import FileIOType, HTTPCacheMode, WriteMode, SinkCommitMode, ExecutorType, ParserBackendType, CurriculaLayout
 from src.schemas.course_schema import COURSE_SCHEMA
+from src.schemas.curriculum_fact_schema import CURRICULUM_FACT_SCHEMA
 from src.schemas.curriculum_schema import CURRICULUM_SCHEMA
+from src.schemas.page_manifest_schema import PAGE_MANIFEST_SCHEMA
+from src.schemas.prerequisite_closure_schema import PREREQUISITE_CLOSURE_SCHEMA
+from src.schemas.prerequisite_edge_schema import PREREQUISITE_EDGE_SCHEMA
 from src.schemas.study_program_schema import STUDY_PROGRAM_SCHEMA
 from src.setup import ENVIRONMENT_VARIABLES
 
@@ -15,23 +20,134 @@ from src.setup import ENVIRONMENT_VARIABLES
 class TableConfiguration:
     table_name: str
     schema: Schema
+    key_columns: tuple[str, ...] = ()
+    dictionary_columns: tuple[str, ...] = ()
+    write_mode: WriteMode = WriteMode.APPEND
+    # Parquet write properties of the table, None keeps the pyiceberg default
+    compression_codec: str = 'zstd'
+    compression_level: int | None = None
+    target_file_size_bytes: int | None = None
+    row_group_rows: int | None = None
+    dictionary_size_bytes: int | None = None
+    sort_columns: tuple[str, ...] = ()
+    # Identity partitioned columns, each value gets its own data files
+    partition_columns: tuple[str, ...] = ()
+
+    def __post_init__(self):
+        if self.write_mode == WriteMode.MERGE and not self.key_columns:
+            raise ValueError(f"Table {self.table_name} needs key columns to be written in {WriteMode.MERGE} mode")
+        unknown_columns: set[str] = set(self.sort_columns) - {field.name for field in self.schema.fields}
+        if unknown_columns:
+            raise ValueError(f"Table {self.table_name} cannot be sorted by unknown columns {', '.join(sorted(unknown_columns))}")
+        unknown_columns = set(self.partition_columns) - {field.name for field in self.schema.fields}
+        if unknown_columns:
+            raise ValueError(f"Table {self.table_name} cannot be partitioned by unknown columns {', '.join(sorted(unknown_columns))}")
 
     def __str__(self):
         return self.table_name
 
+    def get_write_properties(self) -> dict[str, str]:
+        properties: dict[str, int | str | None] = {
+            'write.parquet.compression-codec': self.compression_codec,
+            'write.parquet.compression-level': self.compression_level,
+            'write.target-file-size-bytes': self.target_file_size_bytes,
+            'write.parquet.row-group-limit': self.row_group_rows,
+            'write.parquet.dict-size-bytes': self.dictionary_size_bytes,
+        }
+        return {name: str(value) for name, value in properties.items() if value is not None}
+
+
+def get_write_options(prefix: str, sort_columns: tuple[str, ...] = (), partition_columns: tuple[str, ...] = (),
+                      compression_level: int | None = None, dictionary_size_bytes: int | None = None) -> dict:
+    # Every table reads its write properties from environment variables named after the table, e.g. COURSES_COMPRESSION_CODEC
+    def get_optional_int(name: str, default: int | None) -> int | None:
+        value: str = ENVIRONMENT_VARIABLES.get(f"{prefix}_{name}", '' if default is None else str(default))
+        return int(value) if value else None
+
+    def get_columns(name: str, default: tuple[str, ...]) -> tuple[str, ...]:
+        value: str = ENVIRONMENT_VARIABLES.get(f"{prefix}_{name}", ','.join(default))
+        return tuple(column.strip() for column in value.split(',') if column.strip())
+
+    return {
+        'compression_codec': ENVIRONMENT_VARIABLES.get(f"{prefix}_COMPRESSION_CODEC", 'zstd').lower(),
+        'compression_level': get_optional_int('COMPRESSION_LEVEL', compression_level),
+        'target_file_size_bytes': get_optional_int('TARGET_FILE_SIZE_BYTES', None),
+        'row_group_rows': get_optional_int('ROW_GROUP_ROWS', None),
+        'dictionary_size_bytes': get_optional_int('DICTIONARY_SIZE_BYTES', dictionary_size_bytes),
+        'sort_columns': get_columns('SORT_COLUMNS', sort_columns),
+        'partition_columns': get_columns('PARTITION_COLUMNS', partition_columns),
+    }
+
 class ApplicationConfiguration:
-    BASE_URL: str = "https://finki.ukim.mk"
-    STUDY_PROGRAMS_URL: str = "https://finki.ukim.mk/mk/dodiplomski-studii"
-    COURSE_CODES_REGEX: re.Pattern[str] = re.compile(r'^F23L[1-3][SW]\d{3}')
+    BASE_URL: str = ENVIRONMENT_VARIABLES.get('BASE_URL', "https://finki.ukim.mk")
+    STUDY_PROGRAMS_URL: str = ENVIRONMENT_VARIABLES.get('STUDY_PROGRAMS_URL', f"{BASE_URL}/mk/dodiplomski-studii")
+    COURSE_CODES_REGEX: re.Pattern[str] = re.compile(ENVIRONMENT_VARIABLES.get('COURSE_CODES_REGEX', r'^F23L[1-3][SW]\d{3}'))
+    # Without a sources file, the settings above make up the only source
+    SOURCE_NAME: str = ENVIRONMENT_VARIABLES.get('SOURCE_NAME', 'default')
+    STUDY_PROGRAM_URL_SUFFIX: str = ENVIRONMENT_VARIABLES.get('STUDY_PROGRAM_URL_SUFFIX', 'mk')
+    SOURCES_FILE_PATH: Path | None = Path(ENVIRONMENT_VARIABLES['SOURCES_FILE_PATH']) \
+        if ENVIRONMENT_VARIABLES.get('SOURCES_FILE_PATH') else None
 
     THREADS_PER_CPU_CORE: int = 5
     NUMBER_OF_THREADS: int = THREADS_PER_CPU_CORE * os.cpu_count() if ENVIRONMENT_VARIABLES.get(
         'NUMBER_OF_THREADS') == '-1' else (
         int(ENVIRONMENT_VARIABLES.get('NUMBER_OF_THREADS')))
+    PARSER_EXECUTOR_TYPE: ExecutorType = ExecutorType(ENVIRONMENT_VARIABLES.get('PARSER_EXECUTOR_TYPE', 'THREAD').upper())
+    NUMBER_OF_PROCESSES: int = os.cpu_count() if ENVIRONMENT_VARIABLES.get('NUMBER_OF_PROCESSES', '-1') == '-1' else (
+        int(ENVIRONMENT_VARIABLES.get('NUMBER_OF_PROCESSES')))
+
+    PARSER_BACKEND: ParserBackendType = ParserBackendType(ENVIRONMENT_VARIABLES.get('PARSER_BACKEND', 'LXML').upper())
+    PARTIAL_COURSE_PAGE_PARSING: bool = ENVIRONMENT_VARIABLES.get('PARTIAL_COURSE_PAGE_PARSING', 'true').lower() == 'true'
 
     REQUESTS_TIMEOUT_SECONDS: float = float(ENVIRONMENT_VARIABLES.get('REQUESTS_TIMEOUT_SECONDS'))
     REQUEST_RETRY_COUNT: int = int(ENVIRONMENT_VARIABLES.get('REQUEST_RETRY_COUNT'))
     REQUESTS_RETRY_DELAY_SECONDS: float = float(ENVIRONMENT_VARIABLES.get("REQUESTS_RETRY_DELAY_SECONDS"))
+    REQUESTS_RETRY_MAX_DELAY_SECONDS: float = float(ENVIRONMENT_VARIABLES.get('REQUESTS_RETRY_MAX_DELAY_SECONDS', '60'))
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = int(ENVIRONMENT_VARIABLES.get('CIRCUIT_BREAKER_FAILURE_THRESHOLD', '5'))
+    CIRCUIT_BREAKER_COOLDOWN_SECONDS: float = float(ENVIRONMENT_VARIABLES.get('CIRCUIT_BREAKER_COOLDOWN_SECONDS', '5'))
+    CIRCUIT_BREAKER_MAX_COOLDOWN_SECONDS: float = float(ENVIRONMENT_VARIABLES.get('CIRCUIT_BREAKER_MAX_COOLDOWN_SECONDS', '120'))
+    FAILED_PAGES_RETRY_PASSES: int = int(ENVIRONMENT_VARIABLES.get('FAILED_PAGES_RETRY_PASSES', '1'))
+
+    MAX_CONCURRENT_REQUESTS: int = int(ENVIRONMENT_VARIABLES.get('MAX_CONCURRENT_REQUESTS', '32'))
+    MAX_CONCURRENT_REQUESTS_PER_HOST: int = int(ENVIRONMENT_VARIABLES.get('MAX_CONCURRENT_REQUESTS_PER_HOST', '8'))
+    REQUESTS_PER_SECOND: float = float(ENVIRONMENT_VARIABLES.get('REQUESTS_PER_SECOND', '20'))
+    REQUESTS_BURST_SIZE: int = int(ENVIRONMENT_VARIABLES.get('REQUESTS_BURST_SIZE', '10'))
+    DNS_CACHE_TTL_SECONDS: int = int(ENVIRONMENT_VARIABLES.get('DNS_CACHE_TTL_SECONDS', '300'))
+    KEEPALIVE_TIMEOUT_SECONDS: float = float(ENVIRONMENT_VARIABLES.get('KEEPALIVE_TIMEOUT_SECONDS', '30'))
+
+    HTTP_CACHE_MODE: HTTPCacheMode = HTTPCacheMode(ENVIRONMENT_VARIABLES.get('HTTP_CACHE_MODE', 'DISABLED').upper())
+    HTTP_CACHE_FILE_PATH: Path = Path(ENVIRONMENT_VARIABLES.get('HTTP_CACHE_FILE_PATH', '../cache/http_cache.sqlite3'))
+    HTTP_CACHE_MAX_SIZE_BYTES: int = int(ENVIRONMENT_VARIABLES.get('HTTP_CACHE_MAX_SIZE_BYTES', str(512 * 1024 * 1024)))
+    HTTP_CACHE_TTL_SECONDS: float = float(ENVIRONMENT_VARIABLES.get('HTTP_CACHE_TTL_SECONDS', '0'))
+
+    MAX_PAGES_IN_FLIGHT: int = int(ENVIRONMENT_VARIABLES.get('MAX_PAGES_IN_FLIGHT', '64'))
+    PIPELINE_QUEUE_SIZE: int = int(ENVIRONMENT_VARIABLES.get('PIPELINE_QUEUE_SIZE', '256'))
+
+    SKIP_UNCHANGED_PAGES: bool = ENVIRONMENT_VARIABLES.get('SKIP_UNCHANGED_PAGES', 'true').lower() == 'true'
+    PREREQUISITE_GRAPH_ENABLED: bool = ENVIRONMENT_VARIABLES.get('PREREQUISITE_GRAPH_ENABLED', 'true').lower() == 'true'
+
+    SCHEMA_CACHE_FILE_PATH: Path = Path(ENVIRONMENT_VARIABLES.get('SCHEMA_CACHE_FILE_PATH', '../cache/verified_schemas.json'))
+    SCHEMA_CACHE_TTL_SECONDS: float = float(ENVIRONMENT_VARIABLES.get('SCHEMA_CACHE_TTL_SECONDS', '86400'))
+    JOURNAL_ENABLED: bool = ENVIRONMENT_VARIABLES.get('JOURNAL_ENABLED', 'true').lower() == 'true'
+    JOURNAL_FILE_PATH: Path = Path(ENVIRONMENT_VARIABLES.get('JOURNAL_FILE_PATH', '../cache/journal.sqlite3'))
+
+    WORK_QUEUE_FILE_PATH: Path = Path(ENVIRONMENT_VARIABLES.get('WORK_QUEUE_FILE_PATH', '../cache/work_queue.sqlite3'))
+    SHARD_WORKERS: int = int(ENVIRONMENT_VARIABLES.get('SHARD_WORKERS', '4'))
+    SHARD_SIZE: int = int(ENVIRONMENT_VARIABLES.get('SHARD_SIZE', '10'))
+    SHARD_LEASE_SECONDS: float = float(ENVIRONMENT_VARIABLES.get('SHARD_LEASE_SECONDS', '60'))
+    SHARD_MAX_ATTEMPTS: int = int(ENVIRONMENT_VARIABLES.get('SHARD_MAX_ATTEMPTS', '3'))
+    SHARD_POLL_SECONDS: float = float(ENVIRONMENT_VARIABLES.get('SHARD_POLL_SECONDS', '1'))
+
+    RUN_REPORT_FILE_PATH: Path | None = Path(ENVIRONMENT_VARIABLES['RUN_REPORT_FILE_PATH']) \
+        if ENVIRONMENT_VARIABLES.get('RUN_REPORT_FILE_PATH') else None
+    PROMETHEUS_TEXTFILE_PATH: Path | None = Path(ENVIRONMENT_VARIABLES['PROMETHEUS_TEXTFILE_PATH']) \
+        if ENVIRONMENT_VARIABLES.get('PROMETHEUS_TEXTFILE_PATH') else None
+
+    PROFILING_ENABLED: bool = ENVIRONMENT_VARIABLES.get('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILING_DIRECTORY: Path = Path(ENVIRONMENT_VARIABLES.get('PROFILING_DIRECTORY', '../profiles'))
+    PROFILING_TRACE_ALLOCATIONS: bool = ENVIRONMENT_VARIABLES.get('PROFILING_TRACE_ALLOCATIONS', 'true').lower() == 'true'
+    PROFILING_TRACEBACK_DEPTH: int = int(ENVIRONMENT_VARIABLES.get('PROFILING_TRACEBACK_DEPTH', '5'))
+    PROFILING_TOP_ALLOCATIONS: int = int(ENVIRONMENT_VARIABLES.get('PROFILING_TOP_ALLOCATIONS', '25'))
 
 
 
@@ -45,18 +161,131 @@ class StorageConfiguration:
     S3_PATH_STYLE_ACCESS: bool = ENVIRONMENT_VARIABLES.get('S3_PATH_STYLE_ACCESS')
     ICEBERG_CATALOG_NAME: str = ENVIRONMENT_VARIABLES.get("ICEBERG_CATALOG_NAME")
     ICEBERG_NAMESPACE: str = ENVIRONMENT_VARIABLES.get("ICEBERG_NAMESPACE")
+    SINK_BATCH_ROWS: int = int(ENVIRONMENT_VARIABLES.get("SINK_BATCH_ROWS", "1000"))
+    SINK_BATCH_BYTES: int = int(ENVIRONMENT_VARIABLES.get("SINK_BATCH_BYTES", str(16 * 1024 * 1024)))
+    SINK_COMMIT_MODE: SinkCommitMode = SinkCommitMode(ENVIRONMENT_VARIABLES.get("SINK_COMMIT_MODE", "ONCE").upper())
+    WRITER_THREADS: int = int(ENVIRONMENT_VARIABLES.get("WRITER_THREADS", "4"))
+    COMMIT_RETRY_COUNT: int = int(ENVIRONMENT_VARIABLES.get("COMMIT_RETRY_COUNT", "5"))
+    COMMIT_RETRY_DELAY_SECONDS: float = float(ENVIRONMENT_VARIABLES.get("COMMIT_RETRY_DELAY_SECONDS", "0.1"))
+    CURRICULA_LAYOUT: CurriculaLayout = CurriculaLayout(ENVIRONMENT_VARIABLES.get("CURRICULA_LAYOUT", "WIDE").upper())
+    MAINTENANCE_MIN_INPUT_FILES: int = int(ENVIRONMENT_VARIABLES.get("MAINTENANCE_MIN_INPUT_FILES", "5"))
+    MAINTENANCE_SNAPSHOT_RETENTION_SECONDS: float = float(ENVIRONMENT_VARIABLES.get("MAINTENANCE_SNAPSHOT_RETENTION_SECONDS",
+                                                                                    str(7 * 24 * 60 * 60)))
+    MAINTENANCE_ORPHAN_MIN_AGE_SECONDS: float = float(ENVIRONMENT_VARIABLES.get("MAINTENANCE_ORPHAN_MIN_AGE_SECONDS",
+                                                                                str(3 * 24 * 60 * 60)))
+
+
+@dataclass(frozen=True)
+class SourceConfiguration:
+    name: str
+    base_url: str
+    study_programs_url: str
+    course_codes_regex: re.Pattern[str]
+    # Only study programs whose URL ends with the suffix are crawled, e.g. 'mk' for the Macedonian pages
+    study_program_url_suffix: str = ''
+    # Replaces the parsers' selector class attributes of the same name, e.g. {"COURSE_TABLE_CLASS_NAME": "subjects"}
+    selectors: dict[str, str] = field(default_factory=dict)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def from_dict(cls, source: dict) -> 'SourceConfiguration':
+        unknown_selectors: list[str] = [name for name in source.get('selectors', {}) if not name.isupper()]
+        if unknown_selectors:
+            raise ValueError(f"Source {source.get('name')} overrides selectors that are not parser attributes: {unknown_selectors}")
+        base_url: str = source['base_url'].rstrip('/')
+        return cls(
+            name=source['name'],
+            base_url=base_url,
+            study_programs_url=source.get('study_programs_url', f"{base_url}/mk/dodiplomski-studii"),
+            course_codes_regex=re.compile(source.get('course_codes_regex', ApplicationConfiguration.COURSE_CODES_REGEX.pattern)),
+            study_program_url_suffix=source.get('study_program_url_suffix', ''),
+            selectors=source.get('selectors', {}),
+        )
+
+
+def load_sources() -> list[SourceConfiguration]:
+    if ApplicationConfiguration.SOURCES_FILE_PATH is None:
+        return [SourceConfiguration(
+            name=ApplicationConfiguration.SOURCE_NAME,
+            base_url=ApplicationConfiguration.BASE_URL,
+            study_programs_url=ApplicationConfiguration.STUDY_PROGRAMS_URL,
+            course_codes_regex=ApplicationConfiguration.COURSE_CODES_REGEX,
+            study_program_url_suffix=ApplicationConfiguration.STUDY_PROGRAM_URL_SUFFIX,
+        )]
+    sources: list[SourceConfiguration] = [SourceConfiguration.from_dict(source) for source in
+                                          json.loads(ApplicationConfiguration.SOURCES_FILE_PATH.read_text())]
+    names: list[str] = [source.name for source in sources]
+    if not sources or len(set(names)) != len(names):
+        raise ValueError(f"{ApplicationConfiguration.SOURCES_FILE_PATH} must list at least one source and source names must be unique")
+    return sources
+
+
+# The rows of every source land in the same tables, tagged with the source name
+SOURCES: list[SourceConfiguration] = load_sources()
+SOURCES_BY_NAME: dict[str, SourceConfiguration] = {source.name: source for source in SOURCES}
 
 STUDY_PROGRAMS: TableConfiguration = TableConfiguration(
     table_name=ENVIRONMENT_VARIABLES.get("STUDY_PROGRAMS_DATASET_NAME", "study_programs"),
     schema=STUDY_PROGRAM_SCHEMA,
+    key_columns=('study_program_url',),
+    write_mode=WriteMode(ENVIRONMENT_VARIABLES.get("STUDY_PROGRAMS_WRITE_MODE", "APPEND").upper()),
+    **get_write_options('STUDY_PROGRAMS', sort_columns=('study_program_url',), partition_columns=('source',)),
 )
 
 CURRICULA: TableConfiguration = TableConfiguration(
     table_name=ENVIRONMENT_VARIABLES.get("CURRICULA_DATASET_NAME", "curricula"),
     schema=CURRICULUM_SCHEMA,
+    key_columns=('study_program_url', 'course_code'),
+    dictionary_columns=('study_program_name', 'study_program_url', 'course_type'),
+    write_mode=WriteMode(ENVIRONMENT_VARIABLES.get("CURRICULA_WRITE_MODE", "APPEND").upper()),
+    # Sorting by study program keeps the repeated program columns in long runs, which dictionary and RLE encode well
+    **get_write_options('CURRICULA', sort_columns=('study_program_url', 'course_code'), partition_columns=('source',)),
+) if StorageConfiguration.CURRICULA_LAYOUT == CurriculaLayout.WIDE else TableConfiguration(
+    # Only the keys and the columns that belong to the pair are stored, the program and course columns are joined back
+    # from the study programs and courses tables, see src/views.py
+    table_name=ENVIRONMENT_VARIABLES.get("CURRICULA_DATASET_NAME", "curriculum_facts"),
+    schema=CURRICULUM_FACT_SCHEMA,
+    key_columns=('study_program_id', 'course_code'),
+    dictionary_columns=('course_type',),
+    write_mode=WriteMode(ENVIRONMENT_VARIABLES.get("CURRICULA_WRITE_MODE", "APPEND").upper()),
+    **get_write_options('CURRICULA', sort_columns=('study_program_id', 'course_code'), partition_columns=('source',)),
 )
 
 COURSES: TableConfiguration = TableConfiguration(
     table_name=ENVIRONMENT_VARIABLES.get("COURSES_DATASET_NAME", "courses"),
     schema=COURSE_SCHEMA,
+    # Course codes are only unique within a source
+    key_columns=('source', 'course_code'),
+    write_mode=WriteMode(ENVIRONMENT_VARIABLES.get("COURSES_WRITE_MODE", "APPEND").upper()),
+    # The free text columns compress well with a higher level and are rarely repeated, so they fall back to plain
+    # encoding once the dictionary page reaches its limit
+    **get_write_options('COURSES', sort_columns=('course_code',), partition_columns=('source',), compression_level=9,
+                        dictionary_size_bytes=256 * 1024),
+)
+
+PAGE_MANIFEST: TableConfiguration = TableConfiguration(
+    table_name=ENVIRONMENT_VARIABLES.get("PAGE_MANIFEST_DATASET_NAME", "page_manifest"),
+    schema=PAGE_MANIFEST_SCHEMA,
+    key_columns=('dataset', 'page_url'),
+    **get_write_options('PAGE_MANIFEST', sort_columns=('dataset', 'page_url')),
+)
+
+# The prerequisite graph tables are updated in place by the prerequisite stage, so they have no write mode
+PREREQUISITE_EDGES: TableConfiguration = TableConfiguration(
+    table_name=ENVIRONMENT_VARIABLES.get("PREREQUISITE_EDGES_DATASET_NAME", "prerequisite_edges"),
+    schema=PREREQUISITE_EDGE_SCHEMA,
+    key_columns=('source', 'course_code', 'prerequisite_code'),
+    **get_write_options('PREREQUISITE_EDGES', sort_columns=('source', 'course_code', 'prerequisite_code'),
+                        partition_columns=('source',)),
+)
+
+PREREQUISITE_CLOSURE: TableConfiguration = TableConfiguration(
+    table_name=ENVIRONMENT_VARIABLES.get("PREREQUISITE_CLOSURE_DATASET_NAME", "prerequisite_closure"),
+    schema=PREREQUISITE_CLOSURE_SCHEMA,
+    key_columns=('source', 'course_code', 'prerequisite_code'),
+    # Sorted by course, so the lookup of a course's prerequisites only reads the row groups whose statistics contain it
+    **get_write_options('PREREQUISITE_CLOSURE', sort_columns=('source', 'course_code', 'depth', 'prerequisite_code'),
+                        partition_columns=('source',)),
 )
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+from concurrent.futures import Executor
+from multiprocessing.process import BaseProcess
+from typing import Callable, Any
+
+from src.configurations import ApplicationConfiguration, TableConfiguration, CURRICULA, COURSES, STUDY_PROGRAMS
+from src.course_index import CourseIndex
+from src.initialization import initialize
+from src.journal import Journal
+from src.main import main, create_executor
+from src.manifest import PageManifest
+from src.models.enums import ShardState
+from src.models.named_tuples import Shard, StudyProgram, CourseHeader, Curriculum, JournalEntry
+from src.network import HTTPClient
+from src.parsers.base_parser import Parser
+from src.parsers.course_parser import CourseParser
+from src.parsers.curriculum_parser import CurriculumParser
+from src.parsers.study_program_parser import StudyProgramParser
+from src.storage import IcebergClient
+from src.work_queue import WorkQueue
+
+# Study programs are sharded first, the course pages they reference are sharded once all of them are crawled
+STAGES: dict[str, tuple[TableConfiguration, Callable[..., Any], str]] = {
+    CURRICULA.table_name: (CURRICULA, StudyProgram, 'study_program_url'),
+    COURSES.table_name: (COURSES, CourseHeader, 'course_url'),
+}
+
+
+def get_worker_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class ShardWorker:
+    # Crawls the pages of claimed shards and records their rows in the journal, the coordinator commits them
+
+    def __init__(self, queue: WorkQueue, journal: Journal, http_client: HTTPClient, iceberg_client: IcebergClient,
+                 executor: Executor):
+        self._name: str = get_worker_name()
+        self._queue: WorkQueue = queue
+        self._journal: Journal = journal
+        self._http_client: HTTPClient = http_client
+        self._iceberg_client: IcebergClient = iceberg_client
+        self._executor: Executor = executor
+        self._curriculum_parsers: dict[str, Parser] = CurriculumParser().for_sources()
+        self._course_parsers: dict[str, Parser] = CourseParser().for_sources()
+        self._manifest: PageManifest | None = None
+
+    async def crawl_study_program(self, study_program: StudyProgram) -> bool:
+        curricula: list[Curriculum] | None = await self._curriculum_parsers[study_program.source].crawl(
+            study_program, CURRICULA, self._http_client, self._executor)
+        if curricula is None:
+            return False
+        await self._journal.record(CURRICULA, study_program.study_program_url, curricula)
+        return True
+
+    async def crawl_course(self, course_header: CourseHeader) -> bool:
+        if self._manifest is None:
+            # Only read to skip unchanged pages, the merge builds and saves the manifest of the run
+            self._manifest = await PageManifest.load(self._iceberg_client, COURSES)
+        entry: JournalEntry | None = await self._course_parsers[course_header.source].crawl(
+            course_header, COURSES, self._http_client, self._executor, self._manifest, CourseParser.skips_unchanged_pages(COURSES))
+        if entry is None:
+            return False
+        await self._journal.record(COURSES, entry.page_url, entry.rows, content_hash=entry.content_hash, row_key=entry.row_key)
+        return True
+
+    async def crawl(self, shard: Shard) -> bool:
+        dataset, row_type, page_url_field = STAGES[shard.stage]
+        items: list[StudyProgram | CourseHeader] = [row_type(*values) for values in shard.items]
+        crawl_page: Callable[..., Any] = self.crawl_study_program if dataset is CURRICULA else self.crawl_course
+        # Pages recorded by an earlier attempt at the shard are not crawled again
+        completed: set[str] = await self._journal.completed(dataset, [getattr(item, page_url_field) for item in items])
+        pages: asyncio.Queue[StudyProgram | CourseHeader | None] = asyncio.Queue()
+        for item in items:
+            if getattr(item, page_url_field) not in completed:
+                pages.put_nowait(item)
+        pages.put_nowait(None)
+        failed: list[StudyProgram | CourseHeader] = await Parser.process_queue(pages, crawl_page)
+        logging.info(f"Crawled shard {shard.shard} of {shard.stage}: {len(items) - len(completed)} pages, "
+                     f"{len(completed)} recorded by an earlier attempt, {len(failed)} failed")
+        return not failed
+
+    async def run_shard(self, shard: Shard) -> None:
+        lease_seconds: float = ApplicationConfiguration.SHARD_LEASE_SECONDS
+        crawling: asyncio.Task[bool] = asyncio.create_task(self.crawl(shard))
+        while not (await asyncio.wait({crawling}, timeout=lease_seconds / 3))[0]:
+            if not await self._queue.renew(shard, self._name, lease_seconds):
+                logging.warning(f"Lost the lease of shard {shard.shard} of {shard.stage}, another worker claimed it")
+                crawling.cancel()
+                await asyncio.gather(crawling, return_exceptions=True)
+                return
+        try:
+            crawled: bool = crawling.result()
+        except Exception:
+            logging.exception(f"Shard {shard.shard} of {shard.stage} failed")
+            crawled = False
+        if crawled:
+            await self._queue.complete(shard, self._name)
+            return
+        state: ShardState = await self._queue.release(shard, self._name, ApplicationConfiguration.SHARD_MAX_ATTEMPTS)
+        logging.warning(f"Released shard {shard.shard} of {shard.stage} after attempt {shard.attempts}, it is now {state}")
+
+    async def run(self) -> int:
+        shards: int = 0
+        while True:
+            shard: Shard | None = await self._queue.claim(self._name, ApplicationConfiguration.SHARD_LEASE_SECONDS,
+                                                          ApplicationConfiguration.SHARD_MAX_ATTEMPTS)
+            if shard is None:
+                if self._queue.is_finished(list(STAGES)):
+                    return shards
+                await asyncio.sleep(ApplicationConfiguration.SHARD_POLL_SECONDS)
+                continue
+            logging.info(f"Worker {self._name} claimed shard {shard.shard} of {shard.stage}, attempt {shard.attempts}")
+            await self.run_shard(shard)
+            shards += 1
+
+
+async def work() -> int:
+    queue: WorkQueue = WorkQueue(ApplicationConfiguration.WORK_QUEUE_FILE_PATH)
+    journal: Journal = Journal(ApplicationConfiguration.JOURNAL_FILE_PATH)
+    try:
+        async with HTTPClient() as http_client:
+            iceberg_client: IcebergClient = await asyncio.to_thread(IcebergClient)
+            with create_executor() as executor:
+                shards: int = await ShardWorker(queue, journal, http_client, iceberg_client, executor).run()
+    finally:
+        queue.close()
+        journal.close()
+    logging.info(f"Worker {get_worker_name()} finished after {shards} shards")
+    return shards
+
+
+def run_worker_process() -> None:
+    logging.basicConfig(level=logging.INFO, force=True)
+    asyncio.run(work())
+
+
+def start_worker_process() -> BaseProcess:
+    process: BaseProcess = multiprocessing.get_context('spawn').Process(target=run_worker_process, name='shard-worker')
+    process.start()
+    return process
+
+
+async def plan_courses(queue: WorkQueue, journal: Journal) -> None:
+    # Course pages are deduplicated across all study programs, like the course stage of a single process run does
+    course_index: CourseIndex = CourseIndex()
+    course_headers: list[CourseHeader] = []
+    for entry in (await journal.load(CURRICULA)).values():
+        for values in entry.rows:
+            course_header: CourseHeader | None = course_index.register(Curriculum(*values))
+            if course_header is not None:
+                course_headers.append(course_header)
+    course_index.report()
+    await queue.plan(COURSES.table_name, course_headers, ApplicationConfiguration.SHARD_SIZE)
+
+
+def format_status(status: dict[str, dict[ShardState, int]]) -> str:
+    return '; '.join(f"{stage}: " + ', '.join(f"{count} {state.lower()}" for state, count in states.items())
+                     for stage, states in status.items())
+
+
+async def coordinate(resume: bool = False) -> dict[str, int]:
+    if not ApplicationConfiguration.JOURNAL_ENABLED:
+        raise ValueError("Sharded runs keep the rows of the workers in the journal, JOURNAL_ENABLED must be true")
+    queue: WorkQueue = WorkQueue(ApplicationConfiguration.WORK_QUEUE_FILE_PATH)
+    if not resume:
+        queue.clear()
+    journal: Journal = Journal.from_configuration(resume)
+    await initialize()
+    if CURRICULA.table_name not in queue.planned_stages():
+        async with HTTPClient() as http_client:
+            study_programs, _ = await StudyProgramParser().crawl_sources(STUDY_PROGRAMS, http_client)
+        await queue.plan(CURRICULA.table_name, study_programs, ApplicationConfiguration.SHARD_SIZE)
+
+    logging.info(f"Starting {ApplicationConfiguration.SHARD_WORKERS} local shard workers")
+    workers: list[BaseProcess] = [start_worker_process() for _ in range(ApplicationConfiguration.SHARD_WORKERS)]
+    last_status: str = ''
+    try:
+        while not queue.is_finished(list(STAGES)):
+            if COURSES.table_name not in queue.planned_stages() and queue.is_finished([CURRICULA.table_name]):
+                await plan_courses(queue, journal)
+            # A crashed worker's shard is claimed by the others once its lease expires, the worker itself is replaced
+            for index, worker in enumerate(workers):
+                if not worker.is_alive() and worker.exitcode != 0:
+                    logging.warning(f"Shard worker {worker.pid} exited with code {worker.exitcode}, starting another one")
+                    workers[index] = start_worker_process()
+            status: str = format_status(queue.status())
+            if status != last_status:
+                logging.info(f"Shards: {status}")
+                last_status = status
+            await asyncio.sleep(ApplicationConfiguration.SHARD_POLL_SECONDS)
+    finally:
+        for worker in workers:
+            await asyncio.to_thread(worker.join, ApplicationConfiguration.SHARD_POLL_SECONDS * 10)
+            if worker.is_alive():
+                worker.terminate()
+    logging.info(f"All shards finished, {queue.retried_shards()} of them took more than one attempt. {format_status(queue.status())}")
+    queue.close()
+    journal.close()
+    # Every crawled page is in the journal, so resuming restores them and commits every table once.
+    # Pages of failed shards are not in the journal and are crawled by the merge itself
+    logging.info("Merging the rows of the shard workers")
+    return await main(resume=True)
@@ -4,12 +4,14 @@ from src.configurations import ApplicationConfiguration
 
 
 class CourseCorrector:
+    WORD_SEPARATORS_PATTERN: re.Pattern[str] = re.compile(r'[\s,;:/()\[\]]+')
 
     @staticmethod
-    def correct(fields: dict[str, str]) -> dict[str, str | None]:
+    def correct(fields: dict[str, str],
+                course_codes_regex: re.Pattern[str] = ApplicationConfiguration.COURSE_CODES_REGEX) -> dict[str, str | None]:
         course_name = fields.get('course_name_mk') or fields.get('course_name_en')
 
-        if course_name and re.search(ApplicationConfiguration.COURSE_CODES_REGEX, course_name):
+        if course_name and re.search(course_codes_regex, course_name):
             course_name_key = 'course_name_mk' if 'course_name_mk' in fields else 'course_name_en'
             fields.update({
                 'course_code': CourseCorrector.extract_course_code(course_name),
@@ -25,3 +27,10 @@ class CourseCorrector:
     @staticmethod
     def extract_course_name(course_name: str) -> str:
         return ' '.join(course_name.split(' ')[1:])
+
+    # Applies the course code rule of correct() to every word of a free text, e.g. a prerequisites cell
+    @staticmethod
+    def find_course_codes(text: str,
+                          course_codes_regex: re.Pattern[str] = ApplicationConfiguration.COURSE_CODES_REGEX) -> list[str]:
+        return [CourseCorrector.extract_course_code(word) for word in CourseCorrector.WORD_SEPARATORS_PATTERN.split(text)
+                if word and re.search(course_codes_regex, word)]
@@ -0,0 +1,111 @@
+import logging
+import re
+from dataclasses import dataclass, field
+
+from yarl import URL
+
+from src.configurations import SOURCES_BY_NAME
+from src.corrector import CourseCorrector
+from src.models.named_tuples import CourseHeader, Curriculum
+
+
+@dataclass
+class CourseIndexEntry:
+    course_header: CourseHeader
+    canonical_url: str
+    study_program_urls: set[str] = field(default_factory=set)
+
+
+class CourseIndex:
+    # Courses are keyed by their source, the same code or URL in two sources are two courses
+    DUPLICATE_SLASHES_PATTERN: re.Pattern[str] = re.compile(r'/{2,}')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self) -> None:
+        self._by_url: dict[tuple[str, str], CourseIndexEntry] = {}
+        self._by_code: dict[tuple[str, str], CourseIndexEntry] = {}
+        self._references: int = 0
+        self._url_hits: int = 0
+        self._code_hits: int = 0
+        # False when pages of the curricula stage failed, the index then misses the courses only they referenced
+        self.complete: bool = True
+
+    @classmethod
+    def normalize_url(cls, url: str) -> str:
+        parsed: URL = URL(url)
+        path: str = cls.DUPLICATE_SLASHES_PATTERN.sub('/', parsed.path).rstrip('/') or '/'
+        normalized: URL = parsed.with_fragment(None).with_path(path)
+        if parsed.host is not None and parsed.is_default_port():
+            normalized = normalized.with_port(None)
+        return str(normalized)
+
+    @staticmethod
+    def correct_code(course_header: CourseHeader) -> str:
+        return CourseCorrector.correct({
+            'course_code': course_header.course_code,
+            'course_name_mk': course_header.course_name_mk,
+        }, SOURCES_BY_NAME[course_header.source].course_codes_regex)['course_code'].strip().upper()
+
+    # Returns the course header of the curriculum row if its course page has not been seen in this run
+    def register(self, curriculum: Curriculum) -> CourseHeader | None:
+        course_header: CourseHeader = CourseHeader(
+            course_code=curriculum.course_code,
+            course_name_mk=curriculum.course_name_mk,
+            course_url=curriculum.course_url,
+            source=curriculum.source,
+        )
+        canonical_url: str = self.normalize_url(course_header.course_url)
+        url_key: tuple[str, str] = (course_header.source, canonical_url)
+        code_key: tuple[str, str] = (course_header.source, self.correct_code(course_header))
+        self._references += 1
+
+        entry: CourseIndexEntry | None = self._by_url.get(url_key)
+        if entry is not None:
+            self._url_hits += 1
+        elif (entry := self._by_code.get(code_key)) is not None:
+            self._code_hits += 1
+            self._by_url[url_key] = entry
+        if entry is not None:
+            entry.study_program_urls.add(curriculum.study_program_url)
+            return None
+
+        entry = CourseIndexEntry(course_header=course_header, canonical_url=canonical_url,
+                                 study_program_urls={curriculum.study_program_url})
+        self._by_url[url_key] = entry
+        self._by_code[code_key] = entry
+        return course_header
+
+    def get(self, source: str, course_code: str) -> CourseIndexEntry | None:
+        return self._by_code.get((source, course_code.strip().upper()))
+
+    def get_by_url(self, source: str, course_url: str) -> CourseIndexEntry | None:
+        return self._by_url.get((source, self.normalize_url(course_url)))
+
+    def course_codes(self, source: str) -> set[str]:
+        return {course_code for code_source, course_code in self._by_code if code_source == source}
+
+    def course_names(self, source: str) -> dict[str, str]:
+        # Case folded course names of the source and their course codes
+        return {entry.course_header.course_name_mk.strip().casefold(): course_code
+                for (code_source, course_code), entry in self._by_code.items()
+                if code_source == source and entry.course_header.course_name_mk.strip()}
+
+    def study_program_urls(self, source: str, course_code: str) -> set[str]:
+        entry: CourseIndexEntry | None = self.get(source, course_code)
+        return entry.study_program_urls if entry is not None else set()
+
+    def report(self) -> dict[str, int | float]:
+        hits: int = self._url_hits + self._code_hits
+        stats: dict[str, int | float] = {
+            'references': self._references,
+            'unique_courses': len(self._by_code),
+            'url_hits': self._url_hits,
+            'code_hits': self._code_hits,
+            'hit_rate': hits / self._references if self._references else 0.0,
+        }
+        logging.info(f"Course index: {stats['references']} curriculum references to {stats['unique_courses']} unique courses, "
+                     f"{self._url_hits} deduplicated by URL, {self._code_hits} by course code "
+                     f"(hit rate {stats['hit_rate']:.1%})")
+        return stats
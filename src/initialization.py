@@ -1,14 +1,39 @@
+import asyncio
+import hashlib
+import json
 import logging
+import os
+import time
 from pathlib import Path
-from miniopy_async import Minio
+from typing import TYPE_CHECKING
 import src.setup
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyiceberg.partitioning import PartitionSpec, PartitionField, UNPARTITIONED_PARTITION_SPEC
 from pyiceberg.schema import Schema
 from pyiceberg.catalog import Catalog
+from pyiceberg.table import Table
+from pyiceberg.table.sorting import SortOrder, SortField, UNSORTED_SORT_ORDER
+from pyiceberg.transforms import IdentityTransform
 
-from src.configurations import StorageConfiguration, COURSES, CURRICULA, STUDY_PROGRAMS, TableConfiguration
+from src.configurations import StorageConfiguration, ApplicationConfiguration, COURSES, CURRICULA, STUDY_PROGRAMS, \
+    PAGE_MANIFEST, PREREQUISITE_EDGES, PREREQUISITE_CLOSURE, TableConfiguration, SOURCES
 from src.models.enums import FileIOType
+from src.setup import ENVIRONMENT_VARIABLES
 from src.storage import IcebergClient
 
+if TYPE_CHECKING:
+    from miniopy_async import Minio
+
+DATASETS: list[TableConfiguration] = [
+    STUDY_PROGRAMS,
+    CURRICULA,
+    COURSES,
+    PAGE_MANIFEST,
+    PREREQUISITE_EDGES,
+    PREREQUISITE_CLOSURE,
+]
+
 
 async def create_warehouse_if_not_exists() -> None:
     if StorageConfiguration.FILE_IO_TYPE == FileIOType.LOCAL:
@@ -20,35 +45,131 @@ async def create_warehouse_if_not_exists() -> None:
         folder.mkdir(parents=True, exist_ok=True)
     elif StorageConfiguration.FILE_IO_TYPE == FileIOType.S3:
         bucket_name: str = StorageConfiguration.S3_ICEBERG_LAKEHOUSE_BUCKET_NAME
-        s3_client: Minio = IcebergClient().get_s3_client()
+        s3_client: 'Minio' = (await asyncio.to_thread(IcebergClient)).get_s3_client()
         if await s3_client.bucket_exists(bucket_name):
             logging.info(f"Bucket {bucket_name} already exists")
             return
         logging.info(f"Creating bucket '{bucket_name}'")
         await s3_client.make_bucket(bucket_name)
 
+
+def get_schema_fingerprint(namespace: str, dataset: TableConfiguration) -> str:
+    # A verified schema is only reused for the same catalog, warehouse, table, schema and write properties
+    catalog_prefix: str = f"PYICEBERG_CATALOG__{str(StorageConfiguration.ICEBERG_CATALOG_NAME).upper()}__"
+    catalog_properties: list[tuple[str, str]] = sorted((name, value) for name, value in ENVIRONMENT_VARIABLES.items()
+                                                       if name.startswith(catalog_prefix))
+    warehouse: str = str(StorageConfiguration.LOCAL_ICEBERG_LAKEHOUSE_FILE_PATH) \
+        if StorageConfiguration.FILE_IO_TYPE == FileIOType.LOCAL else StorageConfiguration.S3_ICEBERG_LAKEHOUSE_BUCKET_NAME
+    identity: str = json.dumps([StorageConfiguration.ICEBERG_CATALOG_NAME, catalog_properties, warehouse,
+                                namespace, dataset.table_name, str(dataset.schema), dataset.get_write_properties(),
+                                dataset.sort_columns, dataset.partition_columns])
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+def load_verified_schemas() -> dict[str, float]:
+    try:
+        return json.loads(ApplicationConfiguration.SCHEMA_CACHE_FILE_PATH.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_verified_schemas(verified_schemas: dict[str, float]) -> None:
+    file_path: Path = ApplicationConfiguration.SCHEMA_CACHE_FILE_PATH
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_file_path: Path = file_path.with_name(f".{file_path.name}.{os.getpid()}.tmp")
+    temporary_file_path.write_text(json.dumps(verified_schemas))
+    os.replace(temporary_file_path, file_path)
+
+
+def get_sort_order(dataset: TableConfiguration) -> SortOrder:
+    if not dataset.sort_columns:
+        return UNSORTED_SORT_ORDER
+    return SortOrder(*(SortField(source_id=dataset.schema.find_field(column).field_id, transform=IdentityTransform())
+                       for column in dataset.sort_columns))
+
+
+def get_partition_spec(dataset: TableConfiguration) -> PartitionSpec:
+    if not dataset.partition_columns:
+        return UNPARTITIONED_PARTITION_SPEC
+    return PartitionSpec(*(PartitionField(source_id=dataset.schema.find_field(column).field_id, field_id=1000 + index,
+                                          transform=IdentityTransform(), name=column)
+                           for index, column in enumerate(dataset.partition_columns)))
+
+
+def tag_rows_without_source(table: Table, table_identifier: str, dataset: TableConfiguration) -> None:
+    # Rows written before the table had a source column were scraped from what is now the first source,
+    # tagging them keeps MERGE from deleting them as rows with an unknown key
+    if table.current_snapshot() is None:
+        return
+    arrow_table: pa.Table = table.scan().to_arrow()
+    if not arrow_table.num_rows:
+        return
+    logging.info(f"Tagging {arrow_table.num_rows} rows of table '{table_identifier}' with source {SOURCES[0]}")
+    arrow_table = arrow_table.set_column(arrow_table.schema.get_field_index('source'), 'source',
+                                         pc.fill_null(arrow_table['source'], SOURCES[0].name))
+    table.overwrite(IcebergClient.sort_for_write(arrow_table, dataset))
+
+
+def create_table_if_not_exists(catalog: Catalog, table_identifier: str, dataset: TableConfiguration) -> None:
+    logging.info(f"Creating table '{table_identifier}'")
+    schema: Schema = dataset.schema
+    write_properties: dict[str, str] = dataset.get_write_properties()
+    table: Table = catalog.create_table_if_not_exists(table_identifier, schema, partition_spec=get_partition_spec(dataset),
+                                                      sort_order=get_sort_order(dataset), properties=write_properties)
+    added_columns: set[str] = {field.name for field in schema.fields} - {field.name for field in table.schema().fields}
+    if added_columns:
+        logging.info(f"Evolving schema of table '{table_identifier}'")
+        with table.update_schema() as update:
+            update.union_by_name(schema)
+    # Tables created before they were partitioned keep their data files, only new files are partitioned
+    partitioned_columns: set[str] = {table.schema().find_field(field.source_id).name for field in table.spec().fields}
+    missing_partition_columns: list[str] = [column for column in dataset.partition_columns if column not in partitioned_columns]
+    if missing_partition_columns:
+        logging.info(f"Partitioning table '{table_identifier}' by {', '.join(missing_partition_columns)}")
+        with table.update_spec() as update:
+            for column in missing_partition_columns:
+                update.add_identity(column)
+    if 'source' in added_columns:
+        tag_rows_without_source(table, table_identifier, dataset)
+    changed_properties: dict[str, str] = {name: value for name, value in write_properties.items() if table.properties.get(name) != value}
+    if changed_properties:
+        logging.info(f"Updating write properties of table '{table_identifier}': {changed_properties}")
+        with table.transaction() as transaction:
+            transaction.set_properties(changed_properties)
+
+
 async def initialize():
     logging.info("Initializing...")
+    namespace: str = StorageConfiguration.ICEBERG_NAMESPACE
+    started_at: float = time.time()
+    verified_schemas: dict[str, float] = load_verified_schemas()
+    fingerprints: dict[str, str] = {dataset.table_name: get_schema_fingerprint(namespace, dataset) for dataset in DATASETS}
+    unverified_datasets: list[TableConfiguration] = [
+        dataset for dataset in DATASETS
+        if started_at - verified_schemas.get(fingerprints[dataset.table_name], 0.0) >= ApplicationConfiguration.SCHEMA_CACHE_TTL_SECONDS
+    ]
+    if not unverified_datasets:
+        logging.info(f"Schemas of all tables were verified in the last {ApplicationConfiguration.SCHEMA_CACHE_TTL_SECONDS:g} seconds, "
+                     f"skipping initialization")
+        return
+
     await create_warehouse_if_not_exists()
-    iceberg_client: IcebergClient() = IcebergClient()
+    # Loading the catalog and the catalog round trips are blocking, so they run in threads and the tables are checked concurrently
+    iceberg_client: IcebergClient = await asyncio.to_thread(IcebergClient)
     catalog: Catalog = iceberg_client.get_catalog()
 
-    namespace: str = StorageConfiguration.ICEBERG_NAMESPACE
-
     logging.info(f"Creating namespace '{namespace}'")
-    catalog.create_namespace_if_not_exists(namespace)
-
-    datasets: list[TableConfiguration] = [
-        STUDY_PROGRAMS,
-        CURRICULA,
-        COURSES,
-    ]
+    await asyncio.to_thread(catalog.create_namespace_if_not_exists, namespace)
 
-    for dataset in datasets:
-        table_identifier: str = iceberg_client.get_table_identifier(namespace, dataset.table_name)
-        schema: Schema = dataset.schema
-        logging.info(f"Creating table '{table_identifier}'")
-        catalog.create_table_if_not_exists(table_identifier, schema)
+    await asyncio.gather(*(
+        asyncio.to_thread(create_table_if_not_exists, catalog, iceberg_client.get_table_identifier(namespace, dataset.table_name),
+                          dataset)
+        for dataset in unverified_datasets
+    ))
+    if ApplicationConfiguration.SCHEMA_CACHE_TTL_SECONDS > 0:
+        save_verified_schemas({
+            **{fingerprint: verified_at for fingerprint, verified_at in verified_schemas.items()
+               if started_at - verified_at < ApplicationConfiguration.SCHEMA_CACHE_TTL_SECONDS},
+            **{fingerprints[dataset.table_name]: started_at for dataset in unverified_datasets},
+        })
     logging.info("Initialization complete!")
-
-
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from src.configurations import ApplicationConfiguration, TableConfiguration
+from src.models.named_tuples import JournalEntry
+
+
+class Journal:
+    # Records every completed page with its parsed rows, so an interrupted run can be resumed
+    # without fetching and parsing the completed pages again
+    SCHEMA: str = '''
+        CREATE TABLE IF NOT EXISTS pages (
+            dataset TEXT NOT NULL,
+            page_url TEXT NOT NULL,
+            content_hash TEXT,
+            row_key TEXT,
+            rows TEXT NOT NULL,
+            completed_at REAL NOT NULL,
+            PRIMARY KEY (dataset, page_url)
+        );
+        CREATE TABLE IF NOT EXISTS commits (
+            dataset TEXT PRIMARY KEY,
+            committed_at REAL NOT NULL
+        );
+    '''
+
+    def __init__(self, file_path: Path):
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # Sharded workers in other processes record into the same journal, so writers wait for each other's locks
+        self._connection: sqlite3.Connection = sqlite3.connect(file_path, check_same_thread=False, timeout=30)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(self.SCHEMA)
+        self._lock: threading.Lock = threading.Lock()
+
+    @classmethod
+    def from_configuration(cls, resume: bool) -> 'Journal | None':
+        if not ApplicationConfiguration.JOURNAL_ENABLED:
+            if resume:
+                logging.warning("Cannot resume because the journal is disabled, starting from scratch")
+            return None
+        journal: Journal = cls(ApplicationConfiguration.JOURNAL_FILE_PATH)
+        if resume:
+            pages, committed_datasets = journal.summary()
+            logging.info(f"Resuming from {ApplicationConfiguration.JOURNAL_FILE_PATH} with {pages} completed pages"
+                         + (f", {', '.join(committed_datasets)} already committed" if committed_datasets else ''))
+        else:
+            journal.clear()
+        return journal
+
+    def summary(self) -> tuple[int, list[str]]:
+        with self._lock:
+            pages: int = self._connection.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+            committed_datasets: list[str] = [dataset for dataset, in self._connection.execute('SELECT dataset FROM commits')]
+        return pages, committed_datasets
+
+    def _load(self, dataset: TableConfiguration) -> dict[str, JournalEntry]:
+        with self._lock:
+            rows: list[tuple] = self._connection.execute(
+                'SELECT page_url, content_hash, row_key, rows FROM pages WHERE dataset = ?', (dataset.table_name,)
+            ).fetchall()
+        return {page_url: JournalEntry(page_url=page_url, content_hash=content_hash, row_key=row_key, rows=json.loads(page_rows))
+                for page_url, content_hash, row_key, page_rows in rows}
+
+    def _record(self, dataset: TableConfiguration, page_url: str, rows: list[NamedTuple],
+                content_hash: str | None, row_key: str | None) -> None:
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO pages (dataset, page_url, content_hash, row_key, rows, completed_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (dataset.table_name, page_url, content_hash, row_key, json.dumps(rows, ensure_ascii=False), time.time())
+            )
+            self._connection.commit()
+
+    def _completed(self, dataset: TableConfiguration, page_urls: list[str]) -> set[str]:
+        with self._lock:
+            return {page_url for page_url, in self._connection.execute(
+                f"SELECT page_url FROM pages WHERE dataset = ? AND page_url IN ({', '.join('?' * len(page_urls))})",
+                (dataset.table_name, *page_urls)
+            )}
+
+    async def load(self, dataset: TableConfiguration) -> dict[str, JournalEntry]:
+        return await asyncio.to_thread(self._load, dataset)
+
+    async def record(self, dataset: TableConfiguration, page_url: str, rows: list[NamedTuple],
+                     content_hash: str | None = None, row_key: str | None = None) -> None:
+        await asyncio.to_thread(self._record, dataset, page_url, rows, content_hash, row_key)
+
+    async def completed(self, dataset: TableConfiguration, page_urls: list[str]) -> set[str]:
+        return await asyncio.to_thread(self._completed, dataset, page_urls) if page_urls else set()
+
+    def is_committed(self, dataset: TableConfiguration) -> bool:
+        with self._lock:
+            return self._connection.execute('SELECT 1 FROM commits WHERE dataset = ?', (dataset.table_name,)).fetchone() is not None
+
+    def mark_committed(self, dataset: TableConfiguration) -> None:
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO commits (dataset, committed_at) VALUES (?, ?)',
+                                     (dataset.table_name, time.time()))
+            self._connection.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute('DELETE FROM pages')
+            self._connection.execute('DELETE FROM commits')
+            self._connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -1,54 +1,130 @@
+import argparse
 import asyncio
+import importlib
+import json
 import logging
-import ssl
+import multiprocessing
 import time
+from datetime import datetime, timezone
 import src.setup
-from src.configurations import StorageConfiguration, ApplicationConfiguration, COURSES, CURRICULA, STUDY_PROGRAMS
-from src.initialization import initialize
-from concurrent.futures import ThreadPoolExecutor
-import certifi
-from aiohttp import ClientSession
+from src.configurations import StorageConfiguration, ApplicationConfiguration, COURSES, CURRICULA, STUDY_PROGRAMS, SOURCES
+from src.journal import Journal
+from src.metrics import METRICS, write_run_report
+from src.profiling import profile_section, start_allocation_tracing, write_profiles, write_allocation_reports, \
+    initialize_worker as initialize_profiling_worker
+from src.models.enums import ExecutorType
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 
 from src.network import HTTPClient
-from src.parsers.course_parser import CourseParser
-from src.parsers.curriculum_parser import CurriculumParser
-from src.parsers.study_program_parser import StudyProgramParser
-from src.storage import IcebergClient
+
+# pyiceberg, pyarrow and the parsers take most of the startup time, so they are imported
+# in a worker thread while the study programs page is already being fetched
+STAGE_MODULES: tuple[str, ...] = (
+    'src.storage',
+    'src.initialization',
+    'src.parsers.study_program_parser',
+    'src.parsers.curriculum_parser',
+    'src.parsers.course_parser',
+)
 
 logging.basicConfig(level=logging.INFO, force=True)
 
 
-async def main():
+def initialize_worker() -> None:
+    logging.basicConfig(level=logging.INFO, force=True)
+    initialize_profiling_worker()
+
+
+def create_executor() -> Executor:
+    if ApplicationConfiguration.PARSER_EXECUTOR_TYPE == ExecutorType.PROCESS:
+        logging.info(f"Parsing pages in {ApplicationConfiguration.NUMBER_OF_PROCESSES} worker processes")
+        return ProcessPoolExecutor(max_workers=ApplicationConfiguration.NUMBER_OF_PROCESSES,
+                                   mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=initialize_worker)
+    logging.info(f"Parsing pages in {ApplicationConfiguration.NUMBER_OF_THREADS} worker threads")
+    return ThreadPoolExecutor(max_workers=ApplicationConfiguration.NUMBER_OF_THREADS)
+
+
+def import_stage_modules() -> None:
+    for module in STAGE_MODULES:
+        importlib.import_module(module)
+
+
+async def run_stages(journal: Journal | None) -> list[int]:
+    async with HTTPClient() as http_client:
+        for source in SOURCES:
+            http_client.prefetch(source.study_programs_url)
+        await asyncio.to_thread(import_stage_modules)
+        from src.initialization import initialize
+        from src.parsers.course_parser import CourseParser
+        from src.parsers.curriculum_parser import CurriculumParser
+        from src.parsers.study_program_parser import StudyProgramParser
+        from src.storage import IcebergClient
+
+        await initialize()
+        iceberg_client: IcebergClient = await asyncio.to_thread(IcebergClient)
+        tasks: list[asyncio.Task] = [asyncio.create_task(StudyProgramParser().run(iceberg_configuration=STUDY_PROGRAMS,
+                                                                                  http_client=http_client,
+                                                                                  iceberg_client=iceberg_client,
+                                                                                  journal=journal))]
+        with create_executor() as executor:
+            tasks.append(asyncio.create_task(CurriculumParser().run(executor=executor,
+                                                                    iceberg_configuration=CURRICULA,
+                                                                    http_client=http_client,
+                                                                    iceberg_client=iceberg_client,
+                                                                    journal=journal)))
+            tasks.append(asyncio.create_task(CourseParser().run(executor=executor,
+                                                                iceberg_configuration=COURSES,
+                                                                http_client=http_client,
+                                                                iceberg_client=iceberg_client,
+                                                                journal=journal)))
+            return await asyncio.gather(*tasks)
+
+
+async def main(resume: bool = False) -> dict[str, int]:
     logging.info("Starting...")
+    started_at: datetime = datetime.now(timezone.utc)
     start: float = time.perf_counter()
-    await initialize()
-    session: ClientSession = ClientSession()
-    ssl_context: ssl.SSLContext = ssl.create_default_context(cafile=certifi.where())
-    http_client: HTTPClient = HTTPClient()
-    iceberg_client: IcebergClient = IcebergClient()
-    tasks: list[asyncio.Task] = [asyncio.create_task(StudyProgramParser().run(session=session,
-                                                                              ssl_context=ssl_context,
-                                                                              iceberg_configuration=STUDY_PROGRAMS,
-                                                                              http_client=http_client,
-                                                                              iceberg_client=iceberg_client))]
-    with ThreadPoolExecutor(max_workers=ApplicationConfiguration.NUMBER_OF_THREADS) as executor:
-        tasks.append(asyncio.create_task(CurriculumParser().run(session=session,
-                                                                ssl_context=ssl_context,
-                                                                executor=executor,
-                                                                iceberg_configuration=CURRICULA,
-                                                                http_client=http_client,
-                                                                iceberg_client=iceberg_client
-                                                                )))
-        tasks.append(asyncio.create_task(CourseParser().run(session=session,
-                                                            ssl_context=ssl_context,
-                                                            executor=executor,
-                                                            iceberg_configuration=COURSES,
-                                                            http_client=http_client,
-                                                            iceberg_client=iceberg_client)))
-        await asyncio.gather(*tasks)
-    await session.close()
-    logging.info(f"Time taken: {time.perf_counter() - start:.2f} seconds")
+    METRICS.clear()
+    start_allocation_tracing()
+    # Without --resume the journal of a previous run is discarded, it is kept when a stage fails so the run can be resumed
+    journal: Journal | None = Journal.from_configuration(resume)
+    with profile_section('event_loop'):
+        rows_written: list[int] = await run_stages(journal)
+    if journal is not None:
+        journal.clear()
+        journal.close()
+    duration_seconds: float = time.perf_counter() - start
+    logging.info(f"Time taken: {duration_seconds:.2f} seconds")
+    write_allocation_reports()
+    write_profiles()
+    rows_per_table: dict[str, int] = {str(table): rows for table, rows in zip((STUDY_PROGRAMS, CURRICULA, COURSES), rows_written)}
+    report: dict = {
+        'started_at': started_at.isoformat(),
+        'duration_seconds': round(duration_seconds, 3),
+        'rows_written': rows_per_table,
+        'metrics': METRICS.report(),
+    }
+    print(json.dumps(report, ensure_ascii=False), flush=True)
+    write_run_report(report)
+    return rows_per_table
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Scrape the FINKI study programs, curricula and courses")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue an interrupted run from the journal instead of starting from scratch")
+    role = parser.add_mutually_exclusive_group()
+    role.add_argument('--coordinator', action='store_true',
+                      help="Split the pages into shards, crawl them with shard workers and merge their rows into the tables")
+    role.add_argument('--worker', action='store_true',
+                      help="Crawl shards from the work queue of a coordinator until all of them are finished")
+    arguments: argparse.Namespace = parser.parse_args()
+    if arguments.coordinator:
+        from src.coordinator import coordinate
+        asyncio.run(coordinate(resume=arguments.resume))
+    elif arguments.worker:
+        from src.coordinator import work
+        asyncio.run(work())
+    else:
+        asyncio.run(main(resume=arguments.resume))
@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse
+
+import src.setup
+from pyiceberg.exceptions import NoSuchTableError
+from pyiceberg.expressions import BooleanExpression, AlwaysTrue, And, EqualTo, IsNull
+from pyiceberg.partitioning import PartitionSpec
+from pyiceberg.table import Table
+from pyiceberg.transforms import IdentityTransform
+
+from src.configurations import StorageConfiguration, TableConfiguration
+from src.initialization import DATASETS
+from src.models.enums import FileIOType
+from src.models.named_tuples import StoredFile
+from src.storage import IcebergClient
+
+if TYPE_CHECKING:
+    from miniopy_async import Minio
+
+# pyiceberg writes data files of up to 512 MiB unless the table sets write.target-file-size-bytes
+DEFAULT_TARGET_FILE_SIZE_BYTES: int = 512 * 1024 * 1024
+
+
+def normalize_path(path: str) -> str:
+    # Referenced paths are URIs like file:///data/... or s3://bucket/..., listed files are compared without the scheme
+    parsed = urlparse(path)
+    return f"{parsed.netloc}{parsed.path}"
+
+
+def list_local_files(location: str) -> list[StoredFile]:
+    files: list[StoredFile] = []
+    for directory, _, file_names in os.walk(urlparse(location).path):
+        for file_name in file_names:
+            stat: os.stat_result = os.stat(os.path.join(directory, file_name))
+            files.append(StoredFile(path=os.path.join(directory, file_name), size=stat.st_size, modified_at=stat.st_mtime))
+    return files
+
+
+async def list_files(iceberg_client: IcebergClient, location: str) -> list[StoredFile]:
+    # The trailing slash keeps tables whose name starts with the name of this table out of the listing
+    if StorageConfiguration.FILE_IO_TYPE == FileIOType.LOCAL:
+        return await asyncio.to_thread(list_local_files, location.rstrip('/') + '/')
+    s3_client: 'Minio' = iceberg_client.get_s3_client()
+    parsed = urlparse(location)
+    return [StoredFile(path=f"{parsed.netloc}/{stored_object.object_name}", size=stored_object.size,
+                       modified_at=stored_object.last_modified.timestamp())
+            async for stored_object in s3_client.list_objects(parsed.netloc, prefix=parsed.path.strip('/') + '/', recursive=True)]
+
+
+async def delete_files(iceberg_client: IcebergClient, files: list[StoredFile]) -> None:
+    if StorageConfiguration.FILE_IO_TYPE == FileIOType.LOCAL:
+        for stored_file in files:
+            await asyncio.to_thread(os.remove, stored_file.path)
+        return
+    s3_client: 'Minio' = iceberg_client.get_s3_client()
+    for stored_file in files:
+        bucket_name, object_name = stored_file.path.split('/', 1)
+        await s3_client.remove_object(bucket_name, object_name)
+
+
+def get_referenced_files(table: Table) -> set[str]:
+    # Every file that the current metadata, its metadata log or a snapshot still points to
+    referenced: set[str] = {table.metadata_location, *(entry.metadata_file for entry in table.metadata.metadata_log),
+                            *(statistics.statistics_path for statistics in table.metadata.statistics),
+                            *(statistics.statistics_path for statistics in table.metadata.partition_statistics)}
+    manifest_paths: set[str] = set()
+    for snapshot in table.snapshots():
+        referenced.add(snapshot.manifest_list)
+        for manifest in snapshot.manifests(table.io):
+            # Snapshots share most of their manifests, each one is only read once
+            if manifest.manifest_path in manifest_paths:
+                continue
+            manifest_paths.add(manifest.manifest_path)
+            referenced.update(entry.data_file.file_path for entry in manifest.fetch_manifest_entry(table.io, discard_deleted=True))
+    return {normalize_path(path) for path in referenced | manifest_paths}
+
+
+def get_compaction_filters(table: Table, min_input_files: int) -> list[BooleanExpression]:
+    # A partition is rewritten when it has enough files below the target size, e.g. one small file per APPEND run
+    target_file_size_bytes: int = int(table.properties.get('write.target-file-size-bytes', DEFAULT_TARGET_FILE_SIZE_BYTES))
+    spec: PartitionSpec = table.spec()
+    partition_columns: list[str] = [table.schema().find_field(field.source_id).name for field in spec.fields]
+    identity_partitioned: bool = bool(spec.fields) and all(isinstance(field.transform, IdentityTransform) for field in spec.fields)
+    small_files: dict[tuple | None, int] = defaultdict(int)
+    for task in table.scan().plan_files():
+        if task.file.file_size_in_bytes >= target_file_size_bytes:
+            continue
+        # Files written before the table was partitioned can only be selected together with the whole table
+        partition: tuple | None = tuple(task.file.partition[index] for index in range(len(task.file.partition))) \
+            if identity_partitioned and task.file.spec_id == spec.spec_id else None
+        small_files[partition] += 1
+    if small_files.get(None, 0) >= min_input_files:
+        return [AlwaysTrue()]
+    row_filters: list[BooleanExpression] = []
+    for partition, count in small_files.items():
+        if partition is None or count < min_input_files:
+            continue
+        conditions: list[BooleanExpression] = [IsNull(column) if value is None else EqualTo(column, value)
+                                               for column, value in zip(partition_columns, partition)]
+        row_filters.append(conditions[0] if len(conditions) == 1 else And(*conditions))
+    return row_filters
+
+
+async def get_table_stats(iceberg_client: IcebergClient, table: Table) -> dict[str, int]:
+    data_files: list = await asyncio.to_thread(lambda: [task.file for task in table.scan().plan_files()])
+    stored_files: list[StoredFile] = await list_files(iceberg_client, table.location())
+    return {
+        'snapshots': len(table.snapshots()),
+        'data_files': len(data_files),
+        'data_bytes': sum(data_file.file_size_in_bytes for data_file in data_files),
+        'files': len(stored_files),
+        'bytes': sum(stored_file.size for stored_file in stored_files),
+    }
+
+
+async def maintain_table(iceberg_client: IcebergClient, dataset: TableConfiguration, dry_run: bool) -> dict | None:
+    try:
+        table: Table = await asyncio.to_thread(iceberg_client.get_table, dataset)
+    except NoSuchTableError:
+        logging.warning(f"Skipping maintenance of {dataset}, the table does not exist")
+        return None
+    before: dict[str, int] = await get_table_stats(iceberg_client, table)
+
+    row_filters: list[BooleanExpression] = await asyncio.to_thread(get_compaction_filters, table,
+                                                                   StorageConfiguration.MAINTENANCE_MIN_INPUT_FILES)
+    logging.info(f"Compacting {len(row_filters)} partitions of {dataset}: {', '.join(map(str, row_filters)) or 'none'}")
+    if not dry_run:
+        for row_filter in row_filters:
+            await iceberg_client.compact(dataset, row_filter)
+        table = iceberg_client.get_table(dataset)
+
+    # The current snapshot is never expired, the files of expired snapshots are removed as orphans below
+    older_than: datetime = datetime.fromtimestamp(time.time() - StorageConfiguration.MAINTENANCE_SNAPSHOT_RETENTION_SECONDS,
+                                                  timezone.utc)
+    expired_snapshots: int = sum(1 for snapshot in table.snapshots() if snapshot.timestamp_ms < older_than.timestamp() * 1000
+                                 and snapshot.snapshot_id != table.metadata.current_snapshot_id) if dry_run \
+        else await iceberg_client.expire_snapshots(dataset, older_than)
+    table = iceberg_client.get_table(dataset)
+
+    # Files younger than the minimum age may belong to a commit that is still in progress
+    referenced: set[str] = await asyncio.to_thread(get_referenced_files, table)
+    orphan_files: list[StoredFile] = [
+        stored_file for stored_file in await list_files(iceberg_client, table.location())
+        if normalize_path(stored_file.path) not in referenced
+        and time.time() - stored_file.modified_at >= StorageConfiguration.MAINTENANCE_ORPHAN_MIN_AGE_SECONDS
+    ]
+    logging.info(f"Removing {len(orphan_files)} orphan files of {dataset}")
+    if not dry_run:
+        await delete_files(iceberg_client, orphan_files)
+
+    return {
+        'before': before,
+        'after': await get_table_stats(iceberg_client, table),
+        'compacted_partitions': len(row_filters),
+        'expired_snapshots': expired_snapshots,
+        'orphan_files': len(orphan_files),
+        'orphan_bytes': sum(stored_file.size for stored_file in orphan_files),
+    }
+
+
+async def maintain(dry_run: bool = False) -> dict[str, dict]:
+    logging.info(f"Starting maintenance{' (dry run)' if dry_run else ''}...")
+    started_at: datetime = datetime.now(timezone.utc)
+    start: float = time.perf_counter()
+    iceberg_client: IcebergClient = await asyncio.to_thread(IcebergClient)
+    tables: list[dict | None] = await asyncio.gather(*(maintain_table(iceberg_client, dataset, dry_run) for dataset in DATASETS))
+    report: dict = {
+        'started_at': started_at.isoformat(),
+        'duration_seconds': round(time.perf_counter() - start, 3),
+        'dry_run': dry_run,
+        'tables': {str(dataset): table for dataset, table in zip(DATASETS, tables) if table is not None},
+    }
+    print(json.dumps(report, ensure_ascii=False), flush=True)
+    return report['tables']
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, force=True)
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="Compact small data files, expire old snapshots and remove orphan files of the scraper's tables")
+    parser.add_argument('--dry-run', action='store_true', help="Report what would be compacted, expired and removed without changing anything")
+    asyncio.run(maintain(dry_run=parser.parse_args().dry_run))
@@ -0,0 +1,97 @@
+import hashlib
+import logging
+from collections import Counter
+
+import pyarrow as pa
+from pyiceberg.expressions import EqualTo
+from pyiceberg.table import Table
+
+from src.configurations import TableConfiguration, PAGE_MANIFEST
+from src.models.enums import PageChangeType
+from src.storage import IcebergClient
+
+
+class PageManifest:
+
+    def __init__(self, dataset: TableConfiguration, previous_hashes: dict[str, str], previous_keys: dict[str, str]):
+        self._dataset: TableConfiguration = dataset
+        self._previous_hashes: dict[str, str] = previous_hashes
+        self._previous_keys: dict[str, str] = previous_keys
+        self._current_hashes: dict[str, str] = {}
+        self._current_keys: dict[str, str] = {}
+        self._changes: Counter[PageChangeType] = Counter()
+        self._complete: bool = True
+
+    @classmethod
+    async def load(cls, iceberg_client: IcebergClient, dataset: TableConfiguration) -> 'PageManifest':
+        return await iceberg_client.run_in_writer(cls._load, iceberg_client, dataset)
+
+    @classmethod
+    def _load(cls, iceberg_client: IcebergClient, dataset: TableConfiguration) -> 'PageManifest':
+        table: Table = iceberg_client.get_table(PAGE_MANIFEST)
+        previous: pa.Table = table.scan(
+            row_filter=EqualTo('dataset', dataset.table_name),
+            selected_fields=('page_url', 'content_hash', 'row_key'),
+        ).to_arrow()
+        page_urls: list[str] = previous['page_url'].to_pylist()
+        previous_hashes: dict[str, str] = dict(zip(page_urls, previous['content_hash'].to_pylist()))
+        previous_keys: dict[str, str] = {page_url: row_key for page_url, row_key in zip(page_urls, previous['row_key'].to_pylist())
+                                         if row_key is not None}
+        logging.info(f"Loaded {len(previous_hashes)} page hashes for {dataset} from {PAGE_MANIFEST}")
+        return cls(dataset=dataset, previous_hashes=previous_hashes, previous_keys=previous_keys)
+
+    @staticmethod
+    def compute_hash(page_content: bytes) -> str:
+        return hashlib.sha256(page_content).hexdigest()
+
+    def classify(self, page_url: str, page_content: bytes) -> PageChangeType:
+        return self.classify_hash(page_url, self.compute_hash(page_content))
+
+    def classify_hash(self, page_url: str, content_hash: str) -> PageChangeType:
+        self._current_hashes[page_url] = content_hash
+        previous_hash: str | None = self._previous_hashes.get(page_url)
+        if previous_hash is None:
+            change_type: PageChangeType = PageChangeType.NEW
+        elif previous_hash != content_hash:
+            change_type = PageChangeType.CHANGED
+        else:
+            change_type = PageChangeType.UNCHANGED
+        self._changes[change_type] += 1
+        return change_type
+
+    def record_key(self, page_url: str, row_key: str) -> None:
+        self._current_keys[page_url] = row_key
+
+    def current_hash(self, page_url: str) -> str | None:
+        return self._current_hashes.get(page_url)
+
+    def previous_key(self, page_url: str) -> str | None:
+        return self._previous_keys.get(page_url)
+
+    def mark_incomplete(self) -> None:
+        self._complete = False
+
+    def removed_urls(self) -> set[str]:
+        if not self._complete:
+            return set()
+        return self._previous_hashes.keys() - self._current_hashes.keys()
+
+    def report(self) -> dict[PageChangeType, int]:
+        changes: dict[PageChangeType, int] = {change_type: self._changes[change_type] for change_type in PageChangeType}
+        changes[PageChangeType.REMOVED] = len(self.removed_urls())
+        logging.info(f"Page changes for {self._dataset}"
+                     f"{'' if self._complete else ' (incomplete crawl, removed pages not counted)'}: "
+                     + ', '.join(f"{change_type.lower()}={count}" for change_type, count in changes.items()))
+        return changes
+
+    async def save(self, iceberg_client: IcebergClient) -> None:
+        hashes: dict[str, str] = self._current_hashes if self._complete else {**self._previous_hashes, **self._current_hashes}
+        keys: dict[str, str] = {**self._previous_keys, **self._current_keys}
+        rows: pa.Table = pa.Table.from_pydict({
+            'page_url': list(hashes.keys()),
+            'dataset': [self._dataset.table_name] * len(hashes),
+            'content_hash': list(hashes.values()),
+            'row_key': [keys.get(page_url) for page_url in hashes],
+        }, schema=PAGE_MANIFEST.schema.as_arrow())
+        await iceberg_client.overwrite(PAGE_MANIFEST, rows, overwrite_filter=EqualTo('dataset', self._dataset.table_name))
+        logging.info(f"Saved {rows.num_rows} page hashes for {self._dataset} to {PAGE_MANIFEST}")
@@ -0,0 +1,217 @@
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, TypeVar
+
+from src.configurations import ApplicationConfiguration
+
+T = TypeVar('T')
+Labels = tuple[tuple[str, str], ...]
+
+LATENCY_BUCKETS: tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def to_labels(labels: dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + '}'
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    TYPE: str = 'counter'
+
+    def __init__(self, name: str, description: str):
+        self.name: str = name
+        self.description: str = description
+        self._values: dict[Labels, float] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels: Any) -> None:
+        key: Labels = to_labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(to_labels(labels), 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def report(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return [{'labels': dict(labels), 'value': value} for labels, value in sorted(self._values.items())]
+
+    def to_prometheus(self) -> list[str]:
+        with self._lock:
+            return [f"{self.name}{format_labels(labels)} {format_value(value)}" for labels, value in sorted(self._values.items())]
+
+
+class HistogramSeries:
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.bucket_counts: list[int] = [0] * (len(buckets) + 1)
+        self.count: int = 0
+        self.sum: float = 0.0
+        self.min: float = math.inf
+        self.max: float = -math.inf
+
+    def observe(self, buckets: tuple[float, ...], value: float) -> None:
+        self.bucket_counts[bisect.bisect_left(buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    # Linear interpolation inside the bucket that holds the quantile, like Prometheus' histogram_quantile
+    def quantile(self, buckets: tuple[float, ...], quantile: float) -> float:
+        if not self.count:
+            return 0.0
+        rank: float = quantile * self.count
+        cumulative: int = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower: float = buckets[index - 1] if index > 0 else min(self.min, buckets[0])
+                upper: float = buckets[index] if index < len(buckets) else self.max
+                estimate: float = lower + (upper - lower) * (rank - cumulative) / bucket_count
+                return min(max(estimate, self.min), self.max)
+            cumulative += bucket_count
+        return self.max
+
+
+class Histogram:
+    TYPE: str = 'histogram'
+    QUANTILES: tuple[float, ...] = (0.5, 0.9, 0.99)
+
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name: str = name
+        self.description: str = description
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+        self._series: dict[Labels, HistogramSeries] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key: Labels = to_labels(labels)
+        with self._lock:
+            series: HistogramSeries | None = self._series.get(key)
+            if series is None:
+                series = self._series[key] = HistogramSeries(self.buckets)
+            series.observe(self.buckets, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def report(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return [{
+                'labels': dict(labels),
+                'count': series.count,
+                'sum': round(series.sum, 6),
+                'mean': round(series.sum / series.count, 6),
+                'min': round(series.min, 6),
+                'max': round(series.max, 6),
+                **{f"p{round(quantile * 100)}": round(series.quantile(self.buckets, quantile), 6) for quantile in self.QUANTILES},
+            } for labels, series in sorted(self._series.items()) if series.count]
+
+    def to_prometheus(self) -> list[str]:
+        lines: list[str] = []
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative: int = 0
+                for upper_bound, bucket_count in zip((*self.buckets, math.inf), series.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{format_labels((*labels, ('le', format_value(upper_bound))))} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(series.sum)}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {series.count}")
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self, prefix: str = 'scraper'):
+        self._prefix: str = prefix
+        self._metrics: dict[str, Counter | Histogram] = {}
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._register(Counter(f"{self._prefix}_{name}", description))
+
+    def histogram(self, name: str, description: str, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(f"{self._prefix}_{name}", description, buckets))
+
+    def _register(self, metric: Counter | Histogram) -> Counter | Histogram:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def clear(self) -> None:
+        for metric in self._metrics.values():
+            metric.clear()
+
+    def report(self) -> dict[str, list[dict[str, Any]]]:
+        return {name: series for name, metric in self._metrics.items() if (series := metric.report())}
+
+    def to_prometheus(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            samples: list[str] = metric.to_prometheus()
+            if samples:
+                lines.extend([f"# HELP {metric.name} {metric.description}", f"# TYPE {metric.name} {metric.TYPE}", *samples])
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, file_path: Path) -> None:
+        # The textfile collector may read the file at any time, so it is replaced atomically
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_file_path: Path = file_path.with_name(f".{file_path.name}.{os.getpid()}.tmp")
+        temporary_file_path.write_text(self.to_prometheus())
+        os.replace(temporary_file_path, file_path)
+
+
+# Runs in the parser executor, possibly in another process, so timestamps are wall clock time
+def run_timed(function: Callable[[], T], submitted_at: float) -> tuple[T, float, float]:
+    started_at: float = time.time()
+    result: T = function()
+    return result, max(started_at - submitted_at, 0.0), time.time() - started_at
+
+
+METRICS: MetricsRegistry = MetricsRegistry()
+
+HTTP_REQUESTS: Counter = METRICS.counter('http_requests_total', "HTTP responses received, by status code")
+HTTP_REQUEST_SECONDS: Histogram = METRICS.histogram('http_request_duration_seconds', "Duration of a single HTTP request attempt")
+HTTP_RETRIES: Counter = METRICS.counter('http_retries_total', "HTTP request attempts that were retried, by error")
+HTTP_RESPONSE_BYTES: Counter = METRICS.counter('http_response_bytes_total', "Bytes of HTTP response bodies downloaded")
+CIRCUIT_BREAKER_OPENINGS: Counter = METRICS.counter('circuit_breaker_openings_total', "Times the circuit breaker of a host opened")
+HTTP_CACHE_HITS: Counter = METRICS.counter('http_cache_hits_total', "Pages served from the HTTP response cache without a request")
+PAGES: Counter = METRICS.counter('pages_total', "Pages handled by each stage, by outcome")
+PARSE_QUEUE_WAIT_SECONDS: Histogram = METRICS.histogram('parse_queue_wait_seconds', "Time a page waited for a parser executor worker")
+PARSE_SECONDS: Histogram = METRICS.histogram('parse_duration_seconds', "Time spent parsing a page in the parser executor")
+ROWS_WRITTEN: Counter = METRICS.counter('rows_written_total', "Rows committed to each Iceberg table")
+COMMIT_SECONDS: Histogram = METRICS.histogram('commit_duration_seconds', "Duration of Iceberg commits, by table and operation")
+COMMIT_RETRIES: Counter = METRICS.counter('commit_retries_total', "Iceberg commits retried after a conflict with another writer")
+
+
+def write_run_report(report: dict[str, Any]) -> None:
+    if ApplicationConfiguration.RUN_REPORT_FILE_PATH is not None:
+        ApplicationConfiguration.RUN_REPORT_FILE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        ApplicationConfiguration.RUN_REPORT_FILE_PATH.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    if ApplicationConfiguration.PROMETHEUS_TEXTFILE_PATH is not None:
+        METRICS.write_prometheus(ApplicationConfiguration.PROMETHEUS_TEXTFILE_PATH)
@@ -0,0 +1,44 @@
+from typing import NamedTuple, Any
+
+import pyarrow as pa
+
+
+class ColumnarBuilder:
+
+    def __init__(self, arrow_schema: pa.Schema, dictionary_columns: tuple[str, ...] = ()):
+        self._arrow_schema: pa.Schema = arrow_schema
+        self._dictionary_columns: frozenset[str] = frozenset(dictionary_columns)
+        self._columns: list[list[Any]] = [[] for _ in arrow_schema]
+        self._positions: tuple[int, ...] | None = None
+        self._encoded_schema: pa.Schema = pa.schema([
+            field.with_type(pa.dictionary(pa.int32(), field.type)) if field.name in self._dictionary_columns else field
+            for field in arrow_schema
+        ])
+
+    def __len__(self) -> int:
+        return len(self._columns[0])
+
+    def get_schema(self) -> pa.Schema:
+        return self._encoded_schema
+
+    def append(self, row: NamedTuple) -> None:
+        if self._positions is None:
+            self._positions = tuple(row._fields.index(name) for name in self._arrow_schema.names)
+        for column, position in zip(self._columns, self._positions):
+            column.append(row[position])
+
+    def detach(self) -> list[list[Any]]:
+        # Hands the buffered values over, so they can be converted in another thread while new rows are appended
+        columns: list[list[Any]] = self._columns
+        self._columns = [[] for _ in self._arrow_schema]
+        return columns
+
+    def build_record_batch(self, columns: list[list[Any]]) -> pa.RecordBatch:
+        arrays: list[pa.Array] = []
+        for field, values in zip(self._arrow_schema, columns):
+            array: pa.Array = pa.array(values, type=field.type)
+            arrays.append(array.dictionary_encode() if field.name in self._dictionary_columns else array)
+        return pa.RecordBatch.from_arrays(arrays, schema=self._encoded_schema)
+
+    def to_record_batch(self) -> pa.RecordBatch:
+        return self.build_record_batch(self.detach())
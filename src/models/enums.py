@@ -25,4 +25,61 @@ class CourseSemesterSeasonType(UpperStrEnum):
 
 class FileIOType(UpperStrEnum):
     S3 = auto()
-    LOCAL = auto()
\ No newline at end of file
+    LOCAL = auto()
+
+
+class PageChangeType(UpperStrEnum):
+    NEW = auto()
+    CHANGED = auto()
+    UNCHANGED = auto()
+    REMOVED = auto()
+
+
+class WriteMode(UpperStrEnum):
+    APPEND = auto()
+    MERGE = auto()
+    OVERWRITE = auto()
+
+
+class SinkCommitMode(UpperStrEnum):
+    ONCE = auto()
+    PER_BATCH = auto()
+
+
+class CurriculaLayout(UpperStrEnum):
+    WIDE = auto()
+    NORMALIZED = auto()
+
+
+class ShardState(UpperStrEnum):
+    PENDING = auto()
+    LEASED = auto()
+    DONE = auto()
+    FAILED = auto()
+
+
+class ExecutorType(UpperStrEnum):
+    THREAD = auto()
+    PROCESS = auto()
+
+
+class ParserBackendType(UpperStrEnum):
+    LXML = auto()
+    BEAUTIFULSOUP = auto()
+
+
+class HTTPCacheMode(UpperStrEnum):
+    DISABLED = auto()
+    REVALIDATE = auto()
+    CACHE_ONLY = auto()
+
+
+class CircuitState(UpperStrEnum):
+    CLOSED = auto()
+    OPEN = auto()
+    HALF_OPEN = auto()
+
+
+class PrerequisiteResolution(UpperStrEnum):
+    CODE = auto()
+    NAME = auto()
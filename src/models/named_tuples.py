@@ -1,22 +1,31 @@
 from typing import NamedTuple
 
-StudyProgram = NamedTuple('StudyProgram', [('study_program_name', str), ('study_program_duration', int), ('study_program_url', str)])
+StudyProgram = NamedTuple('StudyProgram', [
+    ('study_program_name', str),
+    ('study_program_duration', int),
+    ('study_program_url', str),
+    ('study_program_id', int),
+    ('source', str),
+])
 
 CourseHeader = NamedTuple('CourseHeader', [
     ('course_code', str),
     ('course_name_mk', str),
     ('course_url', str),
+    ('source', str),
 ])
 
 Curriculum = NamedTuple('Curriculum', [
     ('study_program_name', str),
     ('study_program_duration', int),
     ('study_program_url', str),
+    ('study_program_id', int),
     ('course_code', str),
     ('course_name_mk', str),
     ('course_url', str),
     ('course_semester', int),
     ('course_type', str),
+    ('source', str),
 ])
 
 Course = NamedTuple('Course', [
@@ -27,5 +36,48 @@ Course = NamedTuple('Course', [
     ('course_professors', str),
     ('course_prerequisites', str),
     ('course_competence', str),
-    ('course_content', str)
+    ('course_content', str),
+    ('source', str),
+])
+
+CachedResponse = NamedTuple('CachedResponse', [
+    ('url', str),
+    ('body', bytes),
+    ('etag', str | None),
+    ('last_modified', str | None),
+    ('stored_at', float),
+])
+
+JournalEntry = NamedTuple('JournalEntry', [
+    ('page_url', str),
+    ('content_hash', str | None),
+    ('row_key', str | None),
+    ('rows', list[list]),
+])
+
+Shard = NamedTuple('Shard', [
+    ('stage', str),
+    ('shard', int),
+    ('items', list[list]),
+    ('attempts', int),
+])
+
+StoredFile = NamedTuple('StoredFile', [
+    ('path', str),
+    ('size', int),
+    ('modified_at', float),
+])
+
+PrerequisiteEdge = NamedTuple('PrerequisiteEdge', [
+    ('source', str),
+    ('course_code', str),
+    ('prerequisite_code', str),
+    ('resolved_by', str),
+])
+
+PrerequisitePath = NamedTuple('PrerequisitePath', [
+    ('source', str),
+    ('course_code', str),
+    ('prerequisite_code', str),
+    ('depth', int),
 ])
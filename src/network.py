@@ -1,29 +1,327 @@
 import asyncio
 import logging
-from ssl import SSLContext
-from typing import NamedTuple
+import ssl
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from http import HTTPStatus
+from typing import NamedTuple, AsyncIterator
 
-from aiohttp import ClientError, ClientTimeout, ClientSession
-
-from tenacity import retry, wait_fixed, retry_if_exception_type, stop_after_attempt
+import certifi
+from aiohttp import ClientError, ClientTimeout, ClientSession, TCPConnector
+from tenacity import retry, wait_exponential_jitter, retry_if_exception_type, stop_after_attempt, RetryCallState
+from yarl import URL
 
+from src.cache import ResponseCache
 from src.configurations import ApplicationConfiguration
+from src.metrics import HTTP_REQUESTS, HTTP_REQUEST_SECONDS, HTTP_RETRIES, HTTP_RESPONSE_BYTES, HTTP_CACHE_HITS, \
+    CIRCUIT_BREAKER_OPENINGS
+from src.models.enums import HTTPCacheMode, CircuitState
+from src.models.named_tuples import CachedResponse
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, capacity: float):
+        self._rate: float = rate
+        self._capacity: float = max(capacity, 1.0)
+        self._tokens: float = self._capacity
+        self._updated_at: float = time.monotonic()
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now: float = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        if self._rate <= 0:
+            return
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+                self._refill()
+            self._tokens -= 1
+
+
+RETRYABLE_STATUSES: frozenset[int] = frozenset({
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+})
+
+
+class RetryableStatusError(Exception):
+
+    def __init__(self, url: str, status: int, retry_after: float | None):
+        super().__init__(f"Got HTTP status {status} for {url}")
+        self.status: int = status
+        self.retry_after: float | None = retry_after
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at: datetime = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+BACKOFF = wait_exponential_jitter(initial=ApplicationConfiguration.REQUESTS_RETRY_DELAY_SECONDS,
+                                  max=ApplicationConfiguration.REQUESTS_RETRY_MAX_DELAY_SECONDS,
+                                  jitter=ApplicationConfiguration.REQUESTS_RETRY_DELAY_SECONDS)
+
+
+def wait_for_retry(retry_state: RetryCallState) -> float:
+    exception: BaseException | None = retry_state.outcome.exception()
+    if isinstance(exception, RetryableStatusError) and exception.retry_after is not None:
+        return min(exception.retry_after, ApplicationConfiguration.REQUESTS_RETRY_MAX_DELAY_SECONDS)
+    return BACKOFF(retry_state)
+
+
+def count_retry(retry_state: RetryCallState) -> None:
+    exception: BaseException | None = retry_state.outcome.exception()
+    HTTP_RETRIES.inc(error=exception.status if isinstance(exception, RetryableStatusError) else type(exception).__name__)
+
+
+class CircuitBreaker:
+    # Opens after consecutive failures of a host or a Retry-After, pausing every request to the host.
+    # Once the cooldown has passed a single probe request is let through, which closes the breaker if it succeeds
+    # and reopens it with a doubled cooldown if it fails.
+
+    def __init__(self, host: str):
+        self._host: str = host
+        self._state: CircuitState = CircuitState.CLOSED
+        self._consecutive_failures: int = 0
+        self._consecutive_openings: int = 0
+        self._open_until: float = 0.0
+        self._probing: bool = False
+        self._state_changed: asyncio.Event = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._state_changed.set()
+        self._state_changed = asyncio.Event()
+
+    async def _acquire(self) -> bool:
+        while True:
+            delay: float = self._open_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif self._state == CircuitState.CLOSED:
+                return False
+            elif not self._probing:
+                self._state = CircuitState.HALF_OPEN
+                self._probing = True
+                return True
+            else:
+                await self._state_changed.wait()
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        is_probe: bool = await self._acquire()
+        try:
+            yield
+        finally:
+            if is_probe and self._probing:
+                self._probing = False
+                self._notify()
+
+    def record_success(self) -> None:
+        # Requests that were already in flight when the breaker opened do not close it, only the probe does
+        if self._state == CircuitState.OPEN:
+            return
+        self._consecutive_failures = 0
+        if self._state == CircuitState.HALF_OPEN:
+            logging.info(f"Closing the circuit breaker of {self._host}")
+            self._state = CircuitState.CLOSED
+            self._consecutive_openings = 0
+            self._probing = False
+            self._notify()
+
+    def record_failure(self, retry_after: float | None = None) -> None:
+        self._consecutive_failures += 1
+        now: float = time.monotonic()
+        if retry_after is not None:
+            self._open_until = max(self._open_until, now + min(retry_after, ApplicationConfiguration.CIRCUIT_BREAKER_MAX_COOLDOWN_SECONDS))
+        # Failures of requests that were already in flight when the breaker opened do not extend the cooldown
+        if self._state == CircuitState.OPEN:
+            return
+        if (retry_after is None and self._state == CircuitState.CLOSED
+                and self._consecutive_failures < ApplicationConfiguration.CIRCUIT_BREAKER_FAILURE_THRESHOLD):
+            return
+        self._consecutive_openings += 1
+        cooldown: float = min(ApplicationConfiguration.CIRCUIT_BREAKER_COOLDOWN_SECONDS * 2 ** (self._consecutive_openings - 1),
+                              ApplicationConfiguration.CIRCUIT_BREAKER_MAX_COOLDOWN_SECONDS)
+        self._open_until = max(self._open_until, now + cooldown)
+        logging.warning(f"{'Opening' if self._state == CircuitState.CLOSED else 'Reopening'} the circuit breaker of {self._host} "
+                        f"for {self._open_until - now:.1f} seconds after {self._consecutive_failures} consecutive failures")
+        CIRCUIT_BREAKER_OPENINGS.inc(host=self._host)
+        self._state = CircuitState.OPEN
+        self._probing = False
+        self._notify()
 
 
 class HTTPClient:
 
+    def __init__(self):
+        self._ssl_context: ssl.SSLContext = ssl.create_default_context(cafile=certifi.where())
+        self._session: ClientSession | None = None
+        self._semaphore: asyncio.Semaphore = asyncio.Semaphore(ApplicationConfiguration.MAX_CONCURRENT_REQUESTS)
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+        self._circuit_breakers: dict[str, CircuitBreaker] = {}
+        self._token_bucket: TokenBucket = TokenBucket(rate=ApplicationConfiguration.REQUESTS_PER_SECOND,
+                                                      capacity=ApplicationConfiguration.REQUESTS_BURST_SIZE)
+        self._cache: ResponseCache | None = ResponseCache.from_configuration()
+        self._prefetches: dict[str, asyncio.Task[tuple[int, bytes]]] = {}
+
+    async def __aenter__(self) -> 'HTTPClient':
+        self.get_session()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    def get_ssl_context(self) -> ssl.SSLContext:
+        return self._ssl_context
+
+    def get_session(self) -> ClientSession:
+        if self._session is None or self._session.closed:
+            connector: TCPConnector = TCPConnector(
+                ssl=self._ssl_context,
+                limit=ApplicationConfiguration.MAX_CONCURRENT_REQUESTS,
+                limit_per_host=ApplicationConfiguration.MAX_CONCURRENT_REQUESTS_PER_HOST,
+                ttl_dns_cache=ApplicationConfiguration.DNS_CACHE_TTL_SECONDS,
+                keepalive_timeout=ApplicationConfiguration.KEEPALIVE_TIMEOUT_SECONDS,
+                enable_cleanup_closed=True,
+            )
+            self._session = ClientSession(
+                connector=connector,
+                timeout=ClientTimeout(total=ApplicationConfiguration.REQUESTS_TIMEOUT_SECONDS),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        for prefetch in self._prefetches.values():
+            prefetch.cancel()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        if self._cache is not None:
+            self._cache.close()
+
+    @asynccontextmanager
+    async def _acquire_slot(self, url: str) -> AsyncIterator[None]:
+        host: str = URL(url).host or ''
+        host_semaphore: asyncio.Semaphore = self._host_semaphores.setdefault(
+            host, asyncio.Semaphore(ApplicationConfiguration.MAX_CONCURRENT_REQUESTS_PER_HOST))
+        async with self._semaphore, host_semaphore:
+            await self._token_bucket.acquire()
+            yield
+
+    def get_circuit_breaker(self, url: str) -> CircuitBreaker:
+        host: str = URL(url).host or ''
+        circuit_breaker: CircuitBreaker | None = self._circuit_breakers.get(host)
+        if circuit_breaker is None:
+            circuit_breaker = self._circuit_breakers[host] = CircuitBreaker(host)
+        return circuit_breaker
+
     @retry(
         stop=stop_after_attempt(ApplicationConfiguration.REQUEST_RETRY_COUNT),
-        wait=wait_fixed(ApplicationConfiguration.REQUESTS_RETRY_DELAY_SECONDS),
-        retry=retry_if_exception_type((asyncio.TimeoutError, ClientError)),
+        wait=wait_for_retry,
+        retry=retry_if_exception_type((asyncio.TimeoutError, ClientError, RetryableStatusError)),
+        before_sleep=count_retry,
         reraise=True
     )
-    async def fetch_page(self, session: ClientSession, ssl_context: SSLContext, url: str) -> tuple[int, str]:
-        async with session.get(url, ssl=ssl_context, timeout=ClientTimeout(total=ApplicationConfiguration.REQUESTS_TIMEOUT_SECONDS)) as response:
-                logging.info(f"Fetching page {url}")
-                return response.status, await response.text()
-
-    async def fetch_page_wrapper(self, session: ClientSession, ssl_context: SSLContext, url: str,
-                                 named_tuple: NamedTuple) -> tuple[int, str, NamedTuple]:
-        http_status, page_content = await self.fetch_page(session, ssl_context, url)
+    async def _request(self, url: str, cached_response: CachedResponse | None) -> tuple[int, bytes]:
+        headers: dict[str, str] = {}
+        if cached_response is not None:
+            if cached_response.etag:
+                headers['If-None-Match'] = cached_response.etag
+            if cached_response.last_modified:
+                headers['If-Modified-Since'] = cached_response.last_modified
+        circuit_breaker: CircuitBreaker = self.get_circuit_breaker(url)
+        async with circuit_breaker.guard():
+            try:
+                async with self._acquire_slot(url):
+                    start: float = time.perf_counter()
+                    async with self.get_session().get(url, headers=headers) as response:
+                        logging.info(f"Fetching page {url}")
+                        HTTP_REQUESTS.inc(status=response.status)
+                        if response.status in RETRYABLE_STATUSES:
+                            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start)
+                            retry_after: float | None = parse_retry_after(response.headers.get('Retry-After'))
+                            circuit_breaker.record_failure(retry_after)
+                            raise RetryableStatusError(url, response.status, retry_after)
+                        circuit_breaker.record_success()
+                        if response.status == HTTPStatus.NOT_MODIFIED and cached_response is not None:
+                            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start)
+                            await self._cache.touch(url)
+                            return HTTPStatus.OK, cached_response.body
+                        body: bytes = await response.read()
+                        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start)
+                        HTTP_RESPONSE_BYTES.inc(len(body))
+                        if response.status == HTTPStatus.OK and self._cache is not None:
+                            await self._cache.put(CachedResponse(
+                                url=url,
+                                body=body,
+                                etag=response.headers.get('ETag'),
+                                last_modified=response.headers.get('Last-Modified'),
+                                stored_at=time.time(),
+                            ))
+                        return response.status, body
+            except (asyncio.TimeoutError, ClientError):
+                circuit_breaker.record_failure()
+                raise
+
+    def prefetch(self, url: str) -> None:
+        # Starts fetching a page before its stage asks for it, the next fetch_page() of the url awaits this request
+        if url not in self._prefetches:
+            self._prefetches[url] = asyncio.create_task(self._fetch_page(url))
+
+    async def fetch_page(self, url: str) -> tuple[int, bytes]:
+        prefetch: asyncio.Task[tuple[int, bytes]] | None = self._prefetches.pop(url, None)
+        if prefetch is not None:
+            return await prefetch
+        return await self._fetch_page(url)
+
+    async def _fetch_page(self, url: str) -> tuple[int, bytes]:
+        cached_response: CachedResponse | None = None
+        if self._cache is not None:
+            cached_response = await self._cache.get(url)
+            if cached_response is not None and (self._cache.is_fresh(cached_response)
+                                                or ApplicationConfiguration.HTTP_CACHE_MODE == HTTPCacheMode.CACHE_ONLY):
+                logging.info(f"Using cached page {url}")
+                HTTP_CACHE_HITS.inc()
+                return HTTPStatus.OK, cached_response.body
+            if ApplicationConfiguration.HTTP_CACHE_MODE == HTTPCacheMode.CACHE_ONLY:
+                logging.warning(f"Page {url} is not cached and the HTTP cache is in {HTTPCacheMode.CACHE_ONLY} mode")
+                return HTTPStatus.GATEWAY_TIMEOUT, b''
+        try:
+            return await self._request(url, cached_response)
+        except RetryableStatusError as error:
+            logging.warning(f"Giving up on {url} after {ApplicationConfiguration.REQUEST_RETRY_COUNT} attempts: {error}")
+            return error.status, b''
+        except (asyncio.TimeoutError, ClientError) as error:
+            # Network errors are reported like a gateway timeout so the stages can collect the page and retry it later
+            logging.warning(f"Giving up on {url} after {ApplicationConfiguration.REQUEST_RETRY_COUNT} attempts: "
+                            f"{type(error).__name__} {error}")
+            return HTTPStatus.GATEWAY_TIMEOUT, b''
+
+    async def fetch_page_wrapper(self, url: str, named_tuple: NamedTuple) -> tuple[int, bytes, NamedTuple]:
+        http_status, page_content = await self.fetch_page(url)
         return http_status, page_content, named_tuple
+
+    def submit(self, url: str, named_tuple: NamedTuple) -> asyncio.Task[tuple[int, bytes, NamedTuple]]:
+        return asyncio.create_task(self.fetch_page_wrapper(url=url, named_tuple=named_tuple))
@@ -1,43 +1,314 @@
-from abc import abstractmethod
+import asyncio
+import logging
+import re
+import sys
+import time
+from abc import ABC, abstractmethod
 from concurrent.futures import Executor
-from ssl import SSLContext
-from typing import NamedTuple
+from functools import partial
+from typing import NamedTuple, Coroutine, Callable, Any, TypeVar
 
-from aiohttp import ClientSession
-from bs4 import Tag, BeautifulSoup
+import lxml.html
+from bs4 import Tag, BeautifulSoup, UnicodeDammit
+from lxml import etree
 
-from src.configurations import ApplicationConfiguration, TableConfiguration
+from src.configurations import ApplicationConfiguration, TableConfiguration, SourceConfiguration, SOURCES
+from src.journal import Journal
+from src.metrics import run_timed, PARSE_QUEUE_WAIT_SECONDS, PARSE_SECONDS, PAGES
+from src.profiling import run_profiled
+from src.models.enums import ParserBackendType
+from src.models.named_tuples import JournalEntry
 from src.network import HTTPClient
-from src.storage import IcebergClient
+from src.storage import IcebergClient, IcebergSink
 
 
-class Parser:
+class BoundedTasks:
 
-    @classmethod
-    async def parse_row(cls, *args, **kwargs) -> NamedTuple:
+    def __init__(self, limit: int):
+        self._semaphore: asyncio.Semaphore = asyncio.Semaphore(limit)
+        self._pending: set[asyncio.Task] = set()
+        self._errors: list[BaseException] = []
+
+    async def submit(self, coroutine: Coroutine) -> None:
+        await self._semaphore.acquire()
+        task: asyncio.Task = asyncio.create_task(coroutine)
+        self._pending.add(task)
+        task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._pending.discard(task)
+        self._semaphore.release()
+        if not task.cancelled() and task.exception() is not None:
+            self._errors.append(task.exception())
+
+    async def join(self) -> None:
+        while self._pending:
+            await asyncio.wait(set(self._pending))
+        if self._errors:
+            raise self._errors[0]
+
+
+Node = Tag | lxml.html.HtmlElement
+T = TypeVar('T')
+
+
+class ParserBackend(ABC):
+
+    @abstractmethod
+    def parse(self, html: bytes) -> Node:
+        raise NotImplementedError
+
+    @abstractmethod
+    def select(self, node: Node, selector: str) -> list[Node]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def select_one(self, node: Node, selector: str) -> Node | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def text(self, node: Node) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def attribute(self, node: Node, name: str) -> str | None:
+        raise NotImplementedError
+
+    def prepare(self, selectors: list[str]) -> None:
         pass
 
+
+class BeautifulSoupBackend(ParserBackend):
+
+    def parse(self, html: bytes) -> BeautifulSoup:
+        return BeautifulSoup(html, 'lxml')
+
+    def select(self, node: Tag, selector: str) -> list[Tag]:
+        return node.select(selector)
+
+    def select_one(self, node: Tag, selector: str) -> Tag | None:
+        return node.select_one(selector)
+
+    def text(self, node: Tag) -> str:
+        return node.text
+
+    def attribute(self, node: Tag, name: str) -> str | None:
+        return node.get(name)
+
+
+class LxmlBackend(ParserBackend):
+    # Supports the CSS subset used by the parsers: type and universal selectors, classes, [attribute],
+    # :nth-child(n) and the descendant and child combinators.
+    COMPOUND_SELECTOR_PATTERN: re.Pattern[str] = re.compile(
+        r'(?P<tag>[a-zA-Z][\w-]*|\*)?(?P<filters>(?:\.[\w-]+|\[[\w-]+\]|:nth-child\(\d+\))*)')
+    FILTER_PATTERN: re.Pattern[str] = re.compile(
+        r'\.(?P<class_name>[\w-]+)|\[(?P<attribute>[\w-]+)\]|:nth-child\((?P<position>\d+)\)')
+    COMPILED_SELECTORS: dict[str, etree.XPath] = {}
+
+    @classmethod
+    def to_xpath(cls, selector: str) -> str:
+        steps: list[str] = []
+        axis: str = 'descendant::'
+        for token in selector.replace('>', ' > ').split():
+            if token == '>':
+                if not steps or axis == 'child::':
+                    raise ValueError(f"Unsupported CSS selector {selector!r}")
+                axis = 'child::'
+                continue
+            match: re.Match[str] | None = cls.COMPOUND_SELECTOR_PATTERN.fullmatch(token)
+            if match is None or not token:
+                raise ValueError(f"Unsupported CSS selector {selector!r}")
+            predicates: list[str] = []
+            for selector_filter in cls.FILTER_PATTERN.finditer(match['filters']):
+                if selector_filter['class_name']:
+                    predicates.append(f"contains(concat(' ', normalize-space(@class), ' '), ' {selector_filter['class_name']} ')")
+                elif selector_filter['attribute']:
+                    predicates.append(f"@{selector_filter['attribute']}")
+                else:
+                    predicates.append(f"count(preceding-sibling::*) = {int(selector_filter['position']) - 1}")
+            steps.append(axis + (match['tag'] or '*').lower() + ''.join(f'[{predicate}]' for predicate in predicates))
+            axis = 'descendant::'
+        if not steps or axis == 'child::':
+            raise ValueError(f"Unsupported CSS selector {selector!r}")
+        return '/'.join(steps)
+
     @classmethod
-    async def parse_data(cls, *args, **kwargs) -> list[NamedTuple]:
+    def compile(cls, selector: str) -> etree.XPath:
+        compiled: etree.XPath | None = cls.COMPILED_SELECTORS.get(selector)
+        if compiled is None:
+            compiled = cls.COMPILED_SELECTORS[selector] = etree.XPath(cls.to_xpath(selector))
+        return compiled
+
+    def prepare(self, selectors: list[str]) -> None:
+        for selector in selectors:
+            self.compile(selector)
+
+    def parse(self, html: bytes) -> lxml.html.HtmlElement:
+        try:
+            markup: str = html.decode('utf-8')
+        except UnicodeDecodeError:
+            markup = UnicodeDammit(html, is_html=True).unicode_markup
+        if not markup.strip():
+            return lxml.html.document_fromstring('<html></html>')
+        return lxml.html.document_fromstring(markup)
+
+    def select(self, node: lxml.html.HtmlElement, selector: str) -> list[lxml.html.HtmlElement]:
+        return self.compile(selector)(node)
+
+    def select_one(self, node: lxml.html.HtmlElement, selector: str) -> lxml.html.HtmlElement | None:
+        matches: list[lxml.html.HtmlElement] = self.compile(selector)(node)
+        return matches[0] if matches else None
+
+    def text(self, node: lxml.html.HtmlElement) -> str:
+        return str(node.text_content())
+
+    def attribute(self, node: lxml.html.HtmlElement, name: str) -> str | None:
+        return node.get(name)
+
+
+def create_parser_backend(parser_backend_type: ParserBackendType) -> ParserBackend:
+    if parser_backend_type == ParserBackendType.LXML:
+        return LxmlBackend()
+    return BeautifulSoupBackend()
+
+
+class Parser:
+    # Interns the string fields of parsed rows, for tables whose rows repeat the same strings across pages
+    INTERN_STRINGS: bool = False
+    CHARSET_PATTERN: re.Pattern[bytes] = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+    CLASS_ATTRIBUTE_PATTERN: re.Pattern[bytes] = re.compile(rb'\sclass\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+
+    def __init__(self, backend: ParserBackend | None = None, source: SourceConfiguration | None = None):
+        self.source: SourceConfiguration = source or SOURCES[0]
+        # The selectors of a source shadow the class attributes on this instance only, so parsers of other sources keep the defaults
+        for name, selector in self.source.selectors.items():
+            if isinstance(getattr(type(self), name, None), str):
+                setattr(self, name, selector)
+        self.backend: ParserBackend = backend or create_parser_backend(ApplicationConfiguration.PARSER_BACKEND)
+        self.backend.prepare(self.get_selectors())
+
+    def get_selectors(self) -> list[str]:
+        return [getattr(self, name) for name in dir(self) if name.endswith('_SELECTOR') and isinstance(getattr(self, name), str)]
+
+    def for_source(self, source: SourceConfiguration) -> 'Parser':
+        # Parsers of all sources share the backend, and through it the compiled selectors
+        return self if source is self.source else type(self)(backend=self.backend, source=source)
+
+    def for_sources(self) -> dict[str, 'Parser']:
+        return {source.name: self.for_source(source) for source in SOURCES}
+
+    def parse_row(self, *args, **kwargs) -> NamedTuple:
+        pass
+
+    def parse_data(self, *args, **kwargs) -> list[NamedTuple]:
         pass
 
+    def get_parsed_html(self, html: bytes) -> Node:
+        return self.backend.parse(html)
+
     @classmethod
-    def get_parsed_html(cls, html: str) -> BeautifulSoup:
-        return BeautifulSoup(html, 'lxml')
+    def extract_fragment(cls, html: bytes, tag_name: str, class_names: set[str]) -> bytes | None:
+        # Finds the first element with the tag name and all class names in the raw bytes
+        # and returns it as a standalone document that keeps the page's declared charset
+        tag_pattern: re.Pattern[bytes] = re.compile(rb'<(/?)' + re.escape(tag_name.encode()) + rb'\b[^>]*>', re.IGNORECASE)
+        start: int | None = None
+        depth: int = 0
+        for match in tag_pattern.finditer(html):
+            is_closing: bool = bool(match[1])
+            if start is None:
+                class_match: re.Match[bytes] | None = None if is_closing else cls.CLASS_ATTRIBUTE_PATTERN.search(match[0])
+                if class_match is not None and class_names <= set(next(group for group in class_match.groups() if group is not None).decode().split()):
+                    start, depth = match.start(), 1
+                continue
+            depth += -1 if is_closing else 1
+            if depth == 0:
+                charset_match: re.Match[bytes] | None = cls.CHARSET_PATTERN.search(html, 0, start)
+                charset: bytes = charset_match[1] if charset_match is not None else b'utf-8'
+                return b''.join([b'<html><head><meta charset="', charset, b'"></head><body>',
+                                 html[start:match.end()], b'</body></html>'])
+        return None
+
+    def select(self, node: Node, selector: str) -> list[Node]:
+        return self.backend.select(node, selector)
+
+    def select_one(self, node: Node, selector: str) -> Node | None:
+        return self.backend.select_one(node, selector)
+
+    def extract_text(self, node: Node, selector: str) -> str:
+        return self.backend.text(self.backend.select_one(node, selector)).strip()
+
+    def extract_url(self, node: Node, selector: str) -> str:
+        return ''.join([self.source.base_url, self.backend.attribute(self.backend.select_one(node, selector), 'href')])
 
     @classmethod
-    def extract_text(cls, tag: Tag, selector: str) -> str:
-        return tag.select_one(selector).text.strip()
+    def prepare_rows(cls, rows: list[T]) -> list[T]:
+        # Rows parsed in another process or restored from the journal carry their own copy of every string,
+        # interning them leaves one copy per distinct value in the sink buffers and the course index
+        if not cls.INTERN_STRINGS:
+            return rows
+        return [row._make(sys.intern(value) if type(value) is str else value for value in row) for row in rows]
+
+    def create_parse_call(self, **kwargs) -> partial:
+        parse_call: partial = partial(self.parse_data, **kwargs)
+        return partial(run_profiled, parse_call) if ApplicationConfiguration.PROFILING_ENABLED else parse_call
+
+    async def parse_page(self, iceberg_configuration: TableConfiguration, executor: Executor | None, **kwargs) -> list[NamedTuple]:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        parsed, queue_wait_seconds, parse_seconds = await loop.run_in_executor(
+            executor, partial(run_timed, self.create_parse_call(**kwargs), time.time()))
+        table: str = str(iceberg_configuration)
+        PARSE_QUEUE_WAIT_SECONDS.observe(queue_wait_seconds, table=table)
+        PARSE_SECONDS.observe(parse_seconds, table=table)
+        PAGES.inc(table=table, outcome='parsed')
+        return self.prepare_rows(parsed if isinstance(parsed, list) else [parsed])
 
     @classmethod
-    def extract_url(cls, tag: Tag, selector: str) -> str:
-        return ''.join([ApplicationConfiguration.BASE_URL, tag.select_one(selector)['href']])
+    async def restore_into(cls, sink: IcebergSink, entry: JournalEntry, row_type: Callable[..., T], committed: bool) -> list[T]:
+        # Rows of a page completed before the run was interrupted, they are only added again if their table was not committed
+        rows: list[T] = cls.prepare_rows([row_type(*values) for values in entry.rows])
+        PAGES.inc(table=sink.iceberg_configuration, outcome='resumed')
+        if not committed:
+            await sink.add_all(rows)
+        return rows
+
+    @staticmethod
+    async def commit(sink: IcebergSink, journal: Journal | None) -> int:
+        if journal is not None and journal.is_committed(sink.iceberg_configuration):
+            logging.info(f"Skipping the commit of {sink.iceberg_configuration}, it was committed before the run was interrupted")
+            return 0
+        rows_written: int = await sink.close()
+        if journal is not None:
+            journal.mark_committed(sink.iceberg_configuration)
+        return rows_written
+
+    @staticmethod
+    async def process_queue(queue: asyncio.Queue[T | None], process: Callable[[T], Coroutine[Any, Any, bool]]) -> list[T]:
+        # Processes the queue until its None sentinel, then retries the items whose process() returned False
+        # in up to FAILED_PAGES_RETRY_PASSES passes and returns the items that still failed
+        failed: list[T] = []
+
+        async def process_or_collect(item: T) -> None:
+            if not await process(item):
+                failed.append(item)
+
+        pages: BoundedTasks = BoundedTasks(ApplicationConfiguration.MAX_PAGES_IN_FLIGHT)
+        while (item := await queue.get()) is not None:
+            await pages.submit(process_or_collect(item))
+        await pages.join()
+        for retry_pass in range(1, ApplicationConfiguration.FAILED_PAGES_RETRY_PASSES + 1):
+            if not failed:
+                break
+            retrying, failed = failed, []
+            logging.info(f"Retrying {len(retrying)} failed pages, pass {retry_pass} of {ApplicationConfiguration.FAILED_PAGES_RETRY_PASSES}")
+            for item in retrying:
+                await pages.submit(process_or_collect(item))
+            await pages.join()
+        return failed
 
     @abstractmethod
-    async def run(self, session: ClientSession,
-                  ssl_context: SSLContext,
-                  iceberg_configuration: TableConfiguration,
+    async def run(self, iceberg_configuration: TableConfiguration,
                   http_client: HTTPClient,
                   iceberg_client: IcebergClient,
-                  executor: Executor | None = None) -> list[NamedTuple]:
+                  executor: Executor | None = None,
+                  journal: Journal | None = None) -> int:
         raise NotImplementedError("Subclasses must implement the run() method.")
\ No newline at end of file
@@ -1,25 +1,21 @@
-import asyncio
 import logging
-import queue
-import threading
-from asyncio import Task
+import time
 from concurrent.futures import Executor
-from functools import partial
 from http import HTTPStatus
-from queue import Queue
-from ssl import SSLContext
-from typing import NamedTuple
 
-from aiohttp import ClientSession
-from bs4 import Tag, BeautifulSoup
-
-from src.configurations import TableConfiguration
-from src.models.named_tuples import Course, CourseHeader
+from src.configurations import ApplicationConfiguration, TableConfiguration, SourceConfiguration
+from src.journal import Journal
+from src.manifest import PageManifest
+from src.metrics import PAGES
+from src.profiling import take_allocation_snapshot
+from src.models.enums import PageChangeType, WriteMode
+from src.models.named_tuples import Course, CourseHeader, JournalEntry
 from src.network import HTTPClient
-from src.parsers.base_parser import Parser
+from src.parsers.base_parser import Parser, Node, ParserBackend
 from src.parsers.curriculum_parser import CurriculumParser
 from src.corrector import CourseCorrector
-from src.storage import IcebergClient
+from src.prerequisites import update_prerequisite_graph
+from src.storage import IcebergClient, IcebergSink
 
 
 class CourseParser(Parser):
@@ -36,13 +32,20 @@ class CourseParser(Parser):
     COURSE_SEMESTER_SEASON_SELECTOR: str = 'tr:nth-child(6) > td:nth-child(2) > p:nth-child(2) > span:nth-child(2)'
     COURSE_COMPETENCE_SELECTOR: str =  'tr:nth-child(9) > td:nth-child(2) > p:nth-child(3)'
     COURSE_CONTENT_SELECTOR: str =  'tr:nth-child(10) > td:nth-child(2) > p:nth-child(3)'
-    COURSES_QUEUE: Queue = Queue()
-    COURSES_DONE_EVENT: threading.Event = threading.Event()
-    PROCESSED_COURSE_HEADERS: set[CourseHeader] = set()
+
+    def __init__(self, backend: ParserBackend | None = None, partial_parsing: bool | None = None,
+                 source: SourceConfiguration | None = None):
+        super().__init__(backend, source)
+        self.partial_parsing: bool = ApplicationConfiguration.PARTIAL_COURSE_PAGE_PARSING if partial_parsing is None else partial_parsing
+
+    def for_source(self, source: SourceConfiguration) -> 'CourseParser':
+        if source is self.source:
+            return self
+        return CourseParser(backend=self.backend, partial_parsing=self.partial_parsing, source=source)
 
     def parse_row(self, *args, **kwargs) -> Course:
         course_header: CourseHeader = kwargs.get('course_header')
-        course_table: Tag = kwargs.get('element')
+        course_table: Node = kwargs.get('element')
 
         fields: dict[str, str] = CourseCorrector.correct({
             'course_name_en': self.extract_text(course_table, self.COURSE_NAME_EN_SELECTOR),
@@ -50,7 +53,7 @@ class CourseParser(Parser):
             'course_prerequisites': self.extract_text(course_table, self.COURSE_PREREQUISITE_SELECTOR),
             'course_competence': self.extract_text(course_table, self.COURSE_COMPETENCE_SELECTOR),
             'course_content': self.extract_text(course_table, self.COURSE_CONTENT_SELECTOR),
-        })
+        }, self.source.course_codes_regex)
 
         course: Course = Course(**{**course_header._asdict(), **fields})
         logging.info(f"Scraped course {course}")
@@ -58,53 +61,111 @@ class CourseParser(Parser):
 
     def parse_data(self, *args, **kwargs) -> Course:
         course_header: CourseHeader = kwargs.get('course_header')
-        page_content: str = kwargs.get('page_content')
-        soup: BeautifulSoup = Parser.get_parsed_html(page_content)
-        course_table: Tag = soup.select_one(self.COURSE_TABLE_CLASS_NAME)
-        return self.parse_row(course_header=course_header, element=course_table)
-
-    async def run(self, session: ClientSession,
-                  ssl_context: SSLContext,
-                  iceberg_configuration: TableConfiguration,
+        page_content: bytes = kwargs.get('page_content')
+        return self.parse_row(course_header=course_header, element=self.get_course_table(page_content, course_header))
+
+    def get_course_table(self, page_content: bytes, course_header: CourseHeader) -> Node | None:
+        if self.partial_parsing:
+            tag_name, *class_names = self.COURSE_TABLE_CLASS_NAME.split('.')
+            fragment: bytes | None = self.extract_fragment(page_content, tag_name, set(class_names))
+            course_table: Node | None = None if fragment is None \
+                else self.select_one(self.get_parsed_html(fragment), self.COURSE_TABLE_CLASS_NAME)
+            if course_table is not None:
+                return course_table
+            logging.warning(f"Could not find the course table of {course_header.course_url} in the raw page, parsing the full page")
+        return self.select_one(self.get_parsed_html(page_content), self.COURSE_TABLE_CLASS_NAME)
+
+    @staticmethod
+    def skips_unchanged_pages(iceberg_configuration: TableConfiguration) -> bool:
+        return ApplicationConfiguration.SKIP_UNCHANGED_PAGES and iceberg_configuration.write_mode != WriteMode.OVERWRITE
+
+    async def crawl(self, course_header: CourseHeader, iceberg_configuration: TableConfiguration, http_client: HTTPClient,
+                    executor: Executor | None, manifest: PageManifest, skip_unchanged_pages: bool) -> JournalEntry | None:
+        # Returns the page as a journal entry, with the key of the stored row instead of rows if the page has not changed,
+        # or None when the page could not be fetched, so the caller can retry it later
+        http_status, page_content = await http_client.fetch_page(course_header.course_url)
+        if http_status != HTTPStatus.OK:
+            logging.error(
+                f"Tried to fetch {course_header.course_url} but got HTTP status: {http_status}"
+            )
+            return None
+        change_type: PageChangeType = manifest.classify(course_header.course_url, page_content)
+        content_hash: str | None = manifest.current_hash(course_header.course_url)
+        if change_type == PageChangeType.UNCHANGED and skip_unchanged_pages:
+            logging.info(f"Skipping unchanged course page {course_header.course_url}")
+            PAGES.inc(table=iceberg_configuration, outcome='unchanged')
+            row_key: str = manifest.previous_key(course_header.course_url) or course_header.course_code
+            return JournalEntry(page_url=course_header.course_url, content_hash=content_hash, row_key=row_key, rows=[])
+        courses: list[Course] = await self.parse_page(iceberg_configuration, executor, course_header=course_header,
+                                                      page_content=page_content)
+        return JournalEntry(page_url=course_header.course_url, content_hash=content_hash, row_key=None, rows=courses)
+
+    async def run(self, iceberg_configuration: TableConfiguration,
                   http_client: HTTPClient,
                   iceberg_client: IcebergClient,
-                  executor: Executor | None = None) -> list[NamedTuple]:
-        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, CurriculumParser.COURSE_HEADERS_READY_EVENT.wait)
-        tasks: list[Task[tuple[int, str, CourseHeader]]] = []
-        while True:
-            try:
-                course_header: CourseHeader = CurriculumParser.COURSE_HEADERS_QUEUE.get_nowait()
-            except queue.Empty:
-                if CurriculumParser.CURRICULA_DONE_EVENT.is_set():
-                    break
-                else:
-                    await asyncio.sleep(0.1)
-                    continue
-
-            if course_header not in self.PROCESSED_COURSE_HEADERS:
-                tasks.append(asyncio.create_task(
-                    http_client.fetch_page_wrapper(session=session,
-                                            ssl_context=ssl_context,
-                                            url=course_header.course_url,
-                                            named_tuple=course_header,
-                                            )
-                ))
-                self.PROCESSED_COURSE_HEADERS.add(course_header)
-
-        for task in asyncio.as_completed(tasks):
-            http_status, page_content, course_header = await task
-            if http_status != HTTPStatus.OK:
-                logging.error(
-                    f"Tried to fetch {course_header.course_url} but got HTTP status: {http_status}"
-                )
-                break
-            self.COURSES_QUEUE.put_nowait(
-            loop.run_in_executor(executor, partial(self.parse_data, course_header=course_header, page_content=page_content)))
-
-        self.COURSES_DONE_EVENT.set()
-        courses: list[Course] = await asyncio.gather(
-            *[self.COURSES_QUEUE.get_nowait() for _ in range(self.COURSES_QUEUE.qsize())])  # type: ignore
-        logging.info(f"Finished processing {iceberg_configuration}")
-        await iceberg_client.save_data(courses, iceberg_configuration)
-        return courses
\ No newline at end of file
+                  executor: Executor | None = None,
+                  journal: Journal | None = None) -> int:
+        start: float = time.perf_counter()
+        manifest: PageManifest = await PageManifest.load(iceberg_client, iceberg_configuration)
+        skip_unchanged_pages: bool = self.skips_unchanged_pages(iceberg_configuration)
+        sink: IcebergSink = IcebergSink(iceberg_client, iceberg_configuration)
+        first_row_parsed: bool = False
+        journaled_pages: dict[str, JournalEntry] = await journal.load(iceberg_configuration) if journal is not None else {}
+        committed: bool = journal is not None and journal.is_committed(iceberg_configuration)
+        parsers: dict[str, Parser] = self.for_sources()
+        # Prerequisites of the courses parsed in this run, the graph keeps the edges of unchanged pages
+        prerequisites: dict[tuple[str, str], str] = {}
+
+        # The manifest keeps the course code of a page, the page's source completes the key of its row
+        async def restore(course_header: CourseHeader, entry: JournalEntry) -> None:
+            manifest.classify_hash(entry.page_url, entry.content_hash)
+            if entry.row_key is not None:
+                manifest.record_key(entry.page_url, entry.row_key)
+                sink.retain((course_header.source, entry.row_key))
+                PAGES.inc(table=iceberg_configuration, outcome='resumed')
+                return
+            for course in await self.restore_into(sink, entry, Course, committed):
+                manifest.record_key(course.course_url, course.course_code)
+                prerequisites[(course.source, course.course_code)] = course.course_prerequisites
+
+        async def process(course_header: CourseHeader) -> bool:
+            entry: JournalEntry | None = journaled_pages.get(course_header.course_url)
+            if entry is not None:
+                await restore(course_header, entry)
+                return True
+            entry = await parsers[course_header.source].crawl(course_header, iceberg_configuration, http_client, executor, manifest,
+                                                              skip_unchanged_pages)
+            if entry is None:
+                return False
+            if entry.row_key is not None:
+                manifest.record_key(entry.page_url, entry.row_key)
+                sink.retain((course_header.source, entry.row_key))
+            else:
+                await sink.add_all(entry.rows)
+                nonlocal first_row_parsed
+                if not first_row_parsed:
+                    first_row_parsed = True
+                    logging.info(f"Parsed the first course row {time.perf_counter() - start:.2f} seconds after the stage started")
+                for course in entry.rows:
+                    manifest.record_key(course.course_url, course.course_code)
+                    prerequisites[(course.source, course.course_code)] = course.course_prerequisites
+            if journal is not None:
+                await journal.record(iceberg_configuration, entry.page_url, entry.rows,
+                                     content_hash=entry.content_hash, row_key=entry.row_key)
+            return True
+
+        failed_course_headers: list[CourseHeader] = await self.process_queue(CurriculumParser.COURSE_HEADERS_QUEUE, process)
+        if failed_course_headers:
+            PAGES.inc(len(failed_course_headers), table=iceberg_configuration, outcome='failed')
+            manifest.mark_incomplete()
+            sink.mark_incomplete()
+        logging.info(f"Finished processing {iceberg_configuration} with {len(failed_course_headers)} failed pages")
+        take_allocation_snapshot(f"{iceberg_configuration}-parsed")
+        rows_written: int = await self.commit(sink, journal)
+        take_allocation_snapshot(f"{iceberg_configuration}-written")
+        await manifest.save(iceberg_client)
+        manifest.report()
+        if ApplicationConfiguration.PREREQUISITE_GRAPH_ENABLED:
+            await update_prerequisite_graph(iceberg_client, CurriculumParser.COURSE_INDEX, prerequisites,
+                                            complete=not failed_course_headers)
+        return rows_written
@@ -1,30 +1,29 @@
 import asyncio
 import logging
-import queue
-import threading
-from asyncio import Task
 from concurrent.futures import Executor
-from functools import partial, reduce
+from functools import reduce
 from http import HTTPStatus
-from ssl import SSLContext
-from typing import NamedTuple
 
-from aiohttp import ClientSession
-from bs4 import Tag, BeautifulSoup
-
-from src.configurations import TableConfiguration
+from src.configurations import ApplicationConfiguration, TableConfiguration
+from src.course_index import CourseIndex
+from src.journal import Journal
+from src.metrics import PAGES
+from src.profiling import take_allocation_snapshot
 from src.models.enums import CourseType
-from src.models.named_tuples import Curriculum, StudyProgram, CourseHeader
+from src.models.named_tuples import Curriculum, StudyProgram, CourseHeader, JournalEntry
 from src.network import HTTPClient
-from src.parsers.base_parser import Parser
+from src.parsers.base_parser import Parser, Node
 from src.parsers.study_program_parser import StudyProgramParser
 from src.corrector import CourseCorrector
-from src.storage import IcebergClient
+from src.storage import IcebergClient, IcebergSink
 
 
 class CurriculumParser(Parser):
     # https://finki.ukim.mk/program/{program_name}
 
+    # Every row repeats its study program and many course names, URLs and codes repeat across programs
+    INTERN_STRINGS: bool = True
+
     MANDATORY_COURSE_SECTION_SELECTOR: str = '.col-md-6.col-sm-12'
     ELECTIVE_COURSE_SECTION_SELECTOR: str = '.col-md-12.col-sm-12'
     COURSE_SECTION_ROWS_SELECTOR: str = 'tr'
@@ -33,34 +32,26 @@ class CurriculumParser(Parser):
     COURSE_SEMESTER_SELECTOR: str = 'td:nth-child(3)'
     MANDATORY_COURSE_SEMESTER_SELECTOR: str = 'h3 > span'
 
-    COURSE_HEADERS_QUEUE: queue.Queue = queue.Queue()
-    CURRICULA_QUEUE: queue.Queue = queue.Queue()
-    CURRICULA_DONE_EVENT: asyncio.Event = asyncio.Event()
-    COURSE_HEADERS_READY_EVENT: threading.Event = threading.Event()
+    # Course headers stream to CourseParser as soon as their curriculum page is parsed, None marks the end of the stage
+    COURSE_HEADERS_QUEUE: asyncio.Queue[CourseHeader | None] = asyncio.Queue(maxsize=ApplicationConfiguration.PIPELINE_QUEUE_SIZE)
+    # Only the first reference to each course page is queued, later references are recorded in the index
+    COURSE_INDEX: CourseIndex = CourseIndex()
 
     def parse_row(self, *args, **kwargs) -> Curriculum:
 
         study_program: StudyProgram = kwargs.get('study_program')
-        course_row: Tag = kwargs.get('element')
+        course_row: Node = kwargs.get('element')
         course_type: CourseType = kwargs.get('course_type')
+        section_semester: str | None = kwargs.get('section_semester')
+        semester_cell: Node | None = self.select_one(course_row, self.COURSE_SEMESTER_SELECTOR)
 
         fields: dict[str, str | int] = CourseCorrector.correct({
             'course_code': self.extract_text(course_row, self.COURSE_CODE_SELECTOR),
             'course_name_mk': self.extract_text(course_row, self.COURSE_NAME_AND_URL_SELECTOR),
             'course_url': self.extract_url(course_row, self.COURSE_NAME_AND_URL_SELECTOR),
             'course_type': course_type,
-            'course_semester': int(self.extract_text(course_row, self.COURSE_SEMESTER_SELECTOR))
-        })
-        course_header: CourseHeader = CourseHeader(
-            course_code=fields.get('course_code'),
-            course_name_mk=fields.get('course_name_mk'),
-            course_url=fields.get('course_url'),
-        )
-
-        self.COURSE_HEADERS_QUEUE.put_nowait(course_header)
-        if not self.COURSE_HEADERS_READY_EVENT.is_set():
-            self.COURSE_HEADERS_READY_EVENT.set()
-
+            'course_semester': int(self.backend.text(semester_cell).strip() if semester_cell is not None else section_semester)
+        }, self.source.course_codes_regex)
         curriculum: Curriculum = Curriculum(**{**study_program._asdict(), **fields})
         logging.info(f"Scraped curriculum {curriculum}")
 
@@ -68,70 +59,86 @@ class CurriculumParser(Parser):
 
     def parse_data(self, *args, **kwargs) -> list[Curriculum]:
 
-        def parse_section(study_program: StudyProgram, course_type: CourseType, section: Tag) -> list[Curriculum]:
-            def filter_course_rows(row: Tag) -> bool:
-                return bool(row.select_one(self.COURSE_CODE_SELECTOR) and row.select_one(self.COURSE_NAME_AND_URL_SELECTOR))
+        def parse_section(study_program: StudyProgram, course_type: CourseType, section: Node) -> list[Curriculum]:
+            def filter_course_rows(row: Node) -> bool:
+                return (self.select_one(row, self.COURSE_CODE_SELECTOR) is not None
+                        and self.select_one(row, self.COURSE_NAME_AND_URL_SELECTOR) is not None)
 
-            def modify_course_row(row: Tag, tag_name: str, text: str) -> Tag:
-                tag: Tag = Tag(name=tag_name)
-                tag.string = text
-                row.append(tag)
-                return row
-
-            filtered_course_rows: list[Tag] = list(filter(filter_course_rows, section.select(self.COURSE_SECTION_ROWS_SELECTOR)))
-            augmented_course_rows: list[Tag] = [modify_course_row(row, 'td', self.extract_text(section, self.MANDATORY_COURSE_SEMESTER_SELECTOR))
-                                      if course_type == CourseType.MANDATORY else row for row in filtered_course_rows]
+            filtered_course_rows: list[Node] = list(filter(filter_course_rows, self.select(section, self.COURSE_SECTION_ROWS_SELECTOR)))
+            # Mandatory rows have no semester cell, the semester is the heading of their section
+            section_semester: str | None = self.extract_text(section, self.MANDATORY_COURSE_SEMESTER_SELECTOR) \
+                if course_type == CourseType.MANDATORY and filtered_course_rows else None
 
             return [
-                self.parse_row(study_program=study_program, element=course_row, course_type=course_type)
-                for course_row in augmented_course_rows
+                self.parse_row(study_program=study_program, element=course_row, course_type=course_type,
+                               section_semester=section_semester)
+                for course_row in filtered_course_rows
             ]
 
         study_program: StudyProgram = kwargs.get('study_program')
-        page_content: str = kwargs.get('page_content')
-        soup: BeautifulSoup = self.get_parsed_html(page_content)
+        page_content: bytes = kwargs.get('page_content')
+        document: Node = self.get_parsed_html(page_content)
         nested_curricula: list[list[Curriculum]] = []
 
-        for section in soup.select(self.MANDATORY_COURSE_SECTION_SELECTOR):
+        for section in self.select(document, self.MANDATORY_COURSE_SECTION_SELECTOR):
             nested_curricula.append(parse_section(study_program, CourseType.MANDATORY, section))
-        for section in soup.select(self.ELECTIVE_COURSE_SECTION_SELECTOR):
+        for section in self.select(document, self.ELECTIVE_COURSE_SECTION_SELECTOR):
             nested_curricula.append(parse_section(study_program, CourseType.ELECTIVE, section))
 
         return reduce(lambda x, y: x + y, nested_curricula)
 
-
-    async def run(self, session: ClientSession,
-                  ssl_context: SSLContext,
-                  iceberg_configuration: TableConfiguration,
+    async def crawl(self, study_program: StudyProgram, iceberg_configuration: TableConfiguration,
+                    http_client: HTTPClient, executor: Executor | None) -> list[Curriculum] | None:
+        # Returns None when the page could not be fetched, so the caller can retry it later
+        http_status, page_content = await http_client.fetch_page(study_program.study_program_url)
+        if http_status != HTTPStatus.OK:
+            logging.error(
+                f"Tried to fetch {study_program.study_program_url} but got HTTP status: {http_status}"
+            )
+            return None
+        return await self.parse_page(iceberg_configuration, executor, study_program=study_program, page_content=page_content)
+
+    async def run(self, iceberg_configuration: TableConfiguration,
                   http_client: HTTPClient,
                   iceberg_client: IcebergClient,
-                  executor: Executor | None = None) -> list[NamedTuple]:
-
-        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
-        await StudyProgramParser.STUDY_PROGRAMS_READY_EVENT.wait()
-        tasks: list[Task[tuple[int, str, StudyProgram]]] = []
-        while not StudyProgramParser.STUDY_PROGRAMS_QUEUE.empty():
-            study_program: StudyProgram = StudyProgramParser.STUDY_PROGRAMS_QUEUE.get_nowait()
-            tasks.append(asyncio.create_task(
-                    http_client.fetch_page_wrapper(session=session,
-                                    ssl_context=ssl_context,
-                                    url=study_program.study_program_url,
-                                    named_tuple=study_program,
-                                    )
-                         ))
-        for task in asyncio.as_completed(tasks):
-            http_status, page_content, study_program = await task
-            if http_status != HTTPStatus.OK:
-                logging.error(
-                    f"Tried to fetch {study_program.study_program_url} but got HTTP status: {http_status}"
-                )
-                break
-            self.CURRICULA_QUEUE.put_nowait(loop.run_in_executor(executor, partial(self.parse_data, study_program=study_program, page_content=page_content)))
-
-        nested_curricula: list[list[Curriculum]] = await asyncio.gather(
-            *[self.CURRICULA_QUEUE.get_nowait() for _ in range(self.CURRICULA_QUEUE.qsize())])  # type: ignore
-        self.CURRICULA_DONE_EVENT.set()
-        curricula: list[Curriculum] = reduce(lambda x, y: x + y, nested_curricula)
-        logging.info(f"Finished processing {iceberg_configuration}")
-        await iceberg_client.save_data(curricula, iceberg_configuration)
-        return curricula
+                  executor: Executor | None = None,
+                  journal: Journal | None = None) -> int:
+
+        sink: IcebergSink = IcebergSink(iceberg_client, iceberg_configuration)
+        journaled_pages: dict[str, JournalEntry] = await journal.load(iceberg_configuration) if journal is not None else {}
+        committed: bool = journal is not None and journal.is_committed(iceberg_configuration)
+        parsers: dict[str, Parser] = self.for_sources()
+
+        async def process(study_program: StudyProgram) -> bool:
+            entry: JournalEntry | None = journaled_pages.get(study_program.study_program_url)
+            if entry is not None:
+                curricula: list[Curriculum] = await self.restore_into(sink, entry, Curriculum, committed)
+            else:
+                curricula = await parsers[study_program.source].crawl(study_program, iceberg_configuration, http_client, executor)
+                if curricula is None:
+                    return False
+                await sink.add_all(curricula)
+                if journal is not None:
+                    await journal.record(iceberg_configuration, study_program.study_program_url, curricula)
+            # Course headers are registered for restored pages as well, the course stage needs all of them
+            for curriculum in curricula:
+                course_header: CourseHeader | None = self.COURSE_INDEX.register(curriculum)
+                if course_header is not None:
+                    await self.COURSE_HEADERS_QUEUE.put(course_header)
+            return True
+
+        self.COURSE_INDEX.clear()
+        try:
+            failed_study_programs: list[StudyProgram] = await self.process_queue(StudyProgramParser.STUDY_PROGRAMS_QUEUE, process)
+        finally:
+            await self.COURSE_HEADERS_QUEUE.put(None)
+        if failed_study_programs:
+            PAGES.inc(len(failed_study_programs), table=iceberg_configuration, outcome='failed')
+            sink.mark_incomplete()
+            self.COURSE_INDEX.complete = False
+        self.COURSE_INDEX.report()
+        logging.info(f"Finished processing {iceberg_configuration} with {len(failed_study_programs)} failed pages")
+        take_allocation_snapshot(f"{iceberg_configuration}-parsed")
+        rows_written: int = await self.commit(sink, journal)
+        take_allocation_snapshot(f"{iceberg_configuration}-written")
+        return rows_written
@@ -1,18 +1,16 @@
 import asyncio
+import hashlib
 import logging
-import queue
 from concurrent.futures import Executor
 from http import HTTPStatus
-from ssl import SSLContext
-from typing import List, NamedTuple
+from typing import List
 
-from aiohttp import ClientSession
-from bs4 import Tag, BeautifulSoup
-
-from src.configurations import ApplicationConfiguration, TableConfiguration
+from src.configurations import ApplicationConfiguration, TableConfiguration, SourceConfiguration, SOURCES
+from src.journal import Journal
+from src.metrics import PAGES
 from src.models.named_tuples import StudyProgram
 from src.network import HTTPClient
-from src.parsers.base_parser import Parser
+from src.parsers.base_parser import Parser, Node
 from src.storage import IcebergClient
 
 
@@ -24,53 +22,81 @@ class StudyProgramParser(Parser):
     STUDY_PROGRAM_NAME_SELECTOR: str = 'span:nth-child(1)'
     STUDY_PROGRAM_DURATION_SELECTOR: str = 'span:nth-child(2)'
 
-    STUDY_PROGRAMS_QUEUE: queue.Queue = queue.Queue()
-    STUDY_PROGRAMS_READY_EVENT: asyncio.Event = asyncio.Event()
+    # Study programs stream to CurriculumParser, None marks the end of the stage
+    STUDY_PROGRAMS_QUEUE: asyncio.Queue[StudyProgram | None] = asyncio.Queue(maxsize=ApplicationConfiguration.PIPELINE_QUEUE_SIZE)
+
+    @staticmethod
+    def get_study_program_id(study_program_url: str) -> int:
+        # Derived from the URL instead of assigned, so the same program gets the same id in every run and every table
+        return int.from_bytes(hashlib.blake2b(study_program_url.encode(), digest_size=8).digest(), 'big', signed=True)
 
     def parse_row(self, *args, **kwargs) -> StudyProgram:
-        study_program_row: Tag = kwargs.get('element')
+        study_program_row: Node = kwargs.get('element')
+        study_program_url: str = self.extract_url(study_program_row, self.STUDY_PROGRAM_URL_SELECTOR)
 
         study_program: StudyProgram = StudyProgram(
             study_program_name=self.extract_text(study_program_row, self.STUDY_PROGRAM_NAME_SELECTOR),
             study_program_duration=int(self.extract_text(study_program_row, self.STUDY_PROGRAM_DURATION_SELECTOR)),
-            study_program_url=self.extract_url(study_program_row, self.STUDY_PROGRAM_URL_SELECTOR)
+            study_program_url=study_program_url,
+            study_program_id=self.get_study_program_id(study_program_url),
+            source=self.source.name
         )
         logging.info(f"Scraped study_program {study_program}")
         return study_program
 
     def parse_data(self, *args, **kwargs) -> list[StudyProgram]:
-        def is_macedonian_study_program(study_program: StudyProgram) -> bool:
-            return study_program.study_program_url.endswith('mk')
+        def has_source_url_suffix(study_program: StudyProgram) -> bool:
+            return study_program.study_program_url.endswith(self.source.study_program_url_suffix)
 
-        soup: BeautifulSoup = kwargs.get('soup')
-        study_program_elements: List[Tag] = soup.select(self.STUDY_PROGRAMS_2023_LI_SELECTOR)
+        document: Node = kwargs.get('document')
+        study_program_elements: List[Node] = self.select(document, self.STUDY_PROGRAMS_2023_LI_SELECTOR)
 
         study_programs: List[StudyProgram] = [self.parse_row(element=study_program) for study_program in study_program_elements]
 
-        return list(filter(is_macedonian_study_program, study_programs))
-
-    async def run(self, session: ClientSession,
-                  ssl_context: SSLContext,
-                  iceberg_configuration: TableConfiguration,
-                  http_client: HTTPClient,
-                  iceberg_client: IcebergClient,
-                  executor: Executor | None = None) -> list[NamedTuple]:
+        return list(filter(has_source_url_suffix, study_programs))
 
-        http_status, page_content = await http_client.fetch_page(session=session,
-                                              ssl_context=ssl_context,
-                                              url=ApplicationConfiguration.STUDY_PROGRAMS_URL,
-                                              )
+    async def crawl(self, iceberg_configuration: TableConfiguration, http_client: HTTPClient) -> list[StudyProgram] | None:
+        http_status, page_content = await http_client.fetch_page(url=self.source.study_programs_url)
         if http_status != HTTPStatus.OK:
             logging.error(
-                f"Tried to fetch {ApplicationConfiguration.STUDY_PROGRAMS_URL} but got HTTP status: {http_status}"
+                f"Tried to fetch {self.source.study_programs_url} of source {self.source} but got HTTP status: {http_status}"
             )
-            return []
-        soup: BeautifulSoup = self.get_parsed_html(page_content)
-        study_programs: List[StudyProgram] = self.parse_data(soup=soup)
-        for study_program in study_programs:
-            self.STUDY_PROGRAMS_QUEUE.put_nowait(study_program)
-            if not self.STUDY_PROGRAMS_READY_EVENT.is_set():
-                self.STUDY_PROGRAMS_READY_EVENT.set()
-        logging.info(f"Finished processing {iceberg_configuration}")
-        await iceberg_client.save_data(study_programs, iceberg_configuration)
+            PAGES.inc(table=iceberg_configuration, outcome='failed')
+            return None
+        study_programs: List[StudyProgram] = self.parse_data(document=self.get_parsed_html(page_content))
+        PAGES.inc(table=iceberg_configuration, outcome='parsed')
         return study_programs
+
+    async def crawl_sources(self, iceberg_configuration: TableConfiguration,
+                            http_client: HTTPClient) -> tuple[list[StudyProgram], list[SourceConfiguration]]:
+        # The listings of all sources are fetched concurrently through the shared HTTP client,
+        # returns the study programs of all sources and the sources whose listing could not be fetched
+        crawled: list[list[StudyProgram] | None] = await asyncio.gather(
+            *(self.for_source(source).crawl(iceberg_configuration, http_client) for source in SOURCES))
+        study_programs: list[StudyProgram] = [study_program for source_study_programs in crawled
+                                              if source_study_programs is not None for study_program in source_study_programs]
+        return study_programs, [source for source, source_study_programs in zip(SOURCES, crawled) if source_study_programs is None]
+
+    async def run(self, iceberg_configuration: TableConfiguration,
+                  http_client: HTTPClient,
+                  iceberg_client: IcebergClient,
+                  executor: Executor | None = None,
+                  journal: Journal | None = None) -> int:
+
+        try:
+            study_programs, failed_sources = await self.crawl_sources(iceberg_configuration, http_client)
+            if len(failed_sources) == len(SOURCES):
+                return 0
+            for study_program in study_programs:
+                await self.STUDY_PROGRAMS_QUEUE.put(study_program)
+        finally:
+            await self.STUDY_PROGRAMS_QUEUE.put(None)
+        logging.info(f"Finished processing {iceberg_configuration} with {len(failed_sources)} failed sources")
+        if journal is not None and journal.is_committed(iceberg_configuration):
+            logging.info(f"Skipping the commit of {iceberg_configuration}, it was committed before the run was interrupted")
+            return 0
+        # The study programs of a failed source are kept by a MERGE, like the rows of failed pages
+        await iceberg_client.save_data(study_programs, iceberg_configuration, complete=not failed_sources)
+        if journal is not None:
+            journal.mark_committed(iceberg_configuration)
+        return len(study_programs)
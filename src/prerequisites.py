@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import re
+from collections import defaultdict
+from typing import NamedTuple
+
+import pyarrow as pa
+from pyiceberg.table.upsert_util import create_match_filter
+
+from src.configurations import TableConfiguration, SOURCES_BY_NAME, PREREQUISITE_EDGES, PREREQUISITE_CLOSURE
+from src.corrector import CourseCorrector
+from src.course_index import CourseIndex
+from src.models.columnar import ColumnarBuilder
+from src.models.enums import PrerequisiteResolution
+from src.models.named_tuples import PrerequisiteEdge, PrerequisitePath
+from src.storage import IcebergClient
+
+CourseKey = tuple[str, str]
+
+
+class PrerequisiteResolver:
+    # Resolves the prerequisites text of a source's courses to course codes, by the course code rule of
+    # the corrector and by the names of the courses in the course index
+
+    def __init__(self, course_index: CourseIndex, source: str):
+        self._course_codes_regex: re.Pattern[str] = SOURCES_BY_NAME[source].course_codes_regex
+        self._course_names: dict[str, str] = course_index.course_names(source)
+        # Longer names come first, so a name is not matched as the start of a longer name that contains it
+        names: list[str] = sorted(self._course_names, key=len, reverse=True)
+        self._names_pattern: re.Pattern[str] | None = re.compile(
+            r'(?<!\w)(?:' + '|'.join(map(re.escape, names)) + r')(?!\w)', re.IGNORECASE) if names else None
+
+    def resolve(self, prerequisites: str) -> dict[str, PrerequisiteResolution]:
+        resolved: dict[str, PrerequisiteResolution] = {}
+        for course_code in CourseCorrector.find_course_codes(prerequisites, self._course_codes_regex):
+            resolved.setdefault(course_code, PrerequisiteResolution.CODE)
+        if self._names_pattern is not None:
+            for match in self._names_pattern.finditer(prerequisites):
+                course_code: str | None = self._course_names.get(match[0].casefold())
+                if course_code is not None:
+                    resolved.setdefault(course_code, PrerequisiteResolution.NAME)
+        return resolved
+
+
+def resolve_edges(course_index: CourseIndex, prerequisites: dict[CourseKey, str]) -> dict[CourseKey, dict[str, str]]:
+    resolvers: dict[str, PrerequisiteResolver] = {}
+    edges: dict[CourseKey, dict[str, str]] = {}
+    for (source, course_code), text in prerequisites.items():
+        resolver: PrerequisiteResolver | None = resolvers.get(source)
+        if resolver is None:
+            resolver = resolvers[source] = PrerequisiteResolver(course_index, source)
+        # A course that names itself, e.g. in a sentence about the course, is not its own prerequisite
+        edges[(source, course_code)] = {prerequisite_code: resolved_by for prerequisite_code, resolved_by
+                                        in resolver.resolve(text or '').items() if prerequisite_code != course_code}
+    return edges
+
+
+def get_depths(graph: dict[CourseKey, set[str]], course: CourseKey) -> dict[str, int]:
+    # Breadth first, so every prerequisite gets the length of its shortest chain, and cycles end at visited courses
+    source, course_code = course
+    depths: dict[str, int] = {}
+    frontier: list[str] = [course_code]
+    depth: int = 0
+    while frontier:
+        depth += 1
+        next_frontier: list[str] = []
+        for code in frontier:
+            for prerequisite_code in graph.get((source, code), ()):
+                if prerequisite_code != course_code and prerequisite_code not in depths:
+                    depths[prerequisite_code] = depth
+                    next_frontier.append(prerequisite_code)
+        frontier = next_frontier
+    return depths
+
+
+def to_arrow(rows: list[NamedTuple], dataset: TableConfiguration) -> pa.Table:
+    arrow_schema: pa.Schema = dataset.schema.as_arrow()
+    builder: ColumnarBuilder = ColumnarBuilder(arrow_schema)
+    for row in rows:
+        builder.append(row)
+    return pa.Table.from_batches([builder.to_record_batch()], schema=arrow_schema)
+
+
+def to_filter_keys(courses: set[CourseKey]) -> pa.Table:
+    return pa.table({'source': [source for source, _ in courses], 'course_code': [course_code for _, course_code in courses]})
+
+
+def plan_update(stored_edges: pa.Table, stored_closure: pa.Table, resolved: dict[CourseKey, dict[str, str]],
+                course_index: CourseIndex | None) -> tuple[set[CourseKey], list[PrerequisiteEdge], set[CourseKey], list[PrerequisitePath]]:
+    # Returns the courses whose edges changed with their new edges, and the courses whose closure changed with their new paths
+    edges: dict[CourseKey, dict[str, str]] = defaultdict(dict)
+    for source, course_code, prerequisite_code, resolved_by in zip(*(stored_edges[column].to_pylist() for column in stored_edges.column_names)):
+        edges[(source, course_code)][prerequisite_code] = resolved_by
+    changed: set[CourseKey] = {course for course, course_edges in resolved.items() if edges.get(course, {}) != course_edges}
+    # Courses that no curriculum references anymore lose their edges, only known when every page was crawled
+    if course_index is not None:
+        changed |= {course for course in edges if course not in resolved and course_index.get(*course) is None}
+    for course in changed:
+        edges[course] = resolved.get(course, {})
+
+    # A course's closure changes when its own edges changed or when it reached a changed course through the stored closure
+    dependents: dict[CourseKey, set[CourseKey]] = defaultdict(set)
+    for source, course_code, prerequisite_code in zip(*(stored_closure[column].to_pylist()
+                                                        for column in ('source', 'course_code', 'prerequisite_code'))):
+        dependents[(source, prerequisite_code)].add((source, course_code))
+    affected: set[CourseKey] = set(changed)
+    for course in changed:
+        affected |= dependents.get(course, set())
+
+    graph: dict[CourseKey, set[str]] = {course: set(course_edges) for course, course_edges in edges.items()}
+    paths: list[PrerequisitePath] = [
+        PrerequisitePath(source=source, course_code=course_code, prerequisite_code=prerequisite_code, depth=depth)
+        for source, course_code in sorted(affected)
+        for prerequisite_code, depth in get_depths(graph, (source, course_code)).items()
+    ]
+    new_edges: list[PrerequisiteEdge] = [
+        PrerequisiteEdge(source=source, course_code=course_code, prerequisite_code=prerequisite_code, resolved_by=resolved_by)
+        for source, course_code in sorted(changed)
+        for prerequisite_code, resolved_by in edges[(source, course_code)].items()
+    ]
+    return changed, new_edges, affected, paths
+
+
+async def update_prerequisite_graph(iceberg_client: IcebergClient, course_index: CourseIndex,
+                                    prerequisites: dict[CourseKey, str], complete: bool) -> int:
+    # Runs after the course stage with the prerequisites text of the courses parsed in this run. Unchanged course pages
+    # are not parsed, their edges stay as they are, and only the rows of courses whose graph changed are replaced
+    stored_edges, stored_closure = await asyncio.gather(
+        iceberg_client.run_in_writer(lambda: iceberg_client.get_table(PREREQUISITE_EDGES).scan().to_arrow()),
+        iceberg_client.run_in_writer(lambda: iceberg_client.get_table(PREREQUISITE_CLOSURE).scan(
+            selected_fields=('source', 'course_code', 'prerequisite_code')).to_arrow()),
+    )
+    resolved: dict[CourseKey, dict[str, str]] = await asyncio.to_thread(resolve_edges, course_index, prerequisites)
+    changed, edges, affected, paths = await asyncio.to_thread(plan_update, stored_edges, stored_closure, resolved,
+                                                              course_index if complete and course_index.complete else None)
+    logging.info(f"Prerequisites of {len(resolved)} parsed courses resolved to {sum(map(len, resolved.values()))} edges, "
+                 f"{len(changed)} courses changed their edges and {len(affected)} courses their closure")
+    if not changed:
+        return 0
+    # Each table gets one commit that deletes the rows of the changed courses and adds their new rows
+    await iceberg_client.overwrite(PREREQUISITE_EDGES, to_arrow(edges, PREREQUISITE_EDGES),
+                                   create_match_filter(to_filter_keys(changed), ['source', 'course_code']))
+    await iceberg_client.overwrite(PREREQUISITE_CLOSURE, to_arrow(paths, PREREQUISITE_CLOSURE),
+                                   create_match_filter(to_filter_keys(affected), ['source', 'course_code']))
+    return len(edges) + len(paths)
@@ -0,0 +1,159 @@
+import cProfile
+import linecache
+import logging
+import os
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from multiprocessing import util
+from pathlib import Path
+from typing import Callable, Iterator, TypeVar
+
+from src.configurations import ApplicationConfiguration
+
+T = TypeVar('T')
+FunctionKey = tuple[str, int, str]
+
+# A thread can only run one cProfile profiler at a time, so entering a section pauses the enclosing section's profile
+_profiles: dict[str, cProfile.Profile] = {}
+_profiles_lock: threading.Lock = threading.Lock()
+_local: threading.local = threading.local()
+_snapshots: dict[str, tracemalloc.Snapshot] = {}
+
+
+def get_profile_directory() -> Path:
+    ApplicationConfiguration.PROFILING_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    return ApplicationConfiguration.PROFILING_DIRECTORY
+
+
+@contextmanager
+def profile_section(name: str) -> Iterator[None]:
+    if not ApplicationConfiguration.PROFILING_ENABLED:
+        yield
+        return
+    key: str = f"{name}.{os.getpid()}.{threading.current_thread().name}"
+    with _profiles_lock:
+        profile: cProfile.Profile = _profiles.setdefault(key, cProfile.Profile())
+    stack: list[cProfile.Profile] = _local.__dict__.setdefault('stack', [])
+    if stack:
+        stack[-1].disable()
+    stack.append(profile)
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        stack.pop()
+        if stack:
+            stack[-1].enable()
+
+
+# Runs in the parser executor, possibly in another process
+def run_profiled(function: Callable[[], T]) -> T:
+    with profile_section('parse'):
+        return function()
+
+
+def to_collapsed_stacks(stats: pstats.Stats) -> list[str]:
+    # cProfile only records caller/callee edges, so every stack is weighted by the share of the
+    # callee's cumulative time spent under that caller, as flame graph converters for pstats do
+    entries: dict[FunctionKey, tuple] = stats.stats
+    callees: dict[FunctionKey, dict[FunctionKey, float]] = {}
+    for function, (_, _, _, _, callers) in entries.items():
+        for caller, (_, _, _, cumulative_time) in callers.items():
+            callees.setdefault(caller, {})[function] = cumulative_time
+
+    def label(function: FunctionKey) -> str:
+        file_name, line_number, function_name = function
+        return f"{function_name} ({os.path.basename(file_name)}:{line_number})" if line_number else function_name
+
+    lines: dict[str, float] = {}
+    # Paths below a ten thousandth of the profile are dropped, which bounds the number of stacks walked
+    minimum_seconds: float = stats.total_tt / 10_000
+
+    def walk(function: FunctionKey, path: tuple[FunctionKey, ...], share: float) -> None:
+        _, _, own_time, _, _ = entries[function]
+        stack: str = ';'.join(label(frame) for frame in (*path, function))
+        lines[stack] = lines.get(stack, 0.0) + own_time * share
+        for callee, edge_time in callees.get(function, {}).items():
+            callee_cumulative_time: float = entries[callee][3]
+            if callee in path or callee == function or not callee_cumulative_time or len(path) > 128:
+                continue
+            callee_share: float = share * min(edge_time / callee_cumulative_time, 1.0)
+            if callee_cumulative_time * callee_share >= minimum_seconds:
+                walk(callee, (*path, function), callee_share)
+
+    for function, (_, _, _, cumulative_time, callers) in entries.items():
+        if not callers and cumulative_time >= minimum_seconds:
+            walk(function, (), 1.0)
+    return [f"{stack} {round(seconds * 1_000_000)}" for stack, seconds in lines.items() if round(seconds * 1_000_000) > 0]
+
+
+def write_profiles() -> None:
+    if not ApplicationConfiguration.PROFILING_ENABLED:
+        return
+    directory: Path = get_profile_directory()
+    with _profiles_lock:
+        profiles: list[tuple[str, cProfile.Profile]] = list(_profiles.items())
+        _profiles.clear()
+    for key, profile in profiles:
+        profile.create_stats()
+        if not profile.stats:
+            continue
+        stats: pstats.Stats = pstats.Stats(profile)
+        stats.dump_stats(directory / f"{key}.pstats")
+        (directory / f"{key}.collapsed").write_text('\n'.join(to_collapsed_stacks(stats)) + '\n')
+        logging.info(f"Wrote CPU profile {key} to {directory}")
+
+
+def start_allocation_tracing() -> None:
+    if ApplicationConfiguration.PROFILING_ENABLED and ApplicationConfiguration.PROFILING_TRACE_ALLOCATIONS \
+            and not tracemalloc.is_tracing():
+        tracemalloc.start(ApplicationConfiguration.PROFILING_TRACEBACK_DEPTH)
+        _snapshots['start'] = tracemalloc.take_snapshot()
+
+
+# Snapshots are only taken during the run, comparing them is slow and happens in write_allocation_reports()
+def take_allocation_snapshot(label: str) -> None:
+    if not tracemalloc.is_tracing():
+        return
+    _snapshots[label] = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    logging.info(f"Allocation snapshot {label}: {current / 2 ** 20:.1f} MiB traced, {peak / 2 ** 20:.1f} MiB peak")
+
+
+# Writes every snapshot and the allocation sites that grew the most since the previous snapshot of this process
+def write_allocation_reports() -> None:
+    if not _snapshots:
+        return
+    tracemalloc.stop()
+    directory: Path = get_profile_directory()
+    snapshots: list[tuple[str, tracemalloc.Snapshot]] = [
+        (label, snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, linecache.__file__))))
+        for label, snapshot in _snapshots.items()
+    ]
+    _snapshots.clear()
+    for (previous_label, previous), (label, snapshot) in zip(snapshots, snapshots[1:]):
+        key: str = f"{label}.{os.getpid()}"
+        snapshot.dump(str(directory / f"{key}.tracemalloc"))
+        lines: list[str] = [f"Top {ApplicationConfiguration.PROFILING_TOP_ALLOCATIONS} allocation sites at {label} compared to {previous_label}"]
+        for statistic in snapshot.compare_to(previous, 'traceback')[:ApplicationConfiguration.PROFILING_TOP_ALLOCATIONS]:
+            lines.append(str(statistic))
+            lines.extend(f"    {line}" for line in statistic.traceback.format(most_recent_first=True))
+        (directory / f"{key}.allocations.txt").write_text('\n'.join(lines) + '\n')
+    logging.info(f"Wrote {len(snapshots) - 1} allocation reports to {directory}")
+
+
+def finish_worker() -> None:
+    take_allocation_snapshot('parse-worker')
+    write_allocation_reports()
+    write_profiles()
+
+
+def initialize_worker() -> None:
+    if not ApplicationConfiguration.PROFILING_ENABLED:
+        return
+    start_allocation_tracing()
+    # Runs when the worker process exits after the pool shuts down
+    util.Finalize(None, finish_worker, exitpriority=10)
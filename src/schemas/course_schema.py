@@ -58,4 +58,11 @@ COURSE_SCHEMA = Schema(
         required=True,
         doc="A text description of the course's lectures or study plan."
     ),
+    NestedField(
+        id=9,
+        name="source",
+        field_type=StringType(),
+        required=False,
+        doc="The name of the configured source the row was scraped from, the tables are partitioned by it."
+    ),
 )
@@ -0,0 +1,40 @@
+from pyiceberg.schema import Schema
+from pyiceberg.types import StringType, IntegerType, LongType, NestedField
+
+CURRICULUM_FACT_SCHEMA = Schema(
+    NestedField(
+        id=1,
+        name="study_program_id",
+        field_type=LongType(),
+        required=True,
+        doc="The identifier of the study program, joins with study_program_id of the study programs table."
+    ),
+    NestedField(
+        id=2,
+        name="course_code",
+        field_type=StringType(),
+        required=True,
+        doc="The unique identifier code for the course, joins with course_code of the courses table."
+    ),
+    NestedField(
+        id=3,
+        name="course_semester",
+        field_type=IntegerType(),
+        required=True,
+        doc="The semester the course is offered in (range: [1, 8], depending on the study program duration)"
+    ),
+    NestedField(
+        id=4,
+        name="course_type",
+        field_type=StringType(),
+        required=True,
+        doc="The type of the course: MANDATORY or ELECTIVE."
+    ),
+    NestedField(
+        id=5,
+        name="source",
+        field_type=StringType(),
+        required=False,
+        doc="The name of the configured source the row was scraped from, the tables are partitioned by it."
+    ),
+)
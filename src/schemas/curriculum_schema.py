@@ -58,4 +58,11 @@ CURRICULUM_SCHEMA = Schema(
         required=True,
         doc="The type of the course: MANDATORY or ELECTIVE."
     ),
+    NestedField(
+        id=9,
+        name="source",
+        field_type=StringType(),
+        required=False,
+        doc="The name of the configured source the row was scraped from, the tables are partitioned by it."
+    ),
 )
@@ -0,0 +1,33 @@
+from pyiceberg.schema import Schema
+from pyiceberg.types import StringType, NestedField
+
+PAGE_MANIFEST_SCHEMA: Schema = Schema(
+    NestedField(
+        id=1,
+        name="page_url",
+        field_type=StringType(),
+        required=True,
+        doc="The URL of the scraped page."
+    ),
+    NestedField(
+        id=2,
+        name="dataset",
+        field_type=StringType(),
+        required=True,
+        doc="The name of the table the page's rows are written to."
+    ),
+    NestedField(
+        id=3,
+        name="content_hash",
+        field_type=StringType(),
+        required=True,
+        doc="The SHA-256 hex digest of the page content."
+    ),
+    NestedField(
+        id=4,
+        name="row_key",
+        field_type=StringType(),
+        required=False,
+        doc="The natural key of the row written from the page."
+    ),
+)
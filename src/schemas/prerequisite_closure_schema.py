@@ -0,0 +1,33 @@
+from pyiceberg.schema import Schema
+from pyiceberg.types import StringType, IntegerType, NestedField
+
+PREREQUISITE_CLOSURE_SCHEMA = Schema(
+    NestedField(
+        id=1,
+        name="source",
+        field_type=StringType(),
+        required=True,
+        doc="The name of the configured source of both courses, the table is partitioned by it."
+    ),
+    NestedField(
+        id=2,
+        name="course_code",
+        field_type=StringType(),
+        required=True,
+        doc="The code of the course, joins with course_code of the courses table."
+    ),
+    NestedField(
+        id=3,
+        name="prerequisite_code",
+        field_type=StringType(),
+        required=True,
+        doc="The code of a course that has to be passed before the course, directly or through other prerequisites."
+    ),
+    NestedField(
+        id=4,
+        name="depth",
+        field_type=IntegerType(),
+        required=True,
+        doc="The number of prerequisite edges on the shortest chain from the course to the prerequisite, 1 for a direct prerequisite."
+    ),
+)
@@ -0,0 +1,33 @@
+from pyiceberg.schema import Schema
+from pyiceberg.types import StringType, NestedField
+
+PREREQUISITE_EDGE_SCHEMA = Schema(
+    NestedField(
+        id=1,
+        name="source",
+        field_type=StringType(),
+        required=True,
+        doc="The name of the configured source of both courses, the table is partitioned by it."
+    ),
+    NestedField(
+        id=2,
+        name="course_code",
+        field_type=StringType(),
+        required=True,
+        doc="The code of the course whose prerequisites text was resolved, joins with course_code of the courses table."
+    ),
+    NestedField(
+        id=3,
+        name="prerequisite_code",
+        field_type=StringType(),
+        required=True,
+        doc="The code of a course that the prerequisites text refers to."
+    ),
+    NestedField(
+        id=4,
+        name="resolved_by",
+        field_type=StringType(),
+        required=True,
+        doc="How the prerequisite was found in the text: CODE or NAME."
+    ),
+)
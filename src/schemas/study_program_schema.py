@@ -1,5 +1,5 @@
 from pyiceberg.schema import Schema
-from pyiceberg.types import StringType, IntegerType, NestedField
+from pyiceberg.types import StringType, IntegerType, LongType, NestedField
 
 STUDY_PROGRAM_SCHEMA: Schema = Schema(
     NestedField(
@@ -23,4 +23,18 @@ STUDY_PROGRAM_SCHEMA: Schema = Schema(
         required=True,
         doc="The unique URL to the official study program description or page."
     ),
+    NestedField(
+        id=4,
+        name="study_program_id",
+        field_type=LongType(),
+        required=False,
+        doc="A stable identifier derived from the study program URL, referenced by the normalized curricula table."
+    ),
+    NestedField(
+        id=5,
+        name="source",
+        field_type=StringType(),
+        required=False,
+        doc="The name of the configured source the row was scraped from, the tables are partitioned by it."
+    ),
 )
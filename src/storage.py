@@ -1,20 +1,57 @@
+import asyncio
 import logging
-from typing import NamedTuple, Any
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import NamedTuple, TYPE_CHECKING, Callable, TypeVar
 
 from pyiceberg.catalog import load_catalog, Catalog
-from miniopy_async import Minio
-from pyiceberg.table import Table
+from pyiceberg.exceptions import CommitFailedException
+from pyiceberg.expressions import BooleanExpression
+from pyiceberg.table import Table, UpsertResult
+from pyiceberg.table.update.snapshot import ExpireSnapshots
+from pyiceberg.table.upsert_util import create_match_filter
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter, RetryCallState
 
 from src.configurations import StorageConfiguration, TableConfiguration
+from src.metrics import COMMIT_SECONDS, ROWS_WRITTEN, COMMIT_RETRIES
+from src.profiling import profile_section
 import pyarrow as pa
 
-from src.models.enums import FileIOType
+from src.models.columnar import ColumnarBuilder
+from src.models.enums import FileIOType, WriteMode, SinkCommitMode
+
+if TYPE_CHECKING:
+    from miniopy_async import Minio
+
+T = TypeVar('T')
+
+
+def refresh_before_retry(retry_state: RetryCallState) -> None:
+    # Another writer committed first, the next attempt reloads the table and applies the write on top of its snapshot
+    iceberg_client, iceberg_configuration = retry_state.args[:2]
+    COMMIT_RETRIES.inc(table=iceberg_configuration)
+    logging.warning(f"Commit to {iceberg_configuration} conflicted with another writer, retrying: {retry_state.outcome.exception()}")
+    iceberg_client.invalidate_table(iceberg_configuration)
+
+
+retry_commit_conflicts = retry(
+    stop=stop_after_attempt(StorageConfiguration.COMMIT_RETRY_COUNT),
+    wait=wait_exponential_jitter(initial=StorageConfiguration.COMMIT_RETRY_DELAY_SECONDS,
+                                 jitter=StorageConfiguration.COMMIT_RETRY_DELAY_SECONDS),
+    retry=retry_if_exception_type(CommitFailedException),
+    before_sleep=refresh_before_retry,
+    reraise=True
+)
 
 
 class IcebergClient:
     _instance: 'IcebergClient' = None
-    _s3_client: Minio = None
+    _s3_client: 'Minio' = None
     _catalog: Catalog = None
+    _tables: dict[str, Table] = None
+    _writer: ThreadPoolExecutor = None
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
@@ -28,7 +65,12 @@ class IcebergClient:
         self._catalog = load_catalog(
             StorageConfiguration.ICEBERG_CATALOG_NAME
         )
+        self._tables = {}
+        # Catalog round trips, Arrow conversions and Parquet writes run here instead of on the event loop
+        self._writer = ThreadPoolExecutor(max_workers=StorageConfiguration.WRITER_THREADS, thread_name_prefix='iceberg-writer')
         if self._s3_client is None and StorageConfiguration.FILE_IO_TYPE == FileIOType.S3:
+            # The MinIO client is slow to import and only needed for S3 warehouses
+            from miniopy_async import Minio
             self._s3_client = Minio(
                 endpoint=StorageConfiguration.S3_ENDPOINT_URL,
                 access_key=StorageConfiguration.S3_ACCESS_KEY,
@@ -39,25 +81,292 @@ class IcebergClient:
     def get_catalog(self) -> Catalog:
         return self._catalog
 
-    def get_s3_client(self) -> Minio | None:
+    def get_s3_client(self) -> 'Minio | None':
         return self._s3_client
 
     @classmethod
     def get_table_identifier(cls,  namespace: str, table_name: str) -> str:
         return f"{namespace}.{table_name}"
 
-    async def save_data(self, data: list[NamedTuple], iceberg_configuration: TableConfiguration) -> list[dict[str, Any]]:
-        catalog: Catalog = self.get_catalog()
+    def get_table(self, iceberg_configuration: TableConfiguration) -> Table:
+        # Committing through a Table updates its metadata, so the handle stays current until another writer commits
+        table: Table | None = self._tables.get(iceberg_configuration.table_name)
+        if table is None:
+            table = self._tables.setdefault(iceberg_configuration.table_name, self.get_catalog().load_table(
+                self.get_table_identifier(StorageConfiguration.ICEBERG_NAMESPACE, iceberg_configuration.table_name)))
+        return table
+
+    def invalidate_table(self, iceberg_configuration: TableConfiguration) -> None:
+        self._tables.pop(iceberg_configuration.table_name, None)
+
+    async def run_in_writer(self, function: Callable[..., T], *args, **kwargs) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._writer, partial(function, *args, **kwargs))
+
+    async def save_data(self, data: list[NamedTuple], iceberg_configuration: TableConfiguration,
+                        retained_keys: set[tuple] | None = None, complete: bool = True) -> int:
+        return await self.run_in_writer(self._save_data, data, iceberg_configuration, retained_keys, complete)
+
+    def _save_data(self, data: list[NamedTuple], iceberg_configuration: TableConfiguration,
+                   retained_keys: set[tuple] | None, complete: bool) -> int:
+        if iceberg_configuration.write_mode == WriteMode.MERGE:
+            data = self.deduplicate(data, iceberg_configuration.key_columns)
+        arrow_schema: pa.Schema = iceberg_configuration.schema.as_arrow()
+        builder: ColumnarBuilder = ColumnarBuilder(arrow_schema)
+        for row in data:
+            builder.append(row)
+        arrow_table: pa.Table = pa.Table.from_batches([builder.to_record_batch()], schema=arrow_schema)
+        self._save_arrow(iceberg_configuration, arrow_table, retained_keys, complete)
+        return arrow_table.num_rows
+
+    async def save_arrow(self, arrow_table: pa.Table, iceberg_configuration: TableConfiguration,
+                         retained_keys: set[tuple] | None = None, complete: bool = True) -> None:
+        await self.run_in_writer(self._save_arrow, iceberg_configuration, arrow_table, retained_keys, complete)
+
+    @retry_commit_conflicts
+    def _save_arrow(self, iceberg_configuration: TableConfiguration, arrow_table: pa.Table,
+                    retained_keys: set[tuple] | None = None, complete: bool = True) -> None:
+        table_identifier: str = self.get_table_identifier(StorageConfiguration.ICEBERG_NAMESPACE, iceberg_configuration.table_name)
+        if not arrow_table.num_rows and not (iceberg_configuration.write_mode == WriteMode.MERGE and retained_keys and complete):
+            logging.info(f"No rows to save to {table_identifier}")
+            return
+        table: Table = self.get_table(iceberg_configuration)
+        arrow_table = self.sort_for_write(arrow_table, iceberg_configuration)
+
+        logging.info(f"Saving data to {table_identifier} with schema {iceberg_configuration.schema} and {arrow_table.num_rows} rows "
+                     f"in {iceberg_configuration.write_mode} mode")
+
+        start: float = time.perf_counter()
+        with profile_section(f"write-{iceberg_configuration}"):
+            if iceberg_configuration.write_mode == WriteMode.MERGE:
+                if complete:
+                    present_keys: set[tuple] | None = self.get_keys(arrow_table, iceberg_configuration.key_columns) | (retained_keys or set())
+                else:
+                    logging.warning(f"Skipping deletes for {table_identifier} because the crawl was incomplete")
+                    present_keys = None
+                self.merge(table, arrow_table, iceberg_configuration, present_keys)
+            elif iceberg_configuration.write_mode == WriteMode.OVERWRITE:
+                table.overwrite(arrow_table)
+            else:
+                table.append(arrow_table)
+        self.record_commit(iceberg_configuration, iceberg_configuration.write_mode, start, arrow_table.num_rows)
+
+        self.log_snapshot(table, table_identifier)
+
+    async def save_batch(self, arrow_table: pa.Table, iceberg_configuration: TableConfiguration, first_batch: bool) -> None:
+        await self.run_in_writer(self._save_batch, iceberg_configuration, arrow_table, first_batch)
+
+    @retry_commit_conflicts
+    def _save_batch(self, iceberg_configuration: TableConfiguration, arrow_table: pa.Table, first_batch: bool) -> None:
+        table_identifier: str = self.get_table_identifier(StorageConfiguration.ICEBERG_NAMESPACE, iceberg_configuration.table_name)
+        table: Table = self.get_table(iceberg_configuration)
+        arrow_table = self.sort_for_write(arrow_table, iceberg_configuration)
+
+        logging.info(f"Saving batch of {arrow_table.num_rows} rows to {table_identifier} in {iceberg_configuration.write_mode} mode")
+
+        start: float = time.perf_counter()
+        with profile_section(f"write-{iceberg_configuration}"):
+            if iceberg_configuration.write_mode == WriteMode.MERGE:
+                self.merge(table, arrow_table, iceberg_configuration, None)
+            elif iceberg_configuration.write_mode == WriteMode.OVERWRITE and first_batch:
+                table.overwrite(arrow_table)
+            else:
+                table.append(arrow_table)
+        self.record_commit(iceberg_configuration, iceberg_configuration.write_mode, start, arrow_table.num_rows)
 
-        data: list[dict[str, Any]] = [row._asdict() for row in data]
+        self.log_snapshot(table, table_identifier)
+
+    async def overwrite(self, iceberg_configuration: TableConfiguration, arrow_table: pa.Table,
+                        overwrite_filter: BooleanExpression) -> None:
+        await self.run_in_writer(self._overwrite, iceberg_configuration, arrow_table, overwrite_filter)
+
+    @retry_commit_conflicts
+    def _overwrite(self, iceberg_configuration: TableConfiguration, arrow_table: pa.Table,
+                   overwrite_filter: BooleanExpression) -> None:
+        table: Table = self.get_table(iceberg_configuration)
+        arrow_table = self.sort_for_write(arrow_table, iceberg_configuration)
+        start: float = time.perf_counter()
+        with profile_section(f"write-{iceberg_configuration}"):
+            table.overwrite(arrow_table, overwrite_filter=overwrite_filter)
+        self.record_commit(iceberg_configuration, WriteMode.OVERWRITE, start, arrow_table.num_rows)
+
+    async def delete_missing_keys(self, iceberg_configuration: TableConfiguration, present_keys: set[tuple]) -> None:
+        await self.run_in_writer(self._delete_missing_keys, iceberg_configuration, present_keys)
+
+    @retry_commit_conflicts
+    def _delete_missing_keys(self, iceberg_configuration: TableConfiguration, present_keys: set[tuple]) -> None:
         table_identifier: str = self.get_table_identifier(StorageConfiguration.ICEBERG_NAMESPACE, iceberg_configuration.table_name)
-        table: Table = catalog.load_table(table_identifier)
+        table: Table = self.get_table(iceberg_configuration)
+        empty: pa.Table = iceberg_configuration.schema.as_arrow().empty_table()
+        start: float = time.perf_counter()
+        with profile_section(f"write-{iceberg_configuration}"):
+            self.merge(table, empty, iceberg_configuration, present_keys)
+        self.record_commit(iceberg_configuration, 'DELETE', start, 0)
+        self.log_snapshot(table, table_identifier)
+
+    async def compact(self, iceberg_configuration: TableConfiguration, row_filter: BooleanExpression) -> int:
+        return await self.run_in_writer(self._compact, iceberg_configuration, row_filter)
+
+    @retry_commit_conflicts
+    def _compact(self, iceberg_configuration: TableConfiguration, row_filter: BooleanExpression) -> int:
+        # The rows are read and overwritten on the same snapshot, so a conflicting commit makes the retry read them again
+        table: Table = self.get_table(iceberg_configuration)
+        arrow_table: pa.Table = self.sort_for_write(table.scan(row_filter=row_filter).to_arrow(), iceberg_configuration)
+        start: float = time.perf_counter()
+        with profile_section(f"compact-{iceberg_configuration}"):
+            table.overwrite(arrow_table, overwrite_filter=row_filter)
+        self.record_commit(iceberg_configuration, 'COMPACT', start, arrow_table.num_rows)
+        return arrow_table.num_rows
+
+    async def expire_snapshots(self, iceberg_configuration: TableConfiguration, older_than: datetime) -> int:
+        return await self.run_in_writer(self._expire_snapshots, iceberg_configuration, older_than)
+
+    @retry_commit_conflicts
+    def _expire_snapshots(self, iceberg_configuration: TableConfiguration, older_than: datetime) -> int:
+        table: Table = self.get_table(iceberg_configuration)
+        expire_snapshots: ExpireSnapshots = table.maintenance.expire_snapshots()
+        # pyiceberg 0.10 collects the snapshot ids in a set that all ExpireSnapshots instances share
+        expire_snapshots._snapshot_ids_to_expire = set()
+        expire_snapshots.older_than(older_than)
+        expired: int = len(expire_snapshots._snapshot_ids_to_expire)
+        if expired:
+            start: float = time.perf_counter()
+            expire_snapshots.commit()
+            self.record_commit(iceberg_configuration, 'EXPIRE', start, 0)
+        return expired
+
+    @staticmethod
+    def record_commit(iceberg_configuration: TableConfiguration, operation: str, start: float, rows: int) -> None:
+        COMMIT_SECONDS.observe(time.perf_counter() - start, table=iceberg_configuration, operation=operation)
+        ROWS_WRITTEN.inc(rows, table=iceberg_configuration)
+
+    @staticmethod
+    def log_snapshot(table: Table, table_identifier: str) -> None:
+        if table.current_snapshot() is not None:
+            logging.info(f"Created snapshot_id: {table.current_snapshot().snapshot_id} for table {table_identifier}")
+
+    @staticmethod
+    def sort_for_write(arrow_table: pa.Table, iceberg_configuration: TableConfiguration) -> pa.Table:
+        # pyiceberg writes rows in the order they are given, so the table's sort order is applied here
+        if not iceberg_configuration.sort_columns or arrow_table.num_rows < 2:
+            return arrow_table
+        return arrow_table.sort_by([(column, 'ascending') for column in iceberg_configuration.sort_columns])
+
+    @staticmethod
+    def get_keys(arrow_table: pa.Table, key_columns: tuple[str, ...]) -> set[tuple]:
+        return set(zip(*[arrow_table[column].to_pylist() for column in key_columns]))
+
+    @staticmethod
+    def deduplicate(data: list[NamedTuple], key_columns: tuple[str, ...]) -> list[NamedTuple]:
+        deduplicated: dict[tuple, NamedTuple] = {tuple(getattr(row, column) for column in key_columns): row for row in data}
+        if len(deduplicated) < len(data):
+            logging.warning(f"Dropped {len(data) - len(deduplicated)} rows with duplicate keys {key_columns}")
+        return list(deduplicated.values())
+
+    @staticmethod
+    def merge(table: Table, arrow_table: pa.Table, iceberg_configuration: TableConfiguration,
+              present_keys: set[tuple] | None) -> None:
+        key_columns: list[str] = list(iceberg_configuration.key_columns)
+        deleted_keys: pa.Table | None = None
+        if present_keys is not None:
+            existing_keys: pa.Table = table.scan(selected_fields=tuple(key_columns)).to_arrow()
+            deleted_keys = existing_keys.filter(pa.array(
+                [key not in present_keys for key in zip(*[existing_keys[column].to_pylist() for column in key_columns])],
+                type=pa.bool_()))
+
+        with table.transaction() as transaction:
+            rows_updated: int = 0
+            rows_inserted: int = 0
+            if arrow_table.num_rows:
+                upsert_result: UpsertResult = transaction.upsert(arrow_table, join_cols=key_columns)
+                rows_updated, rows_inserted = upsert_result.rows_updated, upsert_result.rows_inserted
+            if deleted_keys is not None and deleted_keys.num_rows:
+                transaction.delete(delete_filter=create_match_filter(deleted_keys, key_columns))
+        logging.info(f"Merged into {iceberg_configuration}: {rows_inserted} inserted, {rows_updated} updated, "
+                     f"{deleted_keys.num_rows if deleted_keys is not None else 0} deleted")
+
+
+class IcebergSink:
+
+    def __init__(self, iceberg_client: IcebergClient, iceberg_configuration: TableConfiguration):
+        self._iceberg_client: IcebergClient = iceberg_client
+        self._iceberg_configuration: TableConfiguration = iceberg_configuration
+        self._arrow_schema: pa.Schema = iceberg_configuration.schema.as_arrow()
+        self._lock: asyncio.Lock = asyncio.Lock()
+        self._builder: ColumnarBuilder = ColumnarBuilder(
+            self._arrow_schema,
+            iceberg_configuration.dictionary_columns if StorageConfiguration.SINK_COMMIT_MODE == SinkCommitMode.ONCE else ())
+        self._buffered_bytes: int = 0
+        self._batches: list[pa.RecordBatch] = []
+        self._keys: set[tuple] = set()
+        self._retained_keys: set[tuple] = set()
+        self._key_indices: tuple[int, ...] | None = None
+        self._committed_batches: int = 0
+        self._rows_written: int = 0
+        self._duplicate_rows: int = 0
+        self._complete: bool = True
+
+    @property
+    def iceberg_configuration(self) -> TableConfiguration:
+        return self._iceberg_configuration
+
+    def _key(self, row: NamedTuple) -> tuple:
+        if self._key_indices is None:
+            self._key_indices = tuple(row._fields.index(column) for column in self._iceberg_configuration.key_columns)
+        return tuple(row[index] for index in self._key_indices)
+
+    def _decode(self, batches: list[pa.RecordBatch]) -> pa.Table:
+        return pa.Table.from_batches(batches, schema=self._builder.get_schema()).cast(self._arrow_schema)
+
+    def retain(self, key: tuple) -> None:
+        self._retained_keys.add(key)
 
-        logging.info(f"Saving data to {table_identifier} with schema {iceberg_configuration.schema} and {len(data)} rows")
+    def mark_incomplete(self) -> None:
+        self._complete = False
 
-        table.append(pa.Table.from_pylist(mapping=data, schema=iceberg_configuration.schema.as_arrow()))
+    async def add(self, row: NamedTuple) -> None:
+        if self._iceberg_configuration.write_mode == WriteMode.MERGE:
+            key: tuple = self._key(row)
+            if key in self._keys:
+                self._duplicate_rows += 1
+                return
+            self._keys.add(key)
+        self._builder.append(row)
+        self._buffered_bytes += sum(len(value.encode()) for value in row if isinstance(value, str))
+        if (len(self._builder) >= StorageConfiguration.SINK_BATCH_ROWS
+                or self._buffered_bytes >= StorageConfiguration.SINK_BATCH_BYTES):
+            await self.flush()
 
-        logging.info(f"Created snapshot_id: {table.current_snapshot().snapshot_id} for table {table_identifier}")
-        return data
+    async def add_all(self, rows: list[NamedTuple]) -> None:
+        for row in rows:
+            await self.add(row)
 
+    async def flush(self) -> None:
+        async with self._lock:
+            if not len(self._builder):
+                return
+            self._buffered_bytes = 0
+            batch: pa.RecordBatch = await self._iceberg_client.run_in_writer(self._builder.build_record_batch, self._builder.detach())
+            if StorageConfiguration.SINK_COMMIT_MODE == SinkCommitMode.PER_BATCH:
+                await self._iceberg_client.save_batch(await self._iceberg_client.run_in_writer(self._decode, [batch]),
+                                                      self._iceberg_configuration, first_batch=self._committed_batches == 0)
+                self._committed_batches += 1
+            else:
+                self._batches.append(batch)
+            self._rows_written += batch.num_rows
 
+    async def close(self) -> int:
+        await self.flush()
+        if self._duplicate_rows:
+            logging.warning(f"Dropped {self._duplicate_rows} rows with duplicate keys {self._iceberg_configuration.key_columns}")
+        if StorageConfiguration.SINK_COMMIT_MODE == SinkCommitMode.ONCE:
+            await self._iceberg_client.save_arrow(await self._iceberg_client.run_in_writer(self._decode, self._batches),
+                                                  self._iceberg_configuration, retained_keys=self._retained_keys,
+                                                  complete=self._complete)
+            self._batches = []
+        elif self._iceberg_configuration.write_mode == WriteMode.MERGE and (self._keys or self._retained_keys):
+            if self._complete:
+                await self._iceberg_client.delete_missing_keys(self._iceberg_configuration, self._keys | self._retained_keys)
+            else:
+                logging.warning(f"Skipping deletes for {self._iceberg_configuration} because the crawl was incomplete")
+        logging.info(f"Wrote {self._rows_written} rows to {self._iceberg_configuration}")
+        return self._rows_written
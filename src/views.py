@@ -0,0 +1,40 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.configurations import STUDY_PROGRAMS, COURSES, CURRICULA
+from src.schemas.curriculum_schema import CURRICULUM_SCHEMA
+from src.storage import IcebergClient
+
+STUDY_PROGRAM_COLUMNS: tuple[str, ...] = ('study_program_name', 'study_program_duration', 'study_program_url')
+COURSE_COLUMNS: tuple[str, ...] = ('course_name_mk', 'course_url')
+
+
+def deduplicate(arrow_table: pa.Table, key_columns: tuple[str, ...], columns: tuple[str, ...]) -> pa.Table:
+    # APPEND tables can hold a row per run, the last one of each key wins like in IcebergClient.deduplicate
+    for key_column in key_columns:
+        arrow_table = arrow_table.filter(pc.is_valid(arrow_table[key_column]))
+    deduplicated: pa.Table = arrow_table.group_by(list(key_columns), use_threads=False).aggregate(
+        [(column, 'last') for column in columns])
+    return deduplicated.rename_columns({f"{column}_last": column for column in columns})
+
+
+def to_wide_curricula(curriculum_facts: pa.Table, study_programs: pa.Table, courses: pa.Table) -> pa.Table:
+    # Rebuilds the wide curricula shape from the normalized fact table, courses whose page could not be
+    # scraped have no row in the courses table and get a null name and URL
+    wide: pa.Table = curriculum_facts \
+        .join(deduplicate(study_programs, ('study_program_id',), STUDY_PROGRAM_COLUMNS), 'study_program_id',
+              join_type='left outer', use_threads=False) \
+        .join(deduplicate(courses, COURSES.key_columns, COURSE_COLUMNS), list(COURSES.key_columns), join_type='left outer',
+              use_threads=False)
+    arrow_schema: pa.Schema = pa.schema([field.with_nullable(True) for field in CURRICULUM_SCHEMA.as_arrow()])
+    wide = wide.select(arrow_schema.names).cast(arrow_schema)
+    return wide.sort_by([('study_program_url', 'ascending'), ('course_code', 'ascending')])
+
+
+def read_wide_curricula(iceberg_client: IcebergClient) -> pa.Table:
+    # Reads the tables of CURRICULA_LAYOUT=NORMALIZED in the shape of the CURRICULA_LAYOUT=WIDE curricula table
+    curriculum_facts: pa.Table = iceberg_client.get_table(CURRICULA).scan().to_arrow()
+    study_programs: pa.Table = iceberg_client.get_table(STUDY_PROGRAMS).scan(
+        selected_fields=('study_program_id', *STUDY_PROGRAM_COLUMNS)).to_arrow()
+    courses: pa.Table = iceberg_client.get_table(COURSES).scan(selected_fields=(*COURSES.key_columns, *COURSE_COLUMNS)).to_arrow()
+    return to_wide_curricula(curriculum_facts, study_programs, courses)
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import NamedTuple, Iterator
+
+from src.models.enums import ShardState
+from src.models.named_tuples import Shard
+
+
+class WorkQueue:
+    # Shards of pages that sharded workers claim with a lease. Workers renew the lease while they work on a shard,
+    # the shard of a worker that crashed is claimed again by another worker once its lease expires
+    SCHEMA: str = '''
+        CREATE TABLE IF NOT EXISTS stages (
+            stage TEXT PRIMARY KEY,
+            planned_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS shards (
+            stage TEXT NOT NULL,
+            shard INTEGER NOT NULL,
+            items TEXT NOT NULL,
+            state TEXT NOT NULL,
+            worker TEXT,
+            leased_until REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (stage, shard)
+        );
+        CREATE INDEX IF NOT EXISTS shards_state ON shards (state);
+    '''
+
+    def __init__(self, file_path: Path):
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # Transactions are explicit, claiming a shard must read and lease it in one write transaction across processes
+        self._connection: sqlite3.Connection = sqlite3.connect(file_path, check_same_thread=False, timeout=30,
+                                                               isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(self.SCHEMA)
+        self._lock: threading.Lock = threading.Lock()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        self._connection.execute('COMMIT')
+
+    def _plan(self, stage: str, items: list[NamedTuple], shard_size: int) -> int:
+        shards: list[list[NamedTuple]] = [items[start:start + shard_size] for start in range(0, len(items), shard_size)]
+        with self._lock, self._transaction():
+            if self._connection.execute('SELECT 1 FROM stages WHERE stage = ?', (stage,)).fetchone() is not None:
+                return 0
+            self._connection.executemany(
+                'INSERT INTO shards (stage, shard, items, state) VALUES (?, ?, ?, ?)',
+                [(stage, shard, json.dumps(shard_items, ensure_ascii=False), ShardState.PENDING)
+                 for shard, shard_items in enumerate(shards)]
+            )
+            self._connection.execute('INSERT INTO stages (stage, planned_at) VALUES (?, ?)', (stage, time.time()))
+        logging.info(f"Planned {len(shards)} shards with {len(items)} pages for {stage}")
+        return len(shards)
+
+    def _claim(self, worker: str, lease_seconds: float, max_attempts: int) -> Shard | None:
+        with self._lock, self._transaction():
+            now: float = time.time()
+            # An expired lease after the last attempt means the shard keeps crashing its workers
+            exhausted: int = self._connection.execute(
+                'UPDATE shards SET state = ?, worker = NULL, leased_until = NULL WHERE state = ? AND leased_until < ? AND attempts >= ?',
+                (ShardState.FAILED, ShardState.LEASED, now, max_attempts)
+            ).rowcount
+            row: tuple | None = self._connection.execute(
+                'SELECT stage, shard, items, state, worker, attempts FROM shards '
+                'WHERE state = ? OR (state = ? AND leased_until < ?) ORDER BY rowid LIMIT 1',
+                (ShardState.PENDING, ShardState.LEASED, now)
+            ).fetchone()
+            if row is not None:
+                self._connection.execute(
+                    'UPDATE shards SET state = ?, worker = ?, leased_until = ?, attempts = attempts + 1 WHERE stage = ? AND shard = ?',
+                    (ShardState.LEASED, worker, now + lease_seconds, row[0], row[1])
+                )
+        if exhausted:
+            logging.warning(f"Marked {exhausted} shards as failed after {max_attempts} attempts")
+        if row is None:
+            return None
+        stage, shard, items, state, previous_worker, attempts = row
+        if state == ShardState.LEASED:
+            logging.warning(f"Reclaimed shard {shard} of {stage} from {previous_worker}, its lease expired")
+        return Shard(stage=stage, shard=shard, items=json.loads(items), attempts=attempts + 1)
+
+    def _renew(self, shard: Shard, worker: str, lease_seconds: float) -> bool:
+        with self._lock:
+            return self._connection.execute(
+                'UPDATE shards SET leased_until = ? WHERE stage = ? AND shard = ? AND worker = ? AND state = ?',
+                (time.time() + lease_seconds, shard.stage, shard.shard, worker, ShardState.LEASED)
+            ).rowcount == 1
+
+    def _finish(self, shard: Shard, worker: str, state: ShardState) -> bool:
+        with self._lock:
+            return self._connection.execute(
+                'UPDATE shards SET state = ?, worker = NULL, leased_until = NULL WHERE stage = ? AND shard = ? AND worker = ? AND state = ?',
+                (state, shard.stage, shard.shard, worker, ShardState.LEASED)
+            ).rowcount == 1
+
+    async def plan(self, stage: str, items: list[NamedTuple], shard_size: int) -> int:
+        return await asyncio.to_thread(self._plan, stage, items, shard_size)
+
+    async def claim(self, worker: str, lease_seconds: float, max_attempts: int) -> Shard | None:
+        return await asyncio.to_thread(self._claim, worker, lease_seconds, max_attempts)
+
+    async def renew(self, shard: Shard, worker: str, lease_seconds: float) -> bool:
+        return await asyncio.to_thread(self._renew, shard, worker, lease_seconds)
+
+    async def complete(self, shard: Shard, worker: str) -> bool:
+        return await asyncio.to_thread(self._finish, shard, worker, ShardState.DONE)
+
+    # Returns the shard to the queue for another attempt, or fails it after its last attempt
+    async def release(self, shard: Shard, worker: str, max_attempts: int) -> ShardState:
+        state: ShardState = ShardState.FAILED if shard.attempts >= max_attempts else ShardState.PENDING
+        await asyncio.to_thread(self._finish, shard, worker, state)
+        return state
+
+    def planned_stages(self) -> set[str]:
+        with self._lock:
+            return {stage for stage, in self._connection.execute('SELECT stage FROM stages')}
+
+    def status(self) -> dict[str, dict[ShardState, int]]:
+        status: dict[str, dict[ShardState, int]] = {stage: {state: 0 for state in ShardState} for stage in self.planned_stages()}
+        with self._lock:
+            for stage, state, count in self._connection.execute('SELECT stage, state, COUNT(*) FROM shards GROUP BY stage, state'):
+                status[stage][ShardState(state)] = count
+        return status
+
+    def is_finished(self, stages: list[str]) -> bool:
+        status: dict[str, dict[ShardState, int]] = self.status()
+        return all(stage in status and not status[stage][ShardState.PENDING] and not status[stage][ShardState.LEASED]
+                   for stage in stages)
+
+    def retried_shards(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM shards WHERE attempts > 1').fetchone()[0]
+
+    def clear(self) -> None:
+        with self._lock, self._transaction():
+            self._connection.execute('DELETE FROM shards')
+            self._connection.execute('DELETE FROM stages')
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()